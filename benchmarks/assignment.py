@@ -0,0 +1,42 @@
+import sys
+import random
+from timeit import default_timer
+from heartrunner.types import Patient
+from heartrunner.assignment import solve, greedy
+from .synthetic import grid_network, random_runners
+
+# Joint dispatch for concurrent incidents against the greedy baseline, on
+# patients close enough together to compete for runners and AEDs. Run from
+# the repository root with:
+#   pipenv run python -m benchmarks.assignment [runners] [patients] [budget ms]
+
+
+if __name__ == "__main__":
+    n_runners = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_patients = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    budget = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.05
+
+    network = grid_network(40, seed=0)
+    rng = random.Random(1)
+    side = 40
+    center = [network.ids[r * side + c] for r in range(15, 25) for c in range(15, 25)]
+    patients = [Patient(id=i + 1, intersection_id=rng.choice(center)) for i in range(n_patients)]
+    pf = network.pathfinders(patients)[0]
+    for runner in random_runners(network, n_runners, seed=2):
+        pf.add_runner(runner)
+
+    time1 = default_timer()
+    tasks = pf.calculate_tasks_batch(patients, n_runners=20, n_aeds=3)
+    routing = default_timer() - time1
+
+    plan = solve(patients, tasks, budget=budget)
+    baseline = greedy(patients, tasks)
+
+    for name, p in (("assignment", plan), ("greedy", baseline)):
+        runners = [d.runner.id for d in p.dispatches]
+        aeds = [d.aed.id for d in p.dispatches if d.aed is not None]
+        assert len(runners) == len(set(runners)) and len(aeds) == len(set(aeds))
+        print(f"{name:12} latency {p.latency:9.1f}s  unfilled roles {p.unassigned:3}  "
+              f"{p.elapsed * 1000:7.2f} ms{'  (within budget)' if p.exact else ''}")
+    print(f"{'routing':12} {routing * 1000:.1f} ms for {n_patients} patients")
+    print(f"objective    {plan.objective:.1f}s against {baseline.objective:.1f}s greedy")
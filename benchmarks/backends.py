@@ -0,0 +1,85 @@
+import sys
+import random
+import tracemalloc
+import networkx as nx
+from timeit import default_timer
+from heartrunner.pathfinder import Pathfinder, NetworkxBackend, ArrayBackend
+from heartrunner.memory import MemoryHeartrunnerDB
+from heartrunner.database import _projected_pathfinder_from_records
+from .synthetic import grid_network
+from .landmarks import percentiles
+
+# Graph backends of Pathfinder side by side on the same subgraphs and
+# queries: memory per subgraph and search latency. Their parity with
+# networkx is checked in tests/test_backends.py. Run from the repository
+# root with:
+#   pipenv run python -m benchmarks.backends [side] [patients] [queries]
+
+BACKENDS = {"networkx": NetworkxBackend, "array": ArrayBackend}
+
+
+def graph_memory(backend, pf: Pathfinder):
+    # Bytes held by a backend holding pf's streets
+    tracemalloc.start()
+    graph = backend()
+    for node in pf.get_nodes():
+        graph.add_node(node.id, node.coords())
+    for edge in pf.get_edges():
+        graph.add_edge(edge.source.id, edge.target.id, edge.id, edge.length)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def latencies(tasks):
+    return sorted(
+        (task.runner.id, round(task.patient_latency, 6), tuple(round(l, 6) for l in task.aed_latencies))
+        for task in tasks
+    )
+
+
+if __name__ == "__main__":
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    n_patients = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    n_queries = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    db = MemoryHeartrunnerDB(grid_network(side, seed=0))
+    db.generate_runners(len(db.store) // 20, seed=1)
+    rng = random.Random(2)
+
+    times = {name: {"build": [], "astar": [], "dijkstra": []} for name in BACKENDS}
+    memory = {name: [] for name in BACKENDS}
+    checked = 0
+    for patient in db.generate_patients(n_patients, seed=3):
+        limits = db.limits(patient)
+        records = db.fetch_subgraph(limits)
+        pfs = {}
+        for name, backend in BACKENDS.items():
+            time1 = default_timer()
+            pfs[name] = _projected_pathfinder_from_records(
+                *records, limits, patient, pf=Pathfinder(patient, graph=backend()))
+            times[name]["build"].append(default_timer() - time1)
+            memory[name].append(graph_memory(backend, pfs[name]))
+
+        nodes = pfs["networkx"].get_nodes()
+        queries = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(n_queries)]
+        for name, pf in pfs.items():
+            for source, target in queries:
+                time1 = default_timer()
+                try:
+                    pf._to_path(pf._astar(source, target))
+                except nx.NetworkXNoPath:
+                    continue
+                times[name]["astar"].append(default_timer() - time1)
+            time1 = default_timer()
+            pf._dijkstra(pf.get_node(patient.intersection_id))
+            times[name]["dijkstra"].append(default_timer() - time1)
+        checked += len(queries)
+    print(f"{checked} routes and {n_patients} trees per backend")
+
+    for name in BACKENDS:
+        kib = sum(memory[name]) / len(memory[name]) / 1024
+        print(f"{name:>10}: graph {kib:8.1f} KiB per subgraph")
+        for phase, samples in times[name].items():
+            p = percentiles(samples)
+            print(f"{'':>12}{phase:>9}: " + "  ".join(f"{k} {v * 1e3:8.3f}ms" for k, v in p.items()))
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import math
+import inspect
+import argparse
+import platform
+from timeit import default_timer
+from heartrunner.types import *
+from heartrunner.network import RoadNetwork, INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH, AEDS_CSV_PATH
+from heartrunner.memory import MemoryHeartrunnerDB
+from heartrunner.database import _projected_pathfinder_from_records
+from .synthetic import grid_network, planar_network
+from .landmarks import percentiles
+
+# Per phase latency of the dispatch hot path, on seeded synthetic cities and
+# on the DC network when data/csv/streetsegments.csv exists, served by the
+# in-memory backend. Run from the repository root with:
+#   pipenv run python -m benchmarks.dispatch run --scales 1k,10k,100k -o new.json
+#   pipenv run python -m benchmarks.dispatch compare old.json new.json
+# Every incident is timed in phases:
+#   fetch       subgraph records for the patient's box
+#   build       pathfinder from the records
+#   candidates  runner and AED candidate selection
+#   astar       A* searches
+#   search      Dijkstra trees and detours, instead of astar with --mode multi
+#   assembly    the rest of calculate_tasks, paths and Task objects
+#   total       all of the above
+
+SCALES = {"1k": 32, "10k": 100, "100k": 316, "1m": 1000}
+PHASES = ["fetch", "build", "candidates", "astar", "search", "assembly", "total"]
+# Methods timed during calculate_tasks, by mode
+TIMED = {
+    "astar": [("_closest_aeds", "candidates"), ("_astar", "astar")],
+    "multi": [("_tree", "search"), ("_runner_detours", "search"), ("_aed_detours", "search")]
+}
+
+
+class PhaseTimer:
+    # Wraps methods of one object so their time is added to a phase.
+    # Generators are timed across every item they yield
+
+    def __init__(self):
+        self.totals = {}
+
+    def wrap(self, obj, name: str, phase: str):
+        method = getattr(obj, name)
+        totals = self.totals
+
+        def timed(*args, **kwargs):
+            time1 = default_timer()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                totals[phase] = totals.get(phase, 0.0) + default_timer() - time1
+
+        def timed_generator(*args, **kwargs):
+            iterator = method(*args, **kwargs)
+            while True:
+                time1 = default_timer()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    totals[phase] = totals.get(phase, 0.0) + default_timer() - time1
+                yield item
+
+        setattr(obj, name, timed_generator if inspect.isgeneratorfunction(method) else timed)
+
+    def pop(self, phase: str):
+        return self.totals.pop(phase, 0.0)
+
+
+def city(name: str, seed: int):
+    if name == "dc":
+        return RoadNetwork.from_csv(INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH, AEDS_CSV_PATH)
+    kind, scale = name.split("-")
+    generate = {"grid": grid_network, "planar": planar_network}[kind]
+    return generate(SCALES[scale], seed=seed)
+
+
+def run_incident(db: MemoryHeartrunnerDB, patient: Patient, args):
+    samples = {}
+    time0 = default_timer()
+    limits = db.limits(patient, args.kilometers)
+    streets, aeds, runners = db.fetch_subgraph(limits)
+    time1 = default_timer()
+    pf = _projected_pathfinder_from_records(streets, aeds, runners, limits, patient)
+    time2 = default_timer()
+    samples["fetch"] = time1 - time0
+    samples["build"] = time2 - time1
+
+    timer = PhaseTimer()
+    for name, phase in TIMED[args.mode]:
+        timer.wrap(pf, name, phase)
+    if args.mode == "astar":
+        timer.wrap(pf._runner_index, "iter_nearest", "candidates")
+    time3 = default_timer()
+    pf.calculate_tasks(
+        n_runners=args.n_runners, n_aeds=args.n_aeds, multi_target=args.mode == "multi")
+    route = default_timer() - time3
+    timed = {phase for _, phase in TIMED[args.mode]}
+    for phase in timed:
+        samples[phase] = timer.pop(phase)
+    samples["assembly"] = route - sum(samples[phase] for phase in timed)
+    samples["total"] = time2 - time0 + route
+    return samples
+
+
+def run_city(name: str, args):
+    time1 = default_timer()
+    network = city(name, args.seed)
+    db = MemoryHeartrunnerDB(network)
+    n_runners = args.runners if args.runners else max(100, len(network) // 20)
+    db.generate_runners(n_runners, seed=args.seed + 1)
+    patients = db.generate_patients(args.incidents, seed=args.seed + 2)
+    setup = default_timer() - time1
+
+    samples = {}
+    for patient in patients:
+        for phase, elapsed in run_incident(db, patient, args).items():
+            samples.setdefault(phase, []).append(elapsed * 1e3)
+    return {
+        "intersections": len(network),
+        "streets": len(network.targets) // 2,
+        "aeds": len(network.aeds),
+        "runners": n_runners,
+        "setup_s": setup,
+        "phases_ms": {
+            phase: {**percentiles(samples[phase]), "mean": sum(samples[phase]) / len(samples[phase])}
+            for phase in PHASES if phase in samples
+        }
+    }
+
+
+def run(args):
+    cities = [f"{kind}-{scale}" for scale in args.scales.split(",") for kind in args.kinds.split(",")]
+    if os.path.exists(STREETS_CSV_PATH):
+        cities.insert(0, "dc")
+    else:
+        print(f"{STREETS_CSV_PATH} not found, skipping the DC network", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "mode": args.mode,
+            "seed": args.seed,
+            "incidents": args.incidents,
+            "n_runners": args.n_runners,
+            "n_aeds": args.n_aeds,
+            "kilometers": args.kilometers
+        },
+        "results": {}
+    }
+    for name in cities:
+        result = report["results"][name] = run_city(name, args)
+        print(f"{name}: {result['intersections']} intersections, setup {result['setup_s']:.1f}s")
+        for phase, p in result["phases_ms"].items():
+            print(f"  {phase:>10}: " + "  ".join(f"{k} {v:8.3f}ms" for k, v in p.items()))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+def compare(args):
+    # A phase regresses when a percentile grows by more than the threshold
+    # and by more than the floor, which keeps sub-millisecond noise out
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+    if baseline["meta"] != candidate["meta"]:
+        print("warning: runs were made with different settings", file=sys.stderr)
+
+    regressions = 0
+    for name, result in candidate["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        print(name)
+        for phase, p in result["phases_ms"].items():
+            if phase not in old["phases_ms"]:
+                continue
+            cells = []
+            flagged = False
+            for key in ("p50", "p95", "p99"):
+                before, after = old["phases_ms"][phase][key], p[key]
+                change = (after - before) / before if before > 0 else (math.inf if after > 0 else 0.0)
+                if change > args.threshold and after - before > args.floor:
+                    flagged = True
+                cells.append(f"{key} {before:8.3f} -> {after:8.3f}ms ({change:+6.1%})")
+            regressions += flagged
+            print(f"  {'!' if flagged else ' '} {phase:>10}: " + "  ".join(cells))
+    print(f"{regressions} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.dispatch")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--scales", default="1k,10k,100k", help=f"of {','.join(SCALES)}")
+    run_parser.add_argument("--kinds", default="grid,planar")
+    run_parser.add_argument("--mode", choices=list(TIMED), default="astar")
+    run_parser.add_argument("--incidents", type=int, default=200)
+    run_parser.add_argument("--runners", type=int, default=0, help="default one per 20 intersections")
+    run_parser.add_argument("--n-runners", type=int, default=20)
+    run_parser.add_argument("--n-aeds", type=int, default=3)
+    run_parser.add_argument("--kilometers", type=float, default=1)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("-o", "--output")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+    compare_parser.add_argument("--floor", type=float, default=0.05, help="milliseconds")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
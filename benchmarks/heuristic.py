@@ -0,0 +1,43 @@
+import csv
+import random
+from timeit import timeit
+from geopy.distance import great_circle
+from heartrunner.types import Intersection
+from heartrunner.pathfinder import heuristic
+from heartrunner.spatial import HaversineHeuristic
+from heartrunner.network import INTERSECTIONS_CSV_PATH
+
+# Per call cost of the A* heuristic, run from the repository root with:
+#   pipenv run python -m benchmarks.heuristic
+
+
+def geopy_heuristic(node_a: Intersection, node_b: Intersection):
+    return great_circle(node_a.coords(), node_b.coords()).meters
+
+
+if __name__ == "__main__":
+    with open(INTERSECTIONS_CSV_PATH, "r") as intersections_file:
+        nodes = [
+            Intersection(id=int(row["id"]), coords=(float(row["latitude"]), float(row["longitude"])))
+            for row in csv.DictReader(intersections_file)
+        ]
+    rng = random.Random(0)
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(10000)]
+    prepared = HaversineHeuristic()
+    for a, b in pairs:
+        prepared(a, b)
+
+    # Never above the old estimate, which used the mean earth radius
+    assert all(prepared(a, b) <= geopy_heuristic(a, b) for a, b in pairs)
+
+    def per_call(fn):
+        return timeit(lambda: [fn(a, b) for a, b in pairs], number=5) / (5 * len(pairs))
+
+    target = nodes[0]
+    batch = [b for _, b in pairs]
+    batched = timeit(lambda: prepared.distances(target, batch), number=5) / (5 * len(batch))
+
+    print(f"{'geopy great_circle':24} {per_call(geopy_heuristic) * 1e6:8.3f} us/call")
+    print(f"{'heuristic()':24} {per_call(heuristic) * 1e6:8.3f} us/call")
+    print(f"{'HaversineHeuristic':24} {per_call(prepared) * 1e6:8.3f} us/call")
+    print(f"{'HaversineHeuristic batch':24} {batched * 1e6:8.3f} us/call")
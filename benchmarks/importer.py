@@ -0,0 +1,54 @@
+import os
+import sys
+import random
+import resource
+import tempfile
+import geojson_length
+from timeit import default_timer
+from heartrunner.util import parse_geojson, iter_features, street_length
+from .synthetic import write_streets_geojson
+
+# Throughput of the GeoJSON -> CSV import. The DC streets file is not
+# bundled, so a synthetic city of side x side intersections stands in for it
+# unless a streets file is given. Run from the repository root with:
+#   pipenv run python -m benchmarks.importer [side | streets.geojson]
+
+AEDS_GEOJSON_PATH = "data/geojson/wdc_aeds.geojson"
+
+
+if __name__ == "__main__":
+    argument = sys.argv[1] if len(sys.argv) > 1 else "300"
+    with tempfile.TemporaryDirectory() as directory:
+        if os.path.exists(argument):
+            streets_path = argument
+        else:
+            streets_path = os.path.join(directory, "streets.geojson")
+            write_streets_geojson(streets_path, int(argument))
+
+        # Lengths agree with geojson_length, which the old importer used
+        rng = random.Random(0)
+        sample = [f for f in iter_features(streets_path) if rng.random() < 0.01][:500]
+        error = max(
+            abs(street_length(f["geometry"]) - geojson_length.calculate_distance(f))
+            for f in sample
+        )
+
+        size = os.path.getsize(streets_path)
+        time1 = default_timer()
+        counts = parse_geojson(
+            streets_path,
+            AEDS_GEOJSON_PATH,
+            intersections_csv=os.path.join(directory, "intersections.csv"),
+            streets_csv=os.path.join(directory, "streetsegments.csv"),
+            aeds_csv=os.path.join(directory, "aeds.csv")
+        )
+        elapsed = default_timer() - time1
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"input          {size / 2**20:8.1f} MiB")
+    for name, count in counts.items():
+        print(f"{name:14} {count:8}")
+    print(f"elapsed        {elapsed:8.2f} s")
+    print(f"throughput     {counts['features'] / elapsed:8.0f} features/s, {size / 2**20 / elapsed:.1f} MiB/s")
+    print(f"peak rss       {peak:8.1f} MiB")
+    print(f"length error   {error * 1000:8.4f} mm (max vs geojson_length)")
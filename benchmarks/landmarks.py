@@ -0,0 +1,72 @@
+import os
+import sys
+import random
+import tempfile
+import statistics
+from timeit import default_timer
+from heartrunner.network import RoadNetwork, INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH
+from heartrunner.landmarks import Landmarks, dijkstra
+from .synthetic import grid_network
+
+# Preprocessing time, index size and query latency of the ALT index against
+# plain Dijkstra, run from the repository root with:
+#   pipenv run python -m benchmarks.landmarks [landmarks] [queries]
+# Uses the DC network when data/csv/streetsegments.csv exists, otherwise a
+# synthetic city of a similar size.
+
+
+def percentiles(samples: list[float]):
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": q[49], "p95": q[94], "p99": q[98]}
+
+
+def path_length(network: RoadNetwork, path: list[int]):
+    length = 0.0
+    for i, j in zip(path, path[1:]):
+        length += min(
+            network.lengths[slot]
+            for slot in range(network.offsets[i], network.offsets[i+1])
+            if network.targets[slot] == j
+        )
+    return length
+
+
+if __name__ == "__main__":
+    n_landmarks = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    if os.path.exists(STREETS_CSV_PATH):
+        network = RoadNetwork.from_csv(INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH, None)
+    else:
+        network = grid_network(144, seed=0)
+    print(f"network: {len(network)} intersections, {len(network.targets) // 2} streets")
+
+    time1 = default_timer()
+    landmarks = Landmarks.build(network, n=n_landmarks)
+    print(f"preprocessing: {default_timer() - time1:.2f}s for {len(landmarks.landmarks)} landmarks")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "landmarks.bin")
+        landmarks.save(path)
+        print(f"index size: {os.path.getsize(path) / 2**20:.2f} MiB")
+        landmarks = Landmarks.load(path, network)
+
+    rng = random.Random(1)
+    alt_times, dijkstra_times = [], []
+    for _ in range(n_queries):
+        source, target = rng.randrange(len(network)), rng.randrange(len(network))
+
+        time1 = default_timer()
+        expected = dijkstra(network, [source])[target]
+        dijkstra_times.append(default_timer() - time1)
+
+        time1 = default_timer()
+        path = landmarks.astar(source, target)
+        alt_times.append(default_timer() - time1)
+
+        # float32 street lengths are summed in another order
+        assert abs(path_length(network, path) - expected) < 1e-3 * max(1.0, expected)
+
+    for name, samples in (("dijkstra", dijkstra_times), ("alt", alt_times)):
+        p = percentiles(samples)
+        print(f"{name:>10}: " + "  ".join(f"{k} {v * 1e3:8.3f}ms" for k, v in p.items()))
@@ -0,0 +1,51 @@
+import sys
+from timeit import default_timer
+from heartrunner.parallel import ParallelPathfinder
+from .synthetic import grid_network, random_runners, random_patients
+
+# Scaling of ParallelPathfinder over worker counts on a synthetic city, run
+# from the repository root with:
+#   pipenv run python -m benchmarks.parallel [side] [patients] [max workers]
+
+
+def signature(tasks):
+    return [
+        (task.runner.id, [s.id for s in task.patient_path.streets],
+         [(p.aed.id, [s.id for s in p.streets]) for p in task.aed_paths])
+        for task in tasks
+    ]
+
+
+if __name__ == "__main__":
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    n_patients = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    network = grid_network(side, seed=0)
+    patients = random_patients(network, n_patients, seed=1)
+    pf = network.pathfinders(patients)[0]
+    for runner in random_runners(network, len(network) // 5, seed=2):
+        pf.add_runner(runner)
+
+    def run_serial():
+        return [
+            pf.for_patient(patient).calculate_tasks(n_runners=20, n_aeds=3, multi_target=True)
+            for patient in patients
+        ]
+
+    # First run materialises the view's nodes, which the workers then inherit
+    run_serial()
+    time1 = default_timer()
+    serial = run_serial()
+    baseline = default_timer() - time1
+    print(f"{'serial':>10} {baseline:8.3f}s")
+
+    workers = 1
+    while workers <= max_workers:
+        with ParallelPathfinder(pf, workers=workers) as parallel:
+            time1 = default_timer()
+            results = parallel.calculate_tasks_batch(patients, n_runners=20, n_aeds=3)
+            elapsed = default_timer() - time1
+        assert [signature(t) for t in results] == [signature(t) for t in serial]
+        print(f"{workers:>10} {elapsed:8.3f}s  speedup {baseline / elapsed:5.2f}x")
+        workers *= 2
@@ -0,0 +1,44 @@
+import sys
+import random
+from timeit import default_timer
+from .synthetic import grid_network, random_runners, random_patients
+from .parallel import signature
+
+# Live runner location updates on a hot pathfinder, run from the
+# repository root with:
+#   pipenv run python -m benchmarks.runners [side] [runners] [updates]
+
+
+if __name__ == "__main__":
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    n_runners = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    n_updates = int(sys.argv[3]) if len(sys.argv) > 3 else 100_000
+
+    network = grid_network(side, seed=0)
+    patient = random_patients(network, 1, seed=1)[0]
+    runners = random_runners(network, n_runners, seed=2)
+    pf = network.pathfinder(patient, kilometers=3)
+    for runner in runners:
+        pf.add_runner(runner)
+    pf.calculate_tasks(n_runners=20, n_aeds=3, multi_target=True)
+
+    rng = random.Random(3)
+    moves = [
+        (rng.choice(runners).id, rng.choice(network.ids))
+        for _ in range(n_updates)
+    ]
+    time1 = default_timer()
+    for runner_id, intersection_id in moves:
+        pf.move_runner(runner_id, intersection_id)
+    elapsed = default_timer() - time1
+    print(f"{n_updates} moves in {elapsed:.3f}s, {n_updates / elapsed:.0f} updates/s")
+
+    # The hot pathfinder agrees with one built from the final positions
+    fresh = network.pathfinder(patient, kilometers=3)
+    for runner in runners:
+        fresh.add_runner(runner)
+    # Runners sharing an intersection may be listed in another order
+    assert sorted(signature(pf.calculate_tasks(n_runners=20, n_aeds=3, multi_target=True))) == \
+        sorted(signature(fresh.calculate_tasks(n_runners=20, n_aeds=3, multi_target=True)))
+    assert sorted(r.id for r in pf.get_runners()) == sorted(r.id for r in fresh.get_runners())
+    print("tasks match a rebuilt pathfinder")
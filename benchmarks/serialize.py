@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+import tempfile
+import geojson
+from timeit import default_timer
+from heartrunner.util import parse_geojson
+from heartrunner.network import RoadNetwork
+from heartrunner.memory import MemoryHeartrunnerDB
+from heartrunner import serialize
+from .synthetic import write_streets_geojson
+from .landmarks import percentiles
+
+# The map payload of a dispatch, written by a serialize.DispatchWriter against the
+# geojson() methods of the types, one Feature per street of every route. The
+# network goes through the real GeoJSON -> CSV import so streets carry their
+# geometry strings. Checks that the payload parses and holds every runner,
+# AED, route and street once. Run from the repository root with:
+#   pipenv run python -m benchmarks.serialize [side] [incidents] [n_runners]
+
+AEDS_GEOJSON_PATH = "data/geojson/wdc_aeds.geojson"
+
+
+def features(pf, tasks):
+    # What a map client was sent so far
+    location = pf._node(pf._patient.intersection_id)
+    collection = [pf._patient.geojson(location)]
+    for task in tasks:
+        collection.append(task.runner.geojson(task.patient_path.source))
+        collection.extend(task.patient_path.geojson(style={"runner": task.runner.id}))
+        for aed_path in task.aed_paths:
+            collection.append(aed_path.aed.geojson(pf._node(aed_path.aed.intersection_id)))
+            collection.extend(aed_path.geojson(style={"runner": task.runner.id, "aed": aed_path.aed.id}))
+    return geojson.dumps(geojson.FeatureCollection(collection)).encode()
+
+
+if __name__ == "__main__":
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    n_incidents = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    n_runners = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {name: os.path.join(directory, name) for name in (
+            "streets.geojson", "intersections.csv", "streets.csv", "aeds.csv")}
+        write_streets_geojson(paths["streets.geojson"], side)
+        parse_geojson(
+            paths["streets.geojson"], AEDS_GEOJSON_PATH,
+            paths["intersections.csv"], paths["streets.csv"], paths["aeds.csv"])
+        network = RoadNetwork.from_csv(
+            paths["intersections.csv"], paths["streets.csv"], paths["aeds.csv"], geometry=True)
+
+    db = MemoryHeartrunnerDB(network)
+    db.generate_runners(len(network) // 4, seed=1)
+    # Pathfinders over the loaded network, whose streets carry the geometry
+    db.load_network()
+    writer = serialize.DispatchWriter()
+    times = {"geojson": [], "first dispatch": [], "dispatch": [], "first chunk": []}
+    sizes = {"geojson": [], "dispatch": []}
+    for patient in db.generate_patients(n_incidents, seed=2):
+        pf = db.get_pathfinder(patient)
+        tasks = pf.calculate_tasks(n_runners=n_runners, n_aeds=3, multi_target=True)
+
+        time1 = default_timer()
+        payload = features(pf, tasks)
+        times["geojson"].append(default_timer() - time1)
+        sizes["geojson"].append(len(payload))
+
+        time1 = default_timer()
+        writer.dispatch(pf, tasks)
+        times["first dispatch"].append(default_timer() - time1)
+        time1 = default_timer()
+        payload = writer.dispatch(pf, tasks)
+        times["dispatch"].append(default_timer() - time1)
+        sizes["dispatch"].append(len(payload))
+        time1 = default_timer()
+        next(writer.iter_dispatch(pf, tasks))
+        times["first chunk"].append(default_timer() - time1)
+
+        collection = json.loads(payload)
+        kinds = {}
+        for feature in collection["features"]:
+            kinds.setdefault(feature["properties"]["type"], []).append(feature)
+        routes = kinds.get("Route", [])
+        street_ids = {street.id for task in tasks for path in (task.patient_path, *task.aed_paths)
+                      for street in path.streets}
+        assert len(kinds["Patient"]) == 1
+        assert {f["properties"]["id"] for f in kinds.get("Runner", [])} == {task.runner.id for task in tasks}
+        assert len(kinds.get("Runner", [])) == len({task.runner.id for task in tasks})
+        assert len(routes) == sum(1 + len(task.aed_paths) for task in tasks)
+        segments = [feature["properties"]["id"] for feature in kinds.get("Streetsegment", [])]
+        assert len(segments) == len(set(segments)) and set(segments) == street_ids
+        for feature in kinds.get("Streetsegment", []):
+            assert feature["geometry"]["type"] == "LineString"
+        for route, (task, path) in zip(routes, [
+            (task, path) for task in tasks for path in (task.patient_path, *task.aed_paths)
+        ]):
+            assert route["properties"]["runner"] == task.runner.id
+            assert route["properties"]["streets"] == [street.id for street in path.streets]
+
+    print(f"{n_incidents} dispatches of {n_runners} runners on a {side}x{side} grid, "
+          f"{sum(sizes['geojson']) / n_incidents / 1024:.0f} KiB as geojson, "
+          f"{sum(sizes['dispatch']) / n_incidents / 1024:.0f} KiB as dispatch")
+    for name, samples in times.items():
+        p = percentiles(samples)
+        print(f"{name:>16}: " + "  ".join(f"{k} {v * 1e3:8.3f}ms" for k, v in p.items()))
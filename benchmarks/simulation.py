@@ -0,0 +1,62 @@
+import os
+import sys
+import argparse
+from heartrunner.network import RoadNetwork, INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH, AEDS_CSV_PATH
+from heartrunner.memory import MemoryHeartrunnerDB
+from heartrunner.simulation import Simulation, poisson_incidents, trace_incidents
+from .synthetic import planar_network
+
+# Saturation sweep of the dispatch pipeline on the in-memory backend, over
+# the DC network when data/csv/streetsegments.csv exists and a synthetic
+# city of side x side intersections otherwise. Every rate replays seeded
+# Poisson arrivals, or a trace, with runner churn. A rate saturates the
+# pipeline when throughput falls behind it or p95 queueing passes --slo.
+# Run from the repository root with:
+#   pipenv run python -m benchmarks.simulation --rates 1,5,10,20,40 --concurrency 4
+
+
+def network(side: int):
+    if os.path.exists(STREETS_CSV_PATH):
+        return RoadNetwork.from_csv(INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH, AEDS_CSV_PATH)
+    print(f"{STREETS_CSV_PATH} not found, using a synthetic city", file=sys.stderr)
+    return planar_network(side, seed=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.simulation")
+    parser.add_argument("--rates", default="1,5,10,20,40", help="incidents per second")
+    parser.add_argument("--trace", help="CSV of incidents instead of Poisson arrivals")
+    parser.add_argument("--duration", type=float, default=60, help="simulated seconds")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--runners", type=int, default=0, help="default one per 20 intersections")
+    parser.add_argument("--move-rate", type=float, default=10, help="runner moves per second")
+    parser.add_argument("--slo", type=float, default=1.0, help="p95 queueing in seconds")
+    parser.add_argument("--side", type=int, default=144)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    store = network(args.side)
+    streams = {"trace": trace_incidents(args.trace)} if args.trace else {
+        float(rate): None for rate in args.rates.split(",")
+    }
+    print(f"{len(store)} intersections, concurrency {args.concurrency}")
+    print(f"{'rate/s':>8} {'done/s':>8} {'util':>6} {'queue':>6} "
+          f"{'wait p50':>9} {'wait p95':>9} {'lat p50':>9} {'lat p95':>9} {'lat p99':>9}")
+    for rate, incidents in streams.items():
+        # A fresh database per rate, so every run starts from the same runners
+        db = MemoryHeartrunnerDB(store)
+        db.generate_runners(args.runners or len(store) // 20, seed=args.seed + 1)
+        if incidents is None:
+            incidents = poisson_incidents(rate, args.duration, db.get_intersection_ids(), seed=args.seed + 2)
+        report = Simulation(
+            db, incidents, concurrency=args.concurrency, move_rate=args.move_rate, seed=args.seed + 3).run()
+        summary = report.summary()
+        wait, latency = summary["queueing_s"], summary["latency_s"]
+        saturated = (
+            summary["throughput_per_s"] < 0.95 * summary["offered_per_s"] or wait["p95"] > args.slo
+        )
+        print(f"{summary['offered_per_s']:8.2f} {summary['throughput_per_s']:8.2f} "
+              f"{summary['utilization']:6.0%} {summary['max_queue']:6} "
+              f"{wait['p50'] * 1e3:7.1f}ms {wait['p95'] * 1e3:7.1f}ms "
+              f"{latency['p50'] * 1e3:7.1f}ms {latency['p95'] * 1e3:7.1f}ms {latency['p99'] * 1e3:7.1f}ms"
+              f"{'  saturated' if saturated else ''}")
@@ -0,0 +1,100 @@
+import os
+import sys
+import pickle
+import tempfile
+import multiprocessing
+from timeit import default_timer
+from concurrent.futures import ProcessPoolExecutor
+from heartrunner.util import parse_geojson
+from heartrunner.network import RoadNetwork
+from heartrunner import snapshot
+from .synthetic import write_streets_geojson, random_runners, random_patients
+from .backends import latencies
+
+# Worker cold start from the CSVs against a network snapshot. The DC streets
+# file is not bundled, so a synthetic city of side x side intersections goes
+# through the real GeoJSON -> CSV import first. Checks that the snapshot
+# network has the same arrays, AEDs, geometry and tasks as the CSV one.
+# Run from the repository root with:
+#   pipenv run python -m benchmarks.snapshot [side] [workers]
+
+AEDS_GEOJSON_PATH = "data/geojson/wdc_aeds.geojson"
+
+
+def worker_start(network: RoadNetwork):
+    # Runs in a spawned worker, network arrives pickled
+    return len(network), network.edge_ids[len(network.edge_ids) // 2]
+
+
+def timed_load(path, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        time1 = default_timer()
+        snapshot.load(path)
+        best = min(best, default_timer() - time1)
+    return best
+
+
+if __name__ == "__main__":
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 144
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {name: os.path.join(directory, name) for name in (
+            "streets.geojson", "intersections.csv", "streets.csv", "aeds.csv", "network.snap")}
+        write_streets_geojson(paths["streets.geojson"], side)
+        parse_geojson(
+            paths["streets.geojson"], AEDS_GEOJSON_PATH,
+            paths["intersections.csv"], paths["streets.csv"], paths["aeds.csv"])
+
+        time1 = default_timer()
+        network = RoadNetwork.from_csv(
+            paths["intersections.csv"], paths["streets.csv"], paths["aeds.csv"], geometry=True)
+        from_csv = default_timer() - time1
+        runners = random_runners(network, len(network) // 20, seed=1)
+
+        time1 = default_timer()
+        size = snapshot.write(paths["network.snap"], network, runners)
+        export = default_timer() - time1
+        load = timed_load(paths["network.snap"])
+
+        snap = snapshot.Snapshot(paths["network.snap"])
+        mapped = snap.network()
+        for name in ("ids", "latitudes", "longitudes", "offsets", "targets", "edge_ids", "lengths"):
+            assert list(getattr(network, name)) == list(getattr(mapped, name)), name
+        assert {id: (aed.intersection_id, aed.open_hour, aed.close_hour, aed.in_use)
+                for id, aed in network.aeds.items()} == \
+            {id: (aed.intersection_id, aed.open_hour, aed.close_hour, aed.in_use)
+                for id, aed in mapped.aeds.items()}
+        assert [(r.id, r.intersection_id, r.speed) for r in runners] == \
+            [(r.id, r.intersection_id, r.speed) for r in snap.runners()]
+        assert all(mapped._geometries.get(id) == geometry for id, geometry in network._geometries.items())
+        assert len(mapped._geometries) == len(network._geometries)
+        assert len(snap.streets()) == len(network.targets) // 2
+
+        patients = random_patients(network, 20, seed=2)
+        for patient in patients:
+            pfs = [net.pathfinder(patient) for net in (network, mapped)]
+            for pf in pfs:
+                for runner in runners:
+                    if pf.get_node(runner.intersection_id) is not None:
+                        pf.add_runner(runner)
+            for multi_target in (False, True):
+                assert latencies(pfs[0].calculate_tasks(20, 3, multi_target)) == \
+                    latencies(pfs[1].calculate_tasks(20, 3, multi_target)), patient
+        print(f"arrays, AEDs, runners, geometry and {len(patients)} task sets agree with the CSV network")
+
+        # Spawned workers receive the network as its path and map the same file
+        assert len(pickle.dumps(mapped)) < 1024
+        time1 = default_timer()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(worker_start, [mapped] * workers))
+        spawn = default_timer() - time1
+        assert all(result == (len(network), network.edge_ids[len(network.edge_ids) // 2]) for result in results)
+
+        print(f"{len(network)} intersections, {len(network.targets) // 2} streets, "
+              f"{len(network.aeds)} AEDs, {len(runners)} runners")
+        print(f"  from csv     {from_csv * 1e3:9.1f}ms")
+        print(f"  export       {export * 1e3:9.1f}ms  {size / 2**20:.1f} MiB")
+        print(f"  load         {load * 1e3:9.1f}ms  ({from_csv / load:.0f}x)")
+        print(f"  {workers} spawned workers {spawn * 1e3:9.1f}ms including interpreter start")
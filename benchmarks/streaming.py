@@ -0,0 +1,60 @@
+import sys
+import networkx as nx
+from timeit import default_timer
+from heartrunner.memory import MemoryHeartrunnerDB
+from .synthetic import grid_network
+from .landmarks import percentiles
+
+# Time to the first task of Pathfinder.iter_tasks against the full list of
+# calculate_tasks. Checks that the streamed tasks come in latency order and
+# are the n_runners fastest runners, routing every runner in the box to find
+# those. Run from the repository root with:
+#   pipenv run python -m benchmarks.streaming [side] [incidents] [n_runners]
+
+
+if __name__ == "__main__":
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    n_incidents = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    n_runners = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    db = MemoryHeartrunnerDB(grid_network(side, seed=0))
+    db.generate_runners(len(db.store) // 4, seed=1)
+    times = {"first task": [], "all tasks": [], "calculate_tasks": [], "multi_target": []}
+    routed = []
+    for patient in db.generate_patients(n_incidents, seed=2):
+        pf = db.get_pathfinder(patient)
+
+        latencies = []
+        for runner in pf.get_runners():
+            try:
+                path = pf._to_path(pf._astar(
+                    pf.get_node(runner.intersection_id), pf.get_node(patient.intersection_id)))
+            except nx.NetworkXNoPath:
+                continue
+            latencies.append(path.length / runner.speed)
+        latencies.sort()
+
+        time1 = default_timer()
+        tasks = pf.iter_tasks(n_runners=n_runners, n_aeds=3)
+        first = next(tasks, None)
+        times["first task"].append(default_timer() - time1)
+        streamed = [first, *tasks] if first is not None else []
+        times["all tasks"].append(default_timer() - time1)
+        found = [task.patient_latency for task in streamed]
+        assert found == sorted(found)
+        assert all(abs(a - b) <= 1e-9 * max(1.0, b) for a, b in zip(found, latencies[:n_runners])), patient
+        assert len(found) == min(n_runners, len(latencies))
+        routed.append(len(latencies))
+
+        time1 = default_timer()
+        pf.calculate_tasks(n_runners=n_runners, n_aeds=3)
+        times["calculate_tasks"].append(default_timer() - time1)
+        time1 = default_timer()
+        pf.calculate_tasks(n_runners=n_runners, n_aeds=3, multi_target=True)
+        times["multi_target"].append(default_timer() - time1)
+
+    print(f"{n_incidents} incidents streamed the {n_runners} fastest of "
+          f"{sum(routed) / len(routed):.0f} reachable runners on average, in latency order")
+    for name, samples in times.items():
+        p = percentiles(samples)
+        print(f"{name:>16}: " + "  ".join(f"{k} {v * 1e3:8.3f}ms" for k, v in p.items()))
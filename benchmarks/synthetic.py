@@ -0,0 +1,145 @@
+import random
+from heartrunner.types import *
+from heartrunner.spatial import haversine
+from heartrunner.network import RoadNetwork
+
+# Seeded synthetic cities for benchmarks. A grid of side x side intersections
+# around Washington DC, jittered, with a share of the blocks removed so that
+# routes are not trivially straight.
+
+ORIGIN = (38.85, -77.10)
+BLOCK = 0.0012
+
+
+def grid_network(side: int, seed=0, drop=0.1, n_aeds=None):
+    rng = random.Random(seed)
+    intersections = []
+    for row in range(side):
+        for col in range(side):
+            intersections.append((
+                row * side + col + 1,
+                ORIGIN[0] + row * BLOCK + rng.uniform(-0.2, 0.2) * BLOCK,
+                ORIGIN[1] + col * BLOCK * 1.3 + rng.uniform(-0.2, 0.2) * BLOCK
+            ))
+
+    streets = []
+    for row in range(side):
+        for col in range(side):
+            u = intersections[row * side + col]
+            for v_row, v_col in ((row, col + 1), (row + 1, col)):
+                if v_row >= side or v_col >= side or rng.random() < drop:
+                    continue
+                v = intersections[v_row * side + v_col]
+                # Streets are never shorter than the straight line
+                length = haversine(u[1:], v[1:]) * rng.uniform(1.0, 1.2)
+                streets.append((len(streets) + 1, u[0], v[0], length, None))
+
+    if n_aeds is None:
+        n_aeds = max(1, len(intersections) // 10)
+    aeds = [
+        AED(id=i + 1, intersection_id=rng.choice(intersections)[0], time_range=(0, 2359))
+        for i in range(n_aeds)
+    ]
+    return RoadNetwork(intersections, streets, aeds)
+
+
+def planar_network(side: int, seed=0, drop=0.15, diagonals=0.25, n_aeds=None):
+    # Irregular planar city: a strongly jittered grid with blocks removed and
+    # at most one diagonal per block, so streets never cross and degrees
+    # range from 1 to 8
+    rng = random.Random(seed)
+    intersections = []
+    for row in range(side):
+        for col in range(side):
+            intersections.append((
+                row * side + col + 1,
+                ORIGIN[0] + row * BLOCK + rng.uniform(-0.35, 0.35) * BLOCK,
+                ORIGIN[1] + col * BLOCK * 1.3 + rng.uniform(-0.35, 0.35) * BLOCK
+            ))
+
+    streets = []
+
+    def street(a, b):
+        u, v = intersections[a], intersections[b]
+        length = haversine(u[1:], v[1:]) * rng.uniform(1.0, 1.3)
+        streets.append((len(streets) + 1, u[0], v[0], length, None))
+
+    for row in range(side):
+        for col in range(side):
+            a = row * side + col
+            if col + 1 < side and rng.random() >= drop:
+                street(a, a + 1)
+            if row + 1 < side and rng.random() >= drop:
+                street(a, a + side)
+            if row + 1 < side and col + 1 < side and rng.random() < diagonals:
+                if rng.random() < 0.5:
+                    street(a, a + side + 1)
+                else:
+                    street(a + 1, a + side)
+
+    if n_aeds is None:
+        n_aeds = max(1, len(intersections) // 10)
+    aeds = [
+        AED(id=i + 1, intersection_id=rng.choice(intersections)[0], time_range=(0, 2359))
+        for i in range(n_aeds)
+    ]
+    return RoadNetwork(intersections, streets, aeds)
+
+
+def random_runners(network: RoadNetwork, n: int, seed=0):
+    rng = random.Random(seed)
+    return [
+        Runner(id=i + 1, speed=rng.randrange(3, 6), intersection_id=rng.choice(network.ids))
+        for i in range(n)
+    ]
+
+
+def random_patients(network: RoadNetwork, n: int, seed=0, center=True):
+    # Patients towards the middle of the city so their boxes stay inside it
+    rng = random.Random(seed)
+    side = int(len(network) ** 0.5)
+    if center and side > 4:
+        rows = range(side // 4, 3 * side // 4)
+        ids = [network.ids[r * side + c] for r in rows for c in rows]
+    else:
+        ids = list(network.ids)
+    return [Patient(id=i + 1, intersection_id=rng.choice(ids)) for i in range(n)]
+
+
+def write_streets_geojson(path, side: int, seed=0, vertices=6):
+    # Streets of a jittered grid as a DC style FeatureCollection, one
+    # feature per line with a few intermediate vertices, some of them
+    # highways or ramps that the importer filters out
+    rng = random.Random(seed)
+    corners = [
+        [
+            (ORIGIN[1] + col * BLOCK * 1.3 + rng.uniform(-0.2, 0.2) * BLOCK,
+             ORIGIN[0] + row * BLOCK + rng.uniform(-0.2, 0.2) * BLOCK)
+            for col in range(side)
+        ]
+        for row in range(side)
+    ]
+    with open(path, "w") as file:
+        file.write('{\n"type": "FeatureCollection",\n"name": "Roadway_Block",\n"features": [\n')
+        first = True
+        for row in range(side):
+            for col in range(side):
+                for v_row, v_col in ((row, col + 1), (row + 1, col)):
+                    if v_row >= side or v_col >= side:
+                        continue
+                    (x1, y1), (x2, y2) = corners[row][col], corners[v_row][v_col]
+                    line = [(x1, y1)] + [
+                        (x1 + (x2 - x1) * t / vertices + rng.uniform(-1e-5, 1e-5),
+                         y1 + (y2 - y1) * t / vertices + rng.uniform(-1e-5, 1e-5))
+                        for t in range(1, vertices)
+                    ] + [(x2, y2)]
+                    coordinates = ", ".join(f"[ {x:.9f}, {y:.9f} ]" for x, y in line)
+                    roadtype = "Ramp" if rng.random() < 0.02 else "Street"
+                    file.write(
+                        ("" if first else ",\n") +
+                        '{ "type": "Feature", "properties": { "FUNCTIONALCLASS": "Local", '
+                        f'"ROADTYPE": "{roadtype}" }}, "geometry": {{ "type": "LineString", '
+                        f'"coordinates": [ {coordinates} ] }} }}'
+                    )
+                    first = False
+        file.write("\n]\n}\n")
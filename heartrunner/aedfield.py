@@ -0,0 +1,161 @@
+import heapq
+from .types import *
+from .network import RoadNetwork
+
+
+def _not_in_use(aed: AED):
+    return not aed.in_use
+
+
+class AEDField:
+    # For every intersection of a RoadNetwork, the k nearest intersections
+    # holding an available AED by network distance, built with a
+    # multi-source Dijkstra that settles up to k labels (distance, location,
+    # predecessor) per node, one per AED location. Co-located AEDs share one
+    # label and are mapped back from the location when paths are built.
+    #
+    # Labels are ranked by (distance, location), so ties between equally far
+    # locations are broken the same way by the full build and by updates. If
+    # a location is among the k nearest of a node, it is then also among the
+    # k nearest of the node's predecessor towards it, so following
+    # predecessors always finds a label for the same location and paths can
+    # be rebuilt from the field alone. The same argument bounds incremental
+    # updates: adding a location only spreads through nodes where it enters
+    # the top k, removing one only touches the nodes that held it.
+
+    def __init__(self, network: RoadNetwork, k=3, available=_not_in_use):
+        self.network = network
+        self.k = k
+        self.available = available
+        self._labels: list[list[tuple]] = []
+        self._holders: dict[int, set] = {}
+        # Location index -> ids of the available AEDs there, and back
+        self._enabled: dict[int, set] = {}
+        self._locations: dict[int, int] = {}
+        self.build()
+
+    def build(self):
+        net = self.network
+        self._labels = [[] for _ in range(len(net))]
+        self._holders = {}
+        self._enabled = {}
+        self._locations = {}
+        for aed in net.aeds.values():
+            if self.available(aed):
+                self._enable(aed)
+        heap = [(0.0, a, a, -1) for a in self._enabled]
+        heapq.heapify(heap)
+        self._settle(heap)
+
+    def _enable(self, aed: AED):
+        a = self.network.index[aed.intersection_id]
+        self._locations[aed.id] = a
+        aeds = self._enabled.setdefault(a, set())
+        aeds.add(aed.id)
+        return len(aeds) == 1
+
+    def _holds(self, i: int, a: int):
+        for label in self._labels[i]:
+            if label[1] == a:
+                return True
+        return False
+
+    def _settle(self, heap: list, allowed: set = None):
+        # k-best label setting Dijkstra, optionally confined to some nodes.
+        # Entries pop by (distance, location), the order labels are ranked in
+        net = self.network
+        k = self.k
+        labels = self._labels
+        while heap:
+            d, a, i, pred = heapq.heappop(heap)
+            if len(labels[i]) >= k or self._holds(i, a):
+                continue
+            labels[i].append((d, a, pred))
+            labels[i].sort()
+            self._holders.setdefault(a, set()).add(i)
+            for slot in range(net.offsets[i], net.offsets[i+1]):
+                j = net.targets[slot]
+                if allowed is not None and j not in allowed:
+                    continue
+                if len(labels[j]) < k and not self._holds(j, a):
+                    heapq.heappush(heap, (d + net.lengths[slot], a, j, i))
+
+    def nearest(self, node_id: int):
+        # [(meters, intersection id)] for the k nearest intersections with an
+        # available AED, closest first
+        ids = self.network.ids
+        return [(d, ids[a]) for d, a, _ in self._labels[self.network.index[node_id]]]
+
+    def aeds(self, intersection_id: int):
+        # The available AEDs at an intersection
+        net = self.network
+        return [net.aeds[id] for id in self._enabled.get(net.index[intersection_id], ())]
+
+    def path(self, node_id: int, intersection_id: int):
+        # Intersection ids from node_id to the AED location along a shortest
+        # path, None if the field does not list it for node_id
+        net = self.network
+        i = net.index[node_id]
+        a = net.index[intersection_id]
+        nodes = [node_id]
+        while True:
+            label = next((label for label in self._labels[i] if label[1] == a), None)
+            if label is None:
+                return None
+            if label[2] < 0:
+                return nodes
+            i = label[2]
+            nodes.append(net.ids[i])
+
+    def update(self, aed: AED):
+        # Re-evaluate one AED after its in_use flag, opening hours or
+        # location changed
+        self.network.aeds[aed.id] = aed
+        a = self._locations.pop(aed.id, None)
+        if a is not None:
+            self._enabled[a].discard(aed.id)
+            if not self._enabled[a]:
+                del self._enabled[a]
+                self._remove(a)
+        if self.available(aed) and self._enable(aed):
+            self._add(self._locations[aed.id])
+
+    def _add(self, a: int):
+        net = self.network
+        k = self.k
+        heap = [(0.0, a, -1)]
+        done = set()
+        while heap:
+            d, i, pred = heapq.heappop(heap)
+            if i in done:
+                continue
+            done.add(i)
+            labels = self._labels[i]
+            if len(labels) >= k and labels[-1][:2] <= (d, a):
+                continue
+            labels.append((d, a, pred))
+            labels.sort()
+            self._holders.setdefault(a, set()).add(i)
+            if len(labels) > k:
+                _, evicted, _ = labels.pop()
+                self._holders[evicted].discard(i)
+            for slot in range(net.offsets[i], net.offsets[i+1]):
+                j = net.targets[slot]
+                if j not in done:
+                    heapq.heappush(heap, (d + net.lengths[slot], j, i))
+
+    def _remove(self, a: int):
+        net = self.network
+        affected = self._holders.pop(a, set())
+        for i in affected:
+            self._labels[i] = [label for label in self._labels[i] if label[1] != a]
+        # Labels outside the affected nodes are final, seed from them and
+        # let the search fill the freed slots inside
+        heap = []
+        for i in affected:
+            for slot in range(net.offsets[i], net.offsets[i+1]):
+                j = net.targets[slot]
+                for d, b, _ in self._labels[j]:
+                    heap.append((d + net.lengths[slot], b, i, j))
+        heapq.heapify(heap)
+        self._settle(heap, allowed=affected)
@@ -0,0 +1,226 @@
+import math
+from timeit import default_timer
+from .types import *
+from .pathfinder import Path, Task
+
+# Latency counted for a patient left without a runner or without an AED
+UNASSIGNED = 24 * 3600.0
+
+
+class Dispatch:
+    # One runner sent to one patient, directly or by way of an AED
+
+    def __init__(self, patient: Patient, runner: Runner, path: Path, latency: float, aed: AED = None):
+        self.patient = patient
+        self.runner = runner
+        self.path = path
+        self.latency = latency
+        self.aed = aed
+
+    def __repr__(self) -> str:
+        via = f" via {self.aed}" if self.aed is not None else ""
+        return f"Dispatch({self.runner} -> {self.patient}{via}, {self.latency:.1f}s)"
+
+
+class Plan:
+    # Dispatches for a set of concurrent incidents. Every patient gets one
+    # runner going straight to them and one fetching an AED, no runner or AED
+    # is used twice. The objective is the summed latency of both, with
+    # UNASSIGNED for every role that could not be filled
+
+    def __init__(self, patients: list[Patient], dispatches: list[Dispatch], exact=True, elapsed=0.0):
+        self.patients = patients
+        self.dispatches = dispatches
+        self.exact = exact
+        self.elapsed = elapsed
+        self.latency = sum(dispatch.latency for dispatch in dispatches)
+        self.unassigned = 2 * len(patients) - len(dispatches)
+        self.objective = self.latency + UNASSIGNED * self.unassigned
+
+    def __repr__(self) -> str:
+        return f"Plan({len(self.dispatches)} dispatches, objective {self.objective:.1f}s)"
+
+    def for_patient(self, patient: Patient):
+        return [dispatch for dispatch in self.dispatches if dispatch.patient is patient]
+
+
+def hungarian(cost: list[list[float]], deadline: float = None):
+    # Minimum cost assignment of rows to distinct columns for a rectangular
+    # matrix with no more rows than columns, by shortest augmenting paths.
+    # Rows left when the deadline passes are given their cheapest free
+    # column instead. Returns the column of each row and whether the
+    # solution is optimal
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+    exact = True
+    for i in range(1, n + 1):
+        if deadline is not None and default_timer() > deadline:
+            exact = False
+            break
+        p[0] = i
+        j0 = 0
+        minv = [math.inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            row = cost[p[j0] - 1]
+            ui = u[p[j0]]
+            delta = math.inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - ui - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    columns = [None] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            columns[p[j] - 1] = j - 1
+    if not exact:
+        free = set(range(m)) - set(c for c in columns if c is not None)
+        for i in range(n):
+            if columns[i] is None and free:
+                columns[i] = min(free, key=lambda j: cost[i][j])
+                free.discard(columns[i])
+    return columns, exact
+
+
+def _assign(cost: list[list[float]], deadline: float = None):
+    # hungarian for any shape, as (row, column) pairs with a finite cost
+    if not cost or not cost[0]:
+        return [], True
+    if len(cost) <= len(cost[0]):
+        columns, exact = hungarian(cost, deadline)
+        pairs = [(i, j) for i, j in enumerate(columns) if j is not None]
+    else:
+        rows, exact = hungarian([list(column) for column in zip(*cost)], deadline)
+        pairs = [(i, j) for j, i in enumerate(rows) if i is not None]
+    return [(i, j) for i, j in pairs if cost[i][j] < UNASSIGNED], exact
+
+
+def solve(patients: list[Patient], tasks: list[list[Task]], budget=0.05):
+    # Plan from the tasks of calculate_tasks_batch, tasks[k] belonging to
+    # patients[k]. First runners are assigned to the roles of every patient,
+    # a runner's cost for an AED role being its fastest AED detour, then
+    # AEDs are assigned to the runners fetching them. Both are minimum cost
+    # assignments, the budget in seconds bounds the time spent on them and
+    # the greedy plan is returned if it is better than an unfinished one
+    time1 = default_timer()
+    deadline = time1 + budget if budget is not None else None
+
+    runners: dict[int, Runner] = {}
+    by_pair: dict[tuple, Task] = {}
+    for k, patient_tasks in enumerate(tasks):
+        for task in patient_tasks:
+            runners.setdefault(task.runner.id, task.runner)
+            by_pair[(k, task.runner.id)] = task
+    runner_ids = list(runners)
+
+    # Rows are roles: (patient, False) goes straight, (patient, True) via an AED
+    roles = [(k, via) for k in range(len(patients)) for via in (False, True)]
+    cost = []
+    for k, via in roles:
+        row = []
+        for runner_id in runner_ids:
+            task = by_pair.get((k, runner_id))
+            if task is None:
+                row.append(UNASSIGNED)
+            elif via:
+                row.append(min(task.aed_latencies, default=UNASSIGNED))
+            else:
+                row.append(task.patient_latency)
+        cost.append(row)
+    pairs, exact = _assign(cost, deadline)
+
+    dispatches = []
+    fetching = []
+    for role, column in pairs:
+        k, via = roles[role]
+        task = by_pair[(k, runner_ids[column])]
+        if via:
+            fetching.append((k, task))
+        else:
+            dispatches.append(Dispatch(
+                patients[k], task.runner, task.patient_path, task.patient_latency))
+
+    # Runners fetching an AED each get a distinct one
+    aeds: dict[int, AED] = {}
+    for _, task in fetching:
+        for path in task.aed_paths:
+            aeds.setdefault(path.aed.id, path.aed)
+    aed_ids = list(aeds)
+    cost = []
+    for _, task in fetching:
+        latencies = {}
+        for path, latency in zip(task.aed_paths, task.aed_latencies):
+            latencies.setdefault(path.aed.id, (latency, path))
+        cost.append([latencies.get(aed_id, (UNASSIGNED,))[0] for aed_id in aed_ids])
+    aed_pairs, aed_exact = _assign(cost, deadline)
+    for row, column in aed_pairs:
+        k, task = fetching[row]
+        for path, latency in zip(task.aed_paths, task.aed_latencies):
+            if path.aed.id == aed_ids[column]:
+                dispatches.append(Dispatch(patients[k], task.runner, path, latency, path.aed))
+                break
+
+    plan = Plan(patients, dispatches, exact and aed_exact)
+    if not plan.exact:
+        # Out of time, never do worse than the baseline
+        baseline = greedy(patients, tasks)
+        if baseline.objective < plan.objective:
+            plan = baseline
+    plan.elapsed = default_timer() - time1
+    return plan
+
+
+def greedy(patients: list[Patient], tasks: list[list[Task]]):
+    # Baseline: patients in turn take the fastest runner still free, then
+    # the fastest AED detour of a free runner with an unused AED
+    time1 = default_timer()
+    used_runners = set()
+    used_aeds = set()
+    dispatches = []
+    for patient, patient_tasks in zip(patients, tasks):
+        direct = min(
+            (task for task in patient_tasks if task.runner.id not in used_runners),
+            key=lambda task: task.patient_latency, default=None
+        )
+        if direct is not None:
+            used_runners.add(direct.runner.id)
+            dispatches.append(Dispatch(
+                patient, direct.runner, direct.patient_path, direct.patient_latency))
+
+        detours = [
+            (latency, task, path)
+            for task in patient_tasks if task.runner.id not in used_runners
+            for path, latency in zip(task.aed_paths, task.aed_latencies)
+            if path.aed.id not in used_aeds
+        ]
+        if detours:
+            latency, task, path = min(detours, key=lambda x: x[0])
+            used_runners.add(task.runner.id)
+            used_aeds.add(path.aed.id)
+            dispatches.append(Dispatch(patient, task.runner, path, latency, path.aed))
+    return Plan(patients, dispatches, False, default_timer() - time1)
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+from neo4j import AsyncGraphDatabase, AsyncSession
+from . import instrumentation
+from .types import *
+from .cache import RouteCache
+from .network import RoadNetwork, bounding_box, DISTRICT
+from .database import (
+    _NETWORK_INTERSECTIONS_QUERY,
+    _NETWORK_STREETS_QUERY,
+    _NETWORK_AEDS_QUERY,
+    _network_from_records,
+    _node_from_record,
+    _pathfinder_from_records,
+    _projected_pathfinder_from_records,
+    _box_params,
+    _PROJECTED_STREETS_QUERY,
+    _PROJECTED_AEDS_QUERY,
+    _PROJECTED_RUNNERS_QUERY,
+    _RING_STREETS_QUERY,
+    _RING_AEDS_QUERY,
+    _RING_RUNNERS_QUERY,
+    _ring_params,
+    _adaptive_boxes,
+    _runner_from_record,
+    _runners_query,
+    _subgraph_query
+)
+
+
+class AsyncHeartrunnerDB:
+    # asyncio counterpart of HeartrunnerDB's read path, so one event loop
+    # can serve many incidents in flight. Multi-step operations reuse one
+    # session, and batches fetch each patient's subgraph concurrently up to
+    # the connection pool size. A driver can be passed in, e.g. an
+    # in-memory stand-in for tests, in which case uri and auth are unused.
+
+    def __init__(
+        self,
+        uri=None,
+        user=None,
+        password=None,
+        cache: RouteCache = None,
+        driver=None,
+        max_connection_pool_size=50,
+        connection_acquisition_timeout=10.0
+    ):
+        if driver is None:
+            driver = AsyncGraphDatabase.driver(
+                uri,
+                auth=(user, password),
+                max_connection_pool_size=max_connection_pool_size,
+                connection_acquisition_timeout=connection_acquisition_timeout
+            )
+        self.driver = driver
+        self.network: RoadNetwork = None
+        self.cache = cache
+        # Never queue more concurrent fetches than there are connections
+        self._slots = asyncio.Semaphore(max_connection_pool_size)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        await self.driver.close()
+
+    def _session(self) -> AsyncSession:
+        return self.driver.session(database="neo4j")
+
+    @staticmethod
+    async def _records(session: AsyncSession, query: str, params: dict = {}):
+        with instrumentation.span("neo4j.query"):
+            result = await session.run(query, params)
+            records = [record async for record in result]
+        instrumentation.count("neo4j.rows", len(records))
+        return records
+
+    async def get_node(self, node_type: NodeType, node_id: int, session: AsyncSession = None):
+        if session is None:
+            async with self._session() as session:
+                return await self.get_node(node_type, node_id, session)
+        try:
+            records = await self._records(
+                session,
+                f"MATCH (n:{node_type.name})--(m) WHERE n.id = $id RETURN n, m LIMIT 1",
+                {"id": node_id}
+            )
+            return _node_from_record(node_type, records[0])
+        except:
+            logging.exception(" Error while executing get_node")
+            instrumentation.count("db.errors", operation="get_node")
+            return None
+
+    async def count_nodes(self, node_type: NodeType):
+        async with self._session() as session:
+            try:
+                records = await self._records(
+                    session, f"MATCH (n:{node_type.name}) RETURN count(n) AS count")
+                return records[0]["count"]
+            except:
+                logging.exception(" Error while executing count_nodes")
+                instrumentation.count("db.errors", operation="count_nodes")
+                return None
+
+    async def load_network(self, network: RoadNetwork = None):
+        if network is None:
+            network = await self.get_network()
+        self.network = network
+        return network
+
+    @instrumentation.timed("db.get_network")
+    async def get_network(self):
+        async with self._session() as session:
+            try:
+                # One session, three reads issued back to back
+                return _network_from_records(
+                    await self._records(session, _NETWORK_INTERSECTIONS_QUERY),
+                    await self._records(session, _NETWORK_STREETS_QUERY),
+                    await self._records(session, _NETWORK_AEDS_QUERY)
+                )
+            except:
+                logging.exception(" Error while executing get_network")
+                instrumentation.count("db.errors", operation="get_network")
+                return None
+
+    @instrumentation.timed("db.get_pathfinder")
+    async def get_pathfinder(self, patient: Patient, kilometers=1, projected=False):
+        snap = DISTRICT if self.cache is not None else None
+        async with self._slots, self._session() as session:
+            try:
+                if self.network is not None:
+                    pf = self.network.pathfinder(patient, kilometers, cache=self.cache)
+                    query, params = _runners_query(pf.limits)
+                    for record in await self._records(session, query, params):
+                        pf.add_runner(_runner_from_record(record))
+                    return pf
+
+                # Location lookup and subgraph share the session
+                location = await self.get_node(
+                    NodeType.Intersection, patient.intersection_id, session)
+                limits = bounding_box(location.coords(), kilometers, snap=snap)
+                if projected:
+                    params = _box_params(limits)
+                    streets = await self._records(session, _PROJECTED_STREETS_QUERY, params)
+                    aeds = await self._records(session, _PROJECTED_AEDS_QUERY, params)
+                    runners = await self._records(session, _PROJECTED_RUNNERS_QUERY, params)
+                    return _projected_pathfinder_from_records(
+                        streets, aeds[0]["aeds"], runners[0]["runners"],
+                        limits, patient, self.cache)
+                query, params = _subgraph_query(limits)
+                records = await self._records(session, query, params)
+                return _pathfinder_from_records(records, limits, patient, self.cache)
+            except:
+                logging.exception(" Error while executing get_subgraph")
+                instrumentation.count("db.errors", operation="get_subgraph")
+                return None
+
+    @instrumentation.timed("db.get_adaptive_pathfinder")
+    async def get_adaptive_pathfinder(
+        self,
+        patient: Patient,
+        n_runners=20,
+        n_aeds=3,
+        kilometers=0.25,
+        max_kilometers=4,
+        growth=2,
+        at=None
+    ):
+        # See HeartrunnerDB.get_adaptive_pathfinder, every ring on one session
+        async with self._slots, self._session() as session:
+            try:
+                if self.network is not None:
+                    location = self.network.location(patient.intersection_id)
+                else:
+                    location = (await self.get_node(
+                        NodeType.Intersection, patient.intersection_id, session)).coords()
+
+                pf = None
+                runners = []
+                snap = DISTRICT if self.cache is not None else None
+                for limits, inner, radius in _adaptive_boxes(
+                        location, kilometers, max_kilometers, growth, snap=snap):
+                    params = _ring_params(limits, inner)
+                    ring_runners = (await self._records(session, _RING_RUNNERS_QUERY, params))[0]["runners"]
+                    if self.network is not None:
+                        runners += [
+                            Runner(id=id, speed=speed, intersection_id=intersection_id)
+                            for id, intersection_id, speed in ring_runners
+                        ]
+                        pf = self.network.pathfinder(patient, limits=limits, cache=self.cache)
+                        for runner in runners:
+                            pf.add_runner(runner)
+                    else:
+                        streets = await self._records(session, _RING_STREETS_QUERY, params)
+                        aeds = (await self._records(session, _RING_AEDS_QUERY, params))[0]["aeds"]
+                        pf = _projected_pathfinder_from_records(
+                            streets, aeds, ring_runners, limits, patient, self.cache, pf)
+                    found_runners, found_aeds = pf.coverage(radius, at=at)
+                    if found_runners >= n_runners and found_aeds >= n_aeds:
+                        return pf
+                logging.warning(
+                    f" Only {found_runners} runners and {found_aeds} AEDs within "
+                    f"{max_kilometers} km of {patient}")
+                return pf
+            except:
+                logging.exception(" Error while executing get_adaptive_pathfinder")
+                instrumentation.count("db.errors", operation="get_adaptive_pathfinder")
+                return None
+
+    @instrumentation.timed("db.get_pathfinders")
+    async def get_pathfinders(self, patients: list[Patient], kilometers=1, projected=False):
+        # One pathfinder per patient, fetched concurrently
+        return list(await asyncio.gather(*[
+            self.get_pathfinder(patient, kilometers, projected) for patient in patients
+        ]))
+
+    @instrumentation.timed("db.calculate_tasks")
+    async def calculate_tasks(self, patients: list[Patient], n_runners: int = None, n_aeds: int = None, at=None):
+        # Fetch and route a batch of incidents, routing each patient as soon
+        # as its subgraph arrives while the other fetches are still running
+        async def dispatch(patient: Patient):
+            pf = await self.get_pathfinder(patient)
+            if pf is None:
+                return None
+            return pf.calculate_tasks(n_runners=n_runners, n_aeds=n_aeds, multi_target=True, at=at)
+
+        return list(await asyncio.gather(*[dispatch(patient) for patient in patients]))
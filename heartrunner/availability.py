@@ -0,0 +1,82 @@
+from datetime import datetime
+from .types import AED
+
+
+def clock(at):
+    # Dispatch time as hhmm, the format of AED opening hours
+    if isinstance(at, datetime):
+        return at.hour * 100 + at.minute
+    return int(at)
+
+
+def is_open(open_hour: int, close_hour: int, hhmm: int):
+    # Opening hours past midnight, e.g. (2000, 400), wrap around
+    if open_hour <= close_hour:
+        return open_hour <= hhmm <= close_hour
+    return hhmm >= open_hour or hhmm <= close_hour
+
+
+class AvailabilityIndex:
+    # AEDs by hour of the day. An AED open for a whole hour is stored in that
+    # hour's set and needs no further checks, one that opens or closes during
+    # the hour is kept aside with its hours and checked against the minute.
+    # AEDs in use are left out of every answer.
+
+    def __init__(self, aeds: list[AED] = []):
+        self._open: list[set] = [set() for _ in range(24)]
+        self._partial: list[dict] = [{} for _ in range(24)]
+        self._aeds: dict[int, AED] = {}
+        self._in_use: set = set()
+        for aed in aeds:
+            self.add(aed)
+
+    def __len__(self):
+        return len(self._aeds)
+
+    def add(self, aed: AED):
+        if aed.id in self._aeds:
+            self.remove(aed.id)
+        self._aeds[aed.id] = aed
+        if aed.in_use:
+            self._in_use.add(aed.id)
+        # Only the hours it opens and closes in can be partly open
+        edges = (aed.open_hour // 100, aed.close_hour // 100)
+        for hour in range(24):
+            if hour in edges:
+                minutes = sum(
+                    is_open(aed.open_hour, aed.close_hour, hour * 100 + minute)
+                    for minute in range(60)
+                )
+            else:
+                minutes = 60 if is_open(aed.open_hour, aed.close_hour, hour * 100) else 0
+            if minutes == 60:
+                self._open[hour].add(aed.id)
+            elif minutes > 0:
+                self._partial[hour][aed.id] = (aed.open_hour, aed.close_hour)
+
+    def remove(self, aed_id: int):
+        if self._aeds.pop(aed_id, None) is None:
+            return
+        self._in_use.discard(aed_id)
+        for hour in range(24):
+            self._open[hour].discard(aed_id)
+            self._partial[hour].pop(aed_id, None)
+
+    def update(self, aed: AED):
+        # After the in_use flag or opening hours changed
+        self.add(aed)
+
+    def available(self, at):
+        # Ids of the AEDs that are open and not in use at a dispatch time
+        hhmm = clock(at)
+        hour = hhmm // 100
+        ids = {
+            aed_id for aed_id, (open_hour, close_hour) in self._partial[hour].items()
+            if is_open(open_hour, close_hour, hhmm)
+        }
+        ids.update(self._open[hour])
+        ids.difference_update(self._in_use)
+        return ids
+
+    def is_available(self, aed: AED, at):
+        return not aed.in_use and is_open(aed.open_hour, aed.close_hour, clock(at))
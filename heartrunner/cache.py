@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from . import instrumentation
+
+
+class RouteCache:
+    # LRU cache of shortest path trees, keyed by (scope, source node).
+    # The scope identifies the graph a tree was computed on, the limits of a
+    # pathfinder's subgraph, so trees are only shared between pathfinders
+    # over the same streets. A tree is the (dist, pred) pair returned by
+    # Pathfinder._dijkstra and gives every route from or to its source.
+    # Size is capped both by number of trees and by the total number of
+    # nodes they hold, which is what dominates memory.
+
+    def __init__(self, max_entries=1024, max_nodes=2_000_000):
+        self.max_entries = max_entries
+        self.max_nodes = max_nodes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._nodes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        tree = self._entries.get(key)
+        if tree is None:
+            self.misses += 1
+            instrumentation.count("route_cache.misses")
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        instrumentation.count("route_cache.hits")
+        return tree
+
+    def put(self, key, tree: tuple):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = tree
+        self._nodes += len(tree[0])
+        while self._entries and (
+            len(self._entries) > self.max_entries or
+            self._nodes > self.max_nodes
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        tree = self._entries.pop(key)
+        self._nodes -= len(tree[0])
+
+    def scope(self, scope):
+        return _ScopedCache(self, scope)
+
+    def invalidate_source(self, source):
+        # Drop trees rooted at a node, e.g. a runner's previous intersection
+        for key in [key for key in self._entries if key[1] == source]:
+            self._remove(key)
+
+    def invalidate_street(self, street):
+        # A changed street can only affect trees that reached one of its ends
+        for key in [
+            key for key, tree in self._entries.items()
+            if street.source in tree[0] or street.target in tree[0]
+        ]:
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._nodes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "nodes": self._nodes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+class _ScopedCache:
+    # Mapping of source node -> tree for one scope, used by Pathfinder._tree
+
+    def __init__(self, cache: RouteCache, scope):
+        self._cache = cache
+        self._scope = scope
+
+    def get(self, source):
+        return self._cache.get((self._scope, source))
+
+    def __setitem__(self, source, tree: tuple):
+        self._cache.put((self._scope, source), tree)
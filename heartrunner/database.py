@@ -1,15 +1,27 @@
 import logging
-from random import sample
+from random import Random
 from neo4j import GraphDatabase, Transaction
-from geopy.distance import great_circle
+from . import instrumentation, snapshot
 from .types import *
-from .pathfinder import Pathfinder
+from .pathfinder import Pathfinder, Task
+from .cache import RouteCache
+from .network import RoadNetwork, bounding_box, union_box, DISTRICT
+from .spatial import EARTH_RADIUS, ADMISSIBLE_RADIUS
+from .network import INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH, AEDS_CSV_PATH
+from .util import iter_csv, iter_batches
 
 
 class HeartrunnerDB:
 
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(self, uri=None, user=None, password=None, cache: RouteCache = None, driver=None):
+        # A driver can be passed in, e.g. heartrunner.memory.MemoryDriver in
+        # tests, in which case uri and auth are unused
+        if driver is None:
+            driver = GraphDatabase.driver(uri, auth=(user, password))
+        self.driver = driver
+        self.network: RoadNetwork = None
+        # Shared by every pathfinder handed out, see RouteCache
+        self.cache = cache
 
     def __enter__(self):
         return self
@@ -24,64 +36,95 @@ class HeartrunnerDB:
                 return result
             except:
                 logging.exception(" Error while executing __batch_query")
+                instrumentation.count("db.errors", operation="batch_query")
                 return None
 
-    def generate_runners(self, n=1):
-        count = self.count_nodes(NodeType.Intersection)
-        n = count if n > count else n
-        
-        runners: list[Runner] = []
-        batch = []
-        ids = sample(range(count), n)
-        for id in ids:
-            runner = Runner(intersection_id=id)
-            runners.append(runner)
-            batch.append(vars(runner))
-
-        query = (
-            "UNWIND $batch AS row "
-            "MATCH (i:Intersection) WHERE i.id = row.intersection_id "
-            "MERGE (r:Runner {id: row.id, speed: row.speed})-[:LocatedAt]->(i) "
-        )
-        self.__batch_query(query, batch)
+    def get_intersection_ids(self):
+        if self.network is not None:
+            return list(self.network.ids)
+        with self.driver.session(database="neo4j") as session:
+            try:
+                return [record["id"] for record in session.run(_INTERSECTION_IDS_QUERY)]
+            except:
+                logging.exception(" Error while executing get_intersection_ids")
+                instrumentation.count("db.errors", operation="get_intersection_ids")
+                return None
+
+    def __next_id(self, node_type: NodeType):
+        with self.driver.session(database="neo4j") as session:
+            try:
+                return session.run(
+                    f"MATCH (n:{node_type.name}) RETURN coalesce(max(n.id), 0) + 1 AS id").single()["id"]
+            except:
+                logging.exception(" Error while executing next_id")
+                instrumentation.count("db.errors", operation="next_id")
+                return None
+
+    @instrumentation.timed("db.generate_runners")
+    def generate_runners(self, n=1, seed=None):
+        # Runners on n distinct random intersections, numbered on from the
+        # highest runner id so repeated calls never clash
+        rng = Random(seed)
+        ids = self.get_intersection_ids()
+        start = self.__next_id(NodeType.Runner)
+        if ids is None or start is None:
+            return None
+        runners = [
+            Runner(id=start + k, speed=rng.randrange(3, 6), intersection_id=id)
+            for k, id in enumerate(rng.sample(ids, min(n, len(ids))))
+        ]
+        batch = [
+            {"id": runner.id, "speed": runner.speed, "intersection_id": runner.intersection_id}
+            for runner in runners
+        ]
+        self.__batch_query(_GENERATE_RUNNERS_QUERY, batch)
         return runners
 
-    def generate_patients(self, n=1):
-        count = self.count_nodes(NodeType.Intersection)
-        n = count if n > count else n
-
-        patients: list[Patient] = []
-        batch = []
-        ids = sample(range(count), n)
-        for id in ids:
-            patient = Patient(intersection_id=id)
-            patients.append(patient)
-            batch.append(vars(patient))
-
-        query = (
-            "UNWIND $batch AS row "
-            "MATCH (i:Intersection) WHERE i.id = row.intersection_id "
-            "MERGE (p:Patient {id: row.id})-[:LocatedAt]->(i) "
-        )
-        self.__batch_query(query, batch)
+    @instrumentation.timed("db.move_runners")
+    def move_runners(self, moves: list[tuple]):
+        # (runner id, intersection id) pairs, applied in one batched query.
+        # Pathfinders already handed out follow with Pathfinder.move_runner
+        batch = [
+            {"id": runner_id, "intersection_id": intersection_id}
+            for runner_id, intersection_id in moves
+        ]
+        return self.__batch_query(_MOVE_RUNNERS_QUERY, batch)
+
+    @instrumentation.timed("db.set_runner_available")
+    def set_runner_available(self, runner_ids: list[int], available=True):
+        # Unavailable runners stay in the database but are left out of every
+        # pathfinder, see Pathfinder.remove_runner for the in-memory side
+        batch = [{"id": runner_id, "available": available} for runner_id in runner_ids]
+        return self.__batch_query(_RUNNER_AVAILABLE_QUERY, batch)
+
+    @instrumentation.timed("db.generate_patients")
+    def generate_patients(self, n=1, seed=None):
+        rng = Random(seed)
+        ids = self.get_intersection_ids()
+        start = self.__next_id(NodeType.Patient)
+        if ids is None or start is None:
+            return None
+        patients = [
+            Patient(id=start + k, intersection_id=id)
+            for k, id in enumerate(rng.sample(ids, min(n, len(ids))))
+        ]
+        batch = [
+            {"id": patient.id, "intersection_id": patient.intersection_id}
+            for patient in patients
+        ]
+        self.__batch_query(_GENERATE_PATIENTS_QUERY, batch)
         return patients
 
     def get_node(self, node_type: NodeType, node_id: int):
         with self.driver.session(database="neo4j") as session:
             try:
                 result = session.run(
-                    f"MATCH (n:{node_type.name})--(m) WHERE n.id = {node_id} RETURN n, m").peek()
-                match node_type:
-                    case NodeType.Patient:
-                        return Patient.from_record(result)
-                    case NodeType.Runner:
-                        return Runner.from_record(result)
-                    case NodeType.AED:
-                        return AED.from_record(result)
-                    case NodeType.Intersection:
-                        return Intersection.from_record(result)
+                    f"MATCH (n:{node_type.name})--(m) WHERE n.id = $id RETURN n, m",
+                    id=node_id).peek()
+                return _node_from_record(node_type, result)
             except:
                 logging.exception(" Error while executing get_node")
+                instrumentation.count("db.errors", operation="get_node")
                 return None
 
     def get_nodes(self, node_type: NodeType, limit=0):
@@ -93,18 +136,11 @@ class HeartrunnerDB:
                 result = session.run(query)
                 nodes = []
                 for record in result:
-                    match node_type:
-                        case NodeType.Patient:
-                            nodes.append(Patient.from_record(record))
-                        case NodeType.Runner:
-                            nodes.append(Runner.from_record(record))
-                        case NodeType.AED:
-                            nodes.append(AED.from_record(record))
-                        case NodeType.Intersection:
-                            nodes.append(Intersection.from_record(record))
+                    nodes.append(_node_from_record(node_type, record))
                 return nodes
             except:
                 logging.exception(" Error while executing get_nodes")
+                instrumentation.count("db.errors", operation="get_nodes")
                 return None
 
     def delete_nodes(self, node_type: NodeType):
@@ -115,6 +151,7 @@ class HeartrunnerDB:
                 return result
             except:
                 logging.exception(" Error while executing delete_nodes")
+                instrumentation.count("db.errors", operation="delete_nodes")
                 return None
 
     def count_nodes(self, node_type: NodeType):
@@ -125,80 +162,642 @@ class HeartrunnerDB:
                 return result['count(n)']
             except:
                 logging.exception(" Error while executing count_nodes")
+                instrumentation.count("db.errors", operation="count_nodes")
                 return None
 
-    def get_pathfinder(self, patient: Patient, kilometers=1):
+    def load_network(self, network: RoadNetwork = None):
+        # Keep the street network in memory so get_pathfinder only has to
+        # fetch runners, either from a given network or read once from neo4j
+        if network is None:
+            network = self.get_network()
+        self.network = network
+        return network
+
+    @instrumentation.timed("db.get_network")
+    def get_network(self):
+        with self.driver.session(database="neo4j") as session:
+            try:
+                return session.execute_read(self.__get_network)
+            except:
+                logging.exception(" Error while executing get_network")
+                instrumentation.count("db.errors", operation="get_network")
+                return None
+
+    @staticmethod
+    def __get_network(tx: Transaction):
+        return _network_from_records(
+            _read(tx, _NETWORK_INTERSECTIONS_QUERY),
+            _read(tx, _NETWORK_STREETS_QUERY),
+            _read(tx, _NETWORK_AEDS_QUERY)
+        )
+
+    @instrumentation.timed("db.import_csv")
+    def import_csv(
+        self,
+        intersections_path=INTERSECTIONS_CSV_PATH,
+        streets_path=STREETS_CSV_PATH,
+        aeds_path=AEDS_CSV_PATH,
+        batch_size=10_000
+    ):
+        # Load the CSVs written by util.parse_geojson with batched UNWIND
+        # queries, reading each file as a stream. Indexes are created first
+        # so every street and AED batch looks up its intersections by index
+        self.create_indexes()
+        intersections = (
+            {"id": int(row["id"]), "latitude": float(row["latitude"]), "longitude": float(row["longitude"])}
+            for row in iter_csv(intersections_path)
+        )
+        for batch in iter_batches(intersections, batch_size):
+            self.__batch_query(_IMPORT_INTERSECTIONS_QUERY, batch)
+
+        streets = (
+            {
+                "id": int(row["id"]),
+                "head_id": int(row["head_id"]),
+                "tail_id": int(row["tail_id"]),
+                "length": float(row["length"]),
+                "geometry": row["geometry"]
+            }
+            for row in iter_csv(streets_path)
+        )
+        for batch in iter_batches(streets, batch_size):
+            self.__batch_query(_IMPORT_STREETS_QUERY, batch)
+
+        aeds = (
+            {
+                "id": int(row["id"]),
+                "intersection_id": int(row["intersection_id"]),
+                "in_use": row["in_use"].lower() == "true",
+                "open_hour": int(row["open_hour"]),
+                "close_hour": int(row["close_hour"])
+            }
+            for row in iter_csv(aeds_path)
+        )
+        for batch in iter_batches(aeds, batch_size):
+            self.__batch_query(_IMPORT_AEDS_QUERY, batch)
+
+    def create_indexes(self):
+        # Range indexes the parameterized subgraph and lookup queries rely on.
+        # Bounding box queries seek on latitude and filter on longitude
+        with self.driver.session(database="neo4j") as session:
+            try:
+                for query in _INDEX_QUERIES:
+                    session.run(query).consume()
+                session.run("CALL db.awaitIndexes()").consume()
+                return True
+            except:
+                logging.exception(" Error while executing create_indexes")
+                instrumentation.count("db.errors", operation="create_indexes")
+                return None
+
+    @instrumentation.timed("db.get_pathfinder")
+    def get_pathfinder(self, patient: Patient, kilometers=1, projected=False):
+        # With projected=True only the columns routing needs are fetched and
+        # street geometry is left out, see load_geometries
+        if self.network is not None:
+            return self.__get_network_pathfinder(patient, kilometers)
+
         with self.driver.session(database="neo4j") as session:
             try:
                 location = self.get_node(
                     NodeType.Intersection, patient.intersection_id).coords()
-                dist_limit = great_circle(kilometers=kilometers)
-                north_limit = tuple(dist_limit.destination(location, 0))
-                south_limit = tuple(dist_limit.destination(location, 180))
-                east_limit = tuple(dist_limit.destination(location, 90))
-                west_limit = tuple(dist_limit.destination(location, 270))
-                limits = (north_limit[0], south_limit[0],
-                          east_limit[1], west_limit[1])
+                limits = bounding_box(location, kilometers, snap=self.__snap())
 
                 pf = session.execute_read(
-                    self.__get_pathfinder, limits, patient)
+                    self.__read_pathfinder(projected), limits, patient, self.cache)
                 return pf
             except:
                 logging.exception(" Error while executing get_subgraph")
+                instrumentation.count("db.errors", operation="get_subgraph")
+                return None
+
+    @instrumentation.timed("db.get_pathfinders")
+    def get_pathfinders(self, patients: list[Patient], kilometers=1, projected=False):
+        # One subgraph covering every patient's box, fetched in a single
+        # query and shared by the returned pathfinders, see
+        # Pathfinder.calculate_tasks_batch
+        if not patients:
+            return []
+        if self.network is not None:
+            pfs = self.network.pathfinders(patients, kilometers, self.cache)
+            self.__add_runners(pfs[0])
+            return pfs
+
+        with self.driver.session(database="neo4j") as session:
+            try:
+                result = session.run(
+                    "UNWIND $ids AS id "
+                    "MATCH (i:Intersection) WHERE i.id = id "
+                    "RETURN i.latitude AS latitude, i.longitude AS longitude ",
+                    ids=list({patient.intersection_id for patient in patients})
+                )
+                limits = union_box([
+                    bounding_box((record["latitude"], record["longitude"]),
+                                 kilometers, snap=self.__snap())
+                    for record in result
+                ])
+
+                pf = session.execute_read(
+                    self.__read_pathfinder(projected), limits, None, self.cache)
+                return [pf.for_patient(patient) for patient in patients]
+            except:
+                logging.exception(" Error while executing get_pathfinders")
+                instrumentation.count("db.errors", operation="get_pathfinders")
+                return None
+
+    @instrumentation.timed("db.get_adaptive_pathfinder")
+    def get_adaptive_pathfinder(
+        self,
+        patient: Patient,
+        n_runners=20,
+        n_aeds=3,
+        kilometers=0.25,
+        max_kilometers=4,
+        growth=2,
+        at=None
+    ):
+        # Pathfinder over the smallest box, grown from kilometers by growth,
+        # in which n_runners runners and n_aeds AEDs available at the
+        # dispatch time are reachable within the box's exact radius, see
+        # _adaptive_boxes. Each step only fetches the ring around the
+        # previous box. Stops at max_kilometers with whatever was found
+        with self.driver.session(database="neo4j") as session:
+            try:
+                if self.network is not None:
+                    location = self.network.location(patient.intersection_id)
+                else:
+                    location = self.get_node(
+                        NodeType.Intersection, patient.intersection_id).coords()
+
+                pf = None
+                runners = []
+                for limits, inner, radius in _adaptive_boxes(
+                        location, kilometers, max_kilometers, growth, snap=self.__snap()):
+                    params = _ring_params(limits, inner)
+                    if self.network is not None:
+                        # Streets and AEDs are in memory, only runners are fetched
+                        runners += [
+                            Runner(id=id, speed=speed, intersection_id=intersection_id)
+                            for id, intersection_id, speed in
+                            session.execute_read(self.__read_ring_runners, params)
+                        ]
+                        pf = self.network.pathfinder(patient, limits=limits, cache=self.cache)
+                        for runner in runners:
+                            pf.add_runner(runner)
+                    else:
+                        streets, aeds, ring_runners = session.execute_read(self.__read_ring, params)
+                        pf = _projected_pathfinder_from_records(
+                            streets, aeds, ring_runners, limits, patient, self.cache, pf)
+                    found_runners, found_aeds = pf.coverage(radius, at=at)
+                    if found_runners >= n_runners and found_aeds >= n_aeds:
+                        return pf
+                logging.warning(
+                    f" Only {found_runners} runners and {found_aeds} AEDs within "
+                    f"{max_kilometers} km of {patient}")
+                return pf
+            except:
+                logging.exception(" Error while executing get_adaptive_pathfinder")
+                instrumentation.count("db.errors", operation="get_adaptive_pathfinder")
                 return None
 
     @staticmethod
-    def __get_pathfinder(tx: Transaction, limits: tuple, patient: Patient):
-        query = (
-            "MATCH (i1:Intersection)-[s:Streetsegment]-(i2:Intersection) "
-            f"WHERE i1.latitude <= {limits[0]} AND i1.latitude >= {limits[1]} AND i1.longitude <= {limits[2]} AND i1.longitude >= {limits[3]} "
-            "OPTIONAL MATCH (i1)-[:LocatedAt]-(a:AED) "
-            "OPTIONAL MATCH (i1)-[:LocatedAt]-(r:Runner) "
-            "RETURN i1, i2, s, a, r "
+    def __read_ring(tx: Transaction, params: dict):
+        streets = _read(tx, _RING_STREETS_QUERY, params)
+        aeds = _read(tx, _RING_AEDS_QUERY, params)[0]["aeds"]
+        runners = _read(tx, _RING_RUNNERS_QUERY, params)[0]["runners"]
+        return streets, aeds, runners
+
+    @staticmethod
+    def __read_ring_runners(tx: Transaction, params: dict):
+        return _read(tx, _RING_RUNNERS_QUERY, params)[0]["runners"]
+
+    def __get_network_pathfinder(self, patient: Patient, kilometers=1):
+        pf = self.network.pathfinder(patient, kilometers, cache=self.cache)
+        return self.__add_runners(pf)
+
+    def __add_runners(self, pf):
+        with self.driver.session(database="neo4j") as session:
+            try:
+                query, params = _runners_query(pf.limits)
+                for record in _read(session, query, params):
+                    pf.add_runner(_runner_from_record(record))
+                return pf
+            except:
+                logging.exception(" Error while executing get_subgraph")
+                instrumentation.count("db.errors", operation="get_subgraph")
+                return None
+
+    @instrumentation.timed("db.load_geometries")
+    def load_geometries(self, tasks: list[Task]):
+        # Fill in the geometry of every street on the tasks' paths that was
+        # fetched without it, in one query, before calling geojson()
+        streets = {}
+        for task in tasks:
+            for path in [task.patient_path, *task.aed_paths]:
+                for street in path.streets:
+                    if street.geometry is None:
+                        streets.setdefault(street.id, []).append(street)
+        if not streets:
+            return tasks
+
+        with self.driver.session(database="neo4j") as session:
+            try:
+                result = session.run(_GEOMETRY_QUERY, ids=list(streets))
+                for record in result:
+                    if record["geometry"] is None:
+                        continue
+                    for street in streets[record["id"]]:
+                        street.geometry = record["geometry"]
+                return tasks
+            except:
+                logging.exception(" Error while executing load_geometries")
+                instrumentation.count("db.errors", operation="load_geometries")
+                return None
+
+    @instrumentation.timed("db.export_snapshot")
+    def export_snapshot(self, path, runners=True):
+        # Write the network, its street geometry and optionally the current
+        # runners to a snapshot file, see heartrunner.snapshot
+        network = self.get_network()
+        if network is None:
+            return None
+        with self.driver.session(database="neo4j") as session:
+            try:
+                geometries = {
+                    record["id"]: record["geometry"]
+                    for record in session.run(_ALL_GEOMETRIES_QUERY)
+                    if record["geometry"] is not None
+                }
+            except:
+                logging.exception(" Error while executing export_snapshot")
+                instrumentation.count("db.errors", operation="export_snapshot")
+                return None
+        runner_nodes = self.get_nodes(NodeType.Runner) if runners else []
+        if runner_nodes is None:
+            return None
+        return snapshot.write(path, network, runner_nodes, geometries)
+
+    def __read_pathfinder(self, projected: bool):
+        return self.__get_projected_pathfinder if projected else self.__get_pathfinder
+
+    def __snap(self):
+        return DISTRICT if self.cache is not None else None
+
+    @staticmethod
+    def __get_pathfinder(tx: Transaction, limits: tuple, patient: Patient, cache: RouteCache = None):
+        query, params = _subgraph_query(limits)
+        result = tx.run(query, params)
+        return _pathfinder_from_records(result, limits, patient, cache)
+
+    @staticmethod
+    def __get_projected_pathfinder(tx: Transaction, limits: tuple, patient: Patient, cache: RouteCache = None):
+        params = _box_params(limits)
+        # Each result is read in full before the next query is sent
+        streets = _read(tx, _PROJECTED_STREETS_QUERY, params)
+        aeds = _read(tx, _PROJECTED_AEDS_QUERY, params)[0]["aeds"]
+        runners = _read(tx, _PROJECTED_RUNNERS_QUERY, params)[0]["runners"]
+        return _projected_pathfinder_from_records(
+            streets, aeds, runners, limits, patient, cache)
+
+
+# Queries and record parsing shared with AsyncHeartrunnerDB
+
+def _read(tx, query: str, params: dict = {}):
+    # Every record of a query, on a transaction or session, timed
+    with instrumentation.span("neo4j.query"):
+        records = list(tx.run(query, params))
+    instrumentation.count("neo4j.rows", len(records))
+    return records
+
+
+def _count_added(pf: Pathfinder, nodes: int, edges: int):
+    # Nodes and edges a record parser added to pf, from the sizes before
+    if instrumentation.enabled():
+        instrumentation.count("pathfinder.nodes_added", len(pf._nodes) - nodes)
+        instrumentation.count("pathfinder.edges_added", len(pf._edges) - edges)
+
+
+def _node_from_record(node_type: NodeType, record):
+    match node_type:
+        case NodeType.Patient:
+            return Patient.from_record(record)
+        case NodeType.Runner:
+            return Runner.from_record(record)
+        case NodeType.AED:
+            return AED.from_record(record)
+        case NodeType.Intersection:
+            return Intersection.from_record(record)
+
+
+_NETWORK_INTERSECTIONS_QUERY = (
+    "MATCH (i:Intersection) "
+    "RETURN i.id AS id, i.latitude AS latitude, i.longitude AS longitude "
+)
+_NETWORK_STREETS_QUERY = (
+    "MATCH (i1:Intersection)-[s:Streetsegment]->(i2:Intersection) "
+    "RETURN s.id AS id, i1.id AS head_id, i2.id AS tail_id, s.length AS length "
+)
+_NETWORK_AEDS_QUERY = (
+    "MATCH (a:AED)--(i:Intersection) "
+    "RETURN a.id AS id, i.id AS intersection_id, a.open_hour AS open_hour, "
+    "a.close_hour AS close_hour, a.in_use AS in_use "
+)
+
+
+def _network_from_records(intersections, streets, aeds):
+    return RoadNetwork(
+        [
+            (record["id"], record["latitude"], record["longitude"])
+            for record in intersections
+        ],
+        [
+            (record["id"], record["head_id"], record["tail_id"], record["length"], None)
+            for record in streets
+        ],
+        [
+            AED(
+                id=record["id"],
+                intersection_id=record["intersection_id"],
+                time_range=(record["open_hour"], record["close_hour"]),
+                in_use=record["in_use"]
+            )
+            for record in aeds
+        ]
+    )
+
+
+_INDEX_QUERIES = [
+    "CREATE INDEX intersection_id IF NOT EXISTS FOR (n:Intersection) ON (n.id)",
+    "CREATE INDEX intersection_latitude IF NOT EXISTS FOR (n:Intersection) ON (n.latitude)",
+    "CREATE INDEX intersection_longitude IF NOT EXISTS FOR (n:Intersection) ON (n.longitude)",
+    "CREATE INDEX runner_id IF NOT EXISTS FOR (n:Runner) ON (n.id)",
+    "CREATE INDEX aed_id IF NOT EXISTS FOR (n:AED) ON (n.id)",
+    "CREATE INDEX patient_id IF NOT EXISTS FOR (n:Patient) ON (n.id)",
+    "CREATE INDEX streetsegment_id IF NOT EXISTS FOR ()-[s:Streetsegment]-() ON (s.id)"
+]
+
+
+_IMPORT_INTERSECTIONS_QUERY = (
+    "UNWIND $batch AS row "
+    "CREATE (:Intersection {id: row.id, latitude: row.latitude, longitude: row.longitude}) "
+)
+_IMPORT_STREETS_QUERY = (
+    "UNWIND $batch AS row "
+    "MATCH (i1:Intersection {id: row.head_id}), (i2:Intersection {id: row.tail_id}) "
+    "CREATE (i1)-[:Streetsegment {id: row.id, length: row.length, geometry: row.geometry}]->(i2) "
+)
+_IMPORT_AEDS_QUERY = (
+    "UNWIND $batch AS row "
+    "MATCH (i:Intersection {id: row.intersection_id}) "
+    "CREATE (:AED {id: row.id, in_use: row.in_use, open_hour: row.open_hour, "
+    "close_hour: row.close_hour})-[:LocatedAt]->(i) "
+)
+
+
+_INTERSECTION_IDS_QUERY = "MATCH (i:Intersection) RETURN i.id AS id "
+_GENERATE_RUNNERS_QUERY = (
+    "UNWIND $batch AS row "
+    "MATCH (i:Intersection {id: row.intersection_id}) "
+    "CREATE (:Runner {id: row.id, speed: row.speed})-[:LocatedAt]->(i) "
+)
+_GENERATE_PATIENTS_QUERY = (
+    "UNWIND $batch AS row "
+    "MATCH (i:Intersection {id: row.intersection_id}) "
+    "CREATE (:Patient {id: row.id})-[:LocatedAt]->(i) "
+)
+
+
+_MOVE_RUNNERS_QUERY = (
+    "UNWIND $batch AS row "
+    "MATCH (r:Runner {id: row.id}), (i:Intersection {id: row.intersection_id}) "
+    "OPTIONAL MATCH (r)-[l:LocatedAt]->() "
+    "DELETE l "
+    "MERGE (r)-[:LocatedAt]->(i) "
+)
+_RUNNER_AVAILABLE_QUERY = (
+    "UNWIND $batch AS row "
+    "MATCH (r:Runner {id: row.id}) "
+    "SET r.available = row.available "
+)
+# Runners without the property were never marked unavailable
+_AVAILABLE = "coalesce(r.available, true)"
+
+
+def _inside(var: str, box=""):
+    # Bounding box predicate on an intersection, see _box_params
+    return (
+        f"{var}.latitude <= ${box}north AND {var}.latitude >= ${box}south "
+        f"AND {var}.longitude <= ${box}east AND {var}.longitude >= ${box}west"
+    )
+
+
+def _box_params(limits: tuple, box=""):
+    return dict(zip((f"{box}north", f"{box}south", f"{box}east", f"{box}west"), limits))
+
+
+def _runners_query(limits: tuple = None):
+    query = "MATCH (r:Runner)-[:LocatedAt]-(i:Intersection) "
+    params = {}
+    if limits is not None:
+        query += f"WHERE {_inside('i')} AND {_AVAILABLE} "
+        params = _box_params(limits)
+    else:
+        query += f"WHERE {_AVAILABLE} "
+    query += "RETURN r.id AS id, r.speed AS speed, i.id AS intersection_id "
+    return query, params
+
+
+def _runner_from_record(record):
+    return Runner(
+        id=record["id"],
+        speed=record["speed"],
+        intersection_id=record["intersection_id"]
+    )
+
+
+def _subgraph_query(limits: tuple):
+    query = (
+        "MATCH (i1:Intersection)-[s:Streetsegment]-(i2:Intersection) "
+        f"WHERE {_inside('i1')} "
+        "OPTIONAL MATCH (i1)-[:LocatedAt]-(a:AED) "
+        f"OPTIONAL MATCH (i1)-[:LocatedAt]-(r:Runner) WHERE {_AVAILABLE} "
+        "RETURN i1, i2, s, a, r "
+    )
+    return query, _box_params(limits)
+
+
+# Projected subgraph: scalar columns only and no geometry. A street with
+# both ends in the box is returned once rather than once per direction, and
+# AEDs and runners come back as a single aggregated row each instead of
+# being repeated on every street of their intersection
+_PROJECTED_STREETS_QUERY = (
+    "MATCH (i1:Intersection)-[s:Streetsegment]-(i2:Intersection) "
+    f"WHERE {_inside('i1')} AND (i1.id < i2.id OR NOT ({_inside('i2')})) "
+    "RETURN s.id AS id, s.length AS length, "
+    "i1.id AS i1_id, i1.latitude AS i1_latitude, i1.longitude AS i1_longitude, "
+    "i2.id AS i2_id, i2.latitude AS i2_latitude, i2.longitude AS i2_longitude "
+)
+_PROJECTED_AEDS_QUERY = (
+    "MATCH (a:AED)-[:LocatedAt]-(i:Intersection) "
+    f"WHERE {_inside('i')} "
+    "RETURN collect([a.id, i.id, a.open_hour, a.close_hour, a.in_use]) AS aeds "
+)
+_PROJECTED_RUNNERS_QUERY = (
+    "MATCH (r:Runner)-[:LocatedAt]-(i:Intersection) "
+    f"WHERE {_inside('i')} AND {_AVAILABLE} "
+    "RETURN collect([r.id, i.id, r.speed]) AS runners "
+)
+# Ring between a box and the box inside it, the part of a grown box that
+# was not fetched yet. Streets with an end in the inner box already were
+_RING_STREETS_QUERY = (
+    "MATCH (i1:Intersection)-[s:Streetsegment]-(i2:Intersection) "
+    f"WHERE {_inside('i1')} AND NOT ({_inside('i1', 'inner_')}) "
+    f"AND NOT ({_inside('i2', 'inner_')}) "
+    f"AND (i1.id < i2.id OR NOT ({_inside('i2')})) "
+    "RETURN s.id AS id, s.length AS length, "
+    "i1.id AS i1_id, i1.latitude AS i1_latitude, i1.longitude AS i1_longitude, "
+    "i2.id AS i2_id, i2.latitude AS i2_latitude, i2.longitude AS i2_longitude "
+)
+_RING_AEDS_QUERY = (
+    "MATCH (a:AED)-[:LocatedAt]-(i:Intersection) "
+    f"WHERE {_inside('i')} AND NOT ({_inside('i', 'inner_')}) "
+    "RETURN collect([a.id, i.id, a.open_hour, a.close_hour, a.in_use]) AS aeds "
+)
+_RING_RUNNERS_QUERY = (
+    "MATCH (r:Runner)-[:LocatedAt]-(i:Intersection) "
+    f"WHERE {_inside('i')} AND NOT ({_inside('i', 'inner_')}) AND {_AVAILABLE} "
+    "RETURN collect([r.id, i.id, r.speed]) AS runners "
+)
+# Contains nothing, the inner box of the first ring
+_NO_BOX = (-90.0, 90.0, -180.0, 180.0)
+# Keeps the exact radius of a box clear of rounding in bounding_box
+_RADIUS_MARGIN = 0.999
+
+
+def _ring_params(limits: tuple, inner: tuple):
+    params = _box_params(limits)
+    params.update(_box_params(inner, "inner_"))
+    return params
+
+
+def _adaptive_boxes(location: tuple, kilometers: float, max_kilometers: float, growth: float, snap: float = None):
+    # (limits, inner limits, radius) of boxes around location growing from
+    # kilometers to max_kilometers. Streets are never shorter than the
+    # straight line, so no path shorter than radius meters from location
+    # leaves its box and network distances up to radius are exact. With
+    # snap the boxes are widened as in bounding_box, so patients in one
+    # district share them and their cached routes. A snapped box is given
+    # once, with the largest radius of the steps it covers
+    steps = [kilometers]
+    while steps[-1] < max_kilometers:
+        steps.append(min(steps[-1] * growth, max_kilometers))
+    boxes = [bounding_box(location, step, snap=snap) for step in steps]
+    inner = _NO_BOX
+    for k, (step, limits) in enumerate(zip(steps, boxes)):
+        if k + 1 < len(boxes) and boxes[k + 1] == limits:
+            continue
+        yield limits, inner, step * 1000 * ADMISSIBLE_RADIUS / EARTH_RADIUS * _RADIUS_MARGIN
+        inner = limits
+
+
+_GEOMETRY_QUERY = (
+    "UNWIND $ids AS id "
+    "MATCH ()-[s:Streetsegment]->() WHERE s.id = id "
+    "RETURN s.id AS id, s.geometry AS geometry "
+)
+_ALL_GEOMETRIES_QUERY = (
+    "MATCH ()-[s:Streetsegment]->() "
+    "RETURN s.id AS id, s.geometry AS geometry "
+)
+
+
+def _pathfinder_from_records(records, limits: tuple, patient: Patient, cache: RouteCache = None):
+    pf = Pathfinder(patient, cache)
+    pf.limits = limits
+    rows = 0
+    # Parse query response into a pathfinder instance
+    for record in records:
+        rows += 1
+        # MATCH (i1)-[s:Streetsegment]-(i2:Intersection)
+        i1_id = record['i1']['id']
+        i1_coord = (record['i1']['latitude'], record['i1']['longitude'])
+        i1 = Intersection(id=i1_id, coords=i1_coord)
+
+        i2_id = record['i2']['id']
+        i2_coord = (record['i2']['latitude'], record['i2']['longitude'])
+        i2 = Intersection(id=i2_id, coords=i2_coord)
+
+        s_id = record['s']['id']
+        s_length = record['s']['length']
+        s_geometry = record['s']['geometry']
+        s = Streetsegment(
+            id=s_id,
+            source=i1,
+            target=i2,
+            length=s_length,
+            geometry=s_geometry
         )
-        result = tx.run(query)
-        pf = Pathfinder(patient)
-        # Parse query response into a pathfinder instance
-        for record in result:
-            # MATCH (i1)-[s:Streetsegment]-(i2:Intersection)
-            i1_id = record['i1']['id']
-            i1_coord = (record['i1']['latitude'], record['i1']['longitude'])
-            i1 = Intersection(id=i1_id, coords=i1_coord)
-
-            i2_id = record['i2']['id']
-            i2_coord = (record['i2']['latitude'], record['i2']['longitude'])
-            i2 = Intersection(id=i2_id, coords=i2_coord)
-
-            s_id = record['s']['id']
-            s_length = record['s']['length']
-            s_geometry = record['s']['geometry']
-            s = Streetsegment(
-                id=s_id,
-                source=i1,
-                target=i2,
-                length=s_length,
-                geometry=s_geometry
+        pf.add_edge(edge=s)
+
+        # OPTIONAL MATCH (i1)--(a:AED)
+        if record['a']:
+            a_id = record['a']['id']
+            a_time_range = (record['a']['open_hour'],
+                            record['a']['close_hour'])
+            a_in_use = record['a']['in_use']
+            a = AED(
+                id=a_id,
+                intersection_id=i1_id,
+                time_range=a_time_range,
+                in_use=a_in_use
             )
-            pf.add_edge(edge=s)
-
-            # OPTIONAL MATCH (i1)--(a:AED)
-            if record['a']:
-                a_id = record['a']['id']
-                a_time_range = (record['a']['open_hour'],
-                                record['a']['close_hour'])
-                a_in_use = record['a']['in_use']
-                a = AED(
-                    id=a_id,
-                    intersection_id=i1_id,
-                    time_range=a_time_range,
-                    in_use=a_in_use
-                )
-                pf.add_aed(aed=a)
-
-            # OPTIONAL MATCH (i1)--(r:Runner)
-            if record['r']:
-                r_id = record['r']['id']
-                speed = record['r']['speed']
-                r = Runner(id=r_id, speed=speed, intersection_id=i1_id)
-                pf.add_runner(runner=r)
-        return pf
+            pf.add_aed(aed=a)
+
+        # OPTIONAL MATCH (i1)--(r:Runner)
+        if record['r']:
+            r_id = record['r']['id']
+            speed = record['r']['speed']
+            r = Runner(id=r_id, speed=speed, intersection_id=i1_id)
+            pf.add_runner(runner=r)
+    # The records are streamed, so neo4j.query is not timed on its own
+    instrumentation.count("neo4j.rows", rows)
+    _count_added(pf, 0, 0)
+    return pf
+
+
+def _projected_pathfinder_from_records(streets, aeds: list, runners: list, limits: tuple, patient: Patient, cache: RouteCache = None, pf: Pathfinder = None):
+    # Into a new pathfinder, or grows pf by a ring of records
+    if pf is None:
+        pf = Pathfinder(patient, cache)
+    pf.limits = limits
+    before = (len(pf._nodes), len(pf._edges))
+    nodes: dict[int, Intersection] = {}
+
+    def intersection(id, latitude, longitude):
+        node = nodes.get(id) or pf.get_node(id)
+        if node is None:
+            node = Intersection(id=id, coords=(latitude, longitude))
+        nodes[id] = node
+        return node
+
+    for record in streets:
+        pf.add_edge(edge=Streetsegment(
+            id=record["id"],
+            source=intersection(
+                record["i1_id"], record["i1_latitude"], record["i1_longitude"]),
+            target=intersection(
+                record["i2_id"], record["i2_latitude"], record["i2_longitude"]),
+            length=record["length"]
+        ))
+    for id, intersection_id, open_hour, close_hour, in_use in aeds:
+        pf.add_aed(aed=AED(
+            id=id,
+            intersection_id=intersection_id,
+            time_range=(open_hour, close_hour),
+            in_use=in_use
+        ))
+    for id, intersection_id, speed in runners:
+        pf.add_runner(runner=Runner(
+            id=id, speed=speed, intersection_id=intersection_id))
+    _count_added(pf, *before)
+    return pf
@@ -0,0 +1,203 @@
+import re
+import time
+import inspect
+import functools
+from contextlib import nullcontext
+from timeit import default_timer
+
+# Opt-in timings and counters for the dispatch hot path. Nothing is
+# recorded until a sink is added, and until then every hook is a single
+# check of the sink list, so instrumented code runs at full speed:
+#
+#   stats = instrumentation.add_sink(StatsRegistry())
+#   ...
+#   print(stats.snapshot())  or  print(prometheus(stats))
+#
+# Sinks receive spans, a named timed call with attributes, and counters.
+# Names are dotted, e.g. "pathfinder.astar" or "neo4j.rows".
+
+_sinks: list = []
+_NULL_SPAN = nullcontext()
+
+
+class Sink:
+    # Base class, override what the sink cares about
+
+    def span(self, name: str, start: float, end: float, attributes: dict):
+        pass
+
+    def count(self, name: str, value: float, attributes: dict):
+        pass
+
+
+def add_sink(sink: Sink):
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink: Sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def count(name: str, value: float = 1, **attributes):
+    if not _sinks:
+        return
+    for sink in _sinks:
+        sink.count(name, value, attributes)
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "start")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        end = default_timer()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        for sink in _sinks:
+            sink.span(self.name, self.start, end, self.attributes)
+        return False
+
+
+def span(name: str, **attributes):
+    # Context manager timing a block, a shared no-op when nothing records
+    if not _sinks:
+        return _NULL_SPAN
+    return _Span(name, attributes)
+
+
+def timed(name: str):
+    # Decorator form of span for functions and coroutines
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if not _sinks:
+                    return await function(*args, **kwargs)
+                with _Span(name, {}):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return function(*args, **kwargs)
+            with _Span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _key(name: str, attributes: dict):
+    return (name, tuple(sorted((k, str(v)) for k, v in attributes.items())))
+
+
+class StatsRegistry(Sink):
+    # In-process totals. Spans become timings with their count, sum and
+    # maximum, attributes (an error too) split them into series
+
+    def __init__(self):
+        self.counters: dict[tuple, float] = {}
+        self.timings: dict[tuple, list] = {}
+
+    def span(self, name: str, start: float, end: float, attributes: dict):
+        elapsed = end - start
+        key = _key(name, attributes)
+        timing = self.timings.get(key)
+        if timing is None:
+            self.timings[key] = [1, elapsed, elapsed]
+        else:
+            timing[0] += 1
+            timing[1] += elapsed
+            if elapsed > timing[2]:
+                timing[2] = elapsed
+
+    def count(self, name: str, value: float, attributes: dict):
+        key = _key(name, attributes)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def clear(self):
+        self.counters.clear()
+        self.timings.clear()
+
+    def snapshot(self):
+        def label(key):
+            name, attributes = key
+            if not attributes:
+                return name
+            return name + "{" + ",".join(f"{k}={v}" for k, v in attributes) + "}"
+
+        return {
+            "counters": {label(key): value for key, value in self.counters.items()},
+            "timings": {
+                label(key): {"count": n, "sum": total, "mean": total / n, "max": peak}
+                for key, (n, total, peak) in self.timings.items()
+            }
+        }
+
+
+def _metric(name: str):
+    return "heartrunner_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _labels(attributes: tuple):
+    if not attributes:
+        return ""
+    escaped = (
+        (re.sub(r"[^a-zA-Z0-9_]", "_", k), v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in attributes
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def prometheus(registry: StatsRegistry):
+    # Text exposition of a registry, counters as counters and timings as
+    # summaries in seconds, for a /metrics endpoint
+    lines = []
+    by_name: dict[str, list] = {}
+    for (name, attributes), value in sorted(registry.counters.items()):
+        by_name.setdefault(_metric(name) + "_total", []).append((attributes, value))
+    for metric, series in by_name.items():
+        lines.append(f"# TYPE {metric} counter")
+        lines += [f"{metric}{_labels(attributes)} {value}" for attributes, value in series]
+
+    by_name = {}
+    for (name, attributes), timing in sorted(registry.timings.items()):
+        by_name.setdefault(_metric(name) + "_seconds", []).append((attributes, timing))
+    for metric, series in by_name.items():
+        lines.append(f"# TYPE {metric} summary")
+        for attributes, (n, total, _) in series:
+            lines.append(f"{metric}_count{_labels(attributes)} {n}")
+            lines.append(f"{metric}_sum{_labels(attributes)} {total}")
+    return "\n".join(lines) + "\n"
+
+
+class SpanCallback(Sink):
+    # Hands every span to callback(name, start, end, attributes) with start
+    # and end in seconds since the epoch, e.g. to record an OpenTelemetry
+    # span with the same name, timestamps and attributes. With with_counts
+    # counters are passed on too, with start and end None
+
+    def __init__(self, callback, with_counts=False):
+        self.callback = callback
+        self.with_counts = with_counts
+        self._epoch = time.time() - default_timer()
+
+    def span(self, name: str, start: float, end: float, attributes: dict):
+        self.callback(name, start + self._epoch, end + self._epoch, attributes)
+
+    def count(self, name: str, value: float, attributes: dict):
+        if self.with_counts:
+            self.callback(name, None, None, {"value": value, **attributes})
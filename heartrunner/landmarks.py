@@ -0,0 +1,140 @@
+import math
+import heapq
+import random
+import struct
+import networkx as nx
+from array import array
+from .network import RoadNetwork
+
+_MAGIC = b"HRALT2"
+# Distances are stored as float32, keep bounds clear of the rounding
+_SLACK = 0.05
+
+
+def dijkstra(network: RoadNetwork, sources: list[int]):
+    # Distances from the nearest of some node indices to every node index
+    dist = [math.inf] * len(network)
+    heap = [(0.0, i) for i in sources]
+    for i in sources:
+        dist[i] = 0.0
+    offsets, targets, lengths = network.offsets, network.targets, network.lengths
+    while heap:
+        d, i = heapq.heappop(heap)
+        if d > dist[i]:
+            continue
+        for slot in range(offsets[i], offsets[i+1]):
+            j = targets[slot]
+            nd = d + lengths[slot]
+            if nd < dist[j]:
+                dist[j] = nd
+                heapq.heappush(heap, (nd, j))
+    return dist
+
+
+class Landmarks:
+    # ALT (A*, landmarks, triangle inequality) index over a RoadNetwork.
+    # For a landmark L, |d(L, t) - d(L, v)| never exceeds d(v, t), so the
+    # largest such difference over all landmarks is a consistent A* bound
+    # that is far tighter than straight line distance on a street network.
+    # The bound also holds on any subgraph, so searches can still be
+    # limited to a box.
+
+    def __init__(self, network: RoadNetwork, landmarks: list[int], distances: list[array]):
+        self.network = network
+        self.landmarks = landmarks
+        self.distances = distances
+
+    @staticmethod
+    def build(network: RoadNetwork, n=16, seed=0):
+        # Farthest landmark selection: each landmark is the node furthest
+        # from the ones picked so far, which spreads them along the edge of
+        # the city where they give the best bounds
+        rng = random.Random(seed)
+        start = rng.randrange(len(network))
+        dist = dijkstra(network, [start])
+        landmarks = []
+        distances = []
+        for _ in range(min(n, len(network))):
+            reachable = [(d, i) for i, d in enumerate(dist) if d < math.inf]
+            landmark = max(reachable)[1]
+            if landmark in landmarks:
+                break
+            landmarks.append(landmark)
+            from_landmark = dijkstra(network, [landmark])
+            distances.append(array("f", from_landmark))
+            dist = [min(a, b) for a, b in zip(dist, from_landmark)] if len(landmarks) > 1 else from_landmark
+        return Landmarks(network, landmarks, distances)
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(_MAGIC)
+            file.write(struct.pack("<ii", len(self.network), len(self.landmarks)))
+            file.write(self.network.fingerprint())
+            array("i", [self.network.ids[i] for i in self.landmarks]).tofile(file)
+            for distances in self.distances:
+                distances.tofile(file)
+
+    @staticmethod
+    def load(path, network: RoadNetwork):
+        with open(path, "rb") as file:
+            if file.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} is not a landmark index")
+            n_nodes, n_landmarks = struct.unpack("<ii", file.read(8))
+            # Bounds from another street graph, even of the same size, are
+            # not admissible and would give wrong routes
+            if n_nodes != len(network) or file.read(32) != network.fingerprint():
+                raise ValueError(f"{path} was built for another network")
+            ids = array("i")
+            ids.fromfile(file, n_landmarks)
+            distances = []
+            for _ in range(n_landmarks):
+                d = array("f")
+                d.fromfile(file, n_nodes)
+                distances.append(d)
+        return Landmarks(network, [network.index[id] for id in ids], distances)
+
+    def astar(self, source: int, target: int, limits: tuple = None):
+        # Shortest path between node indices, as a list of node indices.
+        # With limits only streets with an end inside them are used
+        net = self.network
+        offsets, targets, lengths = net.offsets, net.targets, net.lengths
+        # Only the landmark distances to the target are fixed per query
+        to_target = [(d, d[target]) for d in self.distances if d[target] < math.inf]
+        dist = {source: 0.0}
+        pred = {source: -1}
+        done = set()
+        heap = [(0.0, 0.0, source)]
+        while heap:
+            _, d, i = heapq.heappop(heap)
+            if i == target:
+                path = [i]
+                while pred[path[-1]] >= 0:
+                    path.append(pred[path[-1]])
+                return path[::-1]
+            if i in done:
+                continue
+            done.add(i)
+            inside = limits is None or net.inside(i, limits)
+            for slot in range(offsets[i], offsets[i+1]):
+                j = targets[slot]
+                if not inside and not net.inside(j, limits):
+                    continue
+                nd = d + lengths[slot]
+                if j not in dist or nd < dist[j]:
+                    dist[j] = nd
+                    pred[j] = i
+                    h = 0.0
+                    for dl, dt in to_target:
+                        dj = dl[j]
+                        diff = dj - dt if dj > dt else dt - dj
+                        if diff > h:
+                            h = diff
+                    h = h - _SLACK if h > _SLACK else 0.0
+                    heapq.heappush(heap, (nd + h, nd, j))
+        raise nx.NetworkXNoPath(f"Node {net.ids[target]} not reachable from {net.ids[source]}")
+
+    def astar_path(self, source_id: int, target_id: int, limits: tuple = None):
+        # Drop-in for nx.astar_path on intersection ids
+        net = self.network
+        path = self.astar(net.index[source_id], net.index[target_id], limits)
+        return [net.ids[i] for i in path]
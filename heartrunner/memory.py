@@ -0,0 +1,487 @@
+import re
+import random
+import asyncio
+import logging
+import threading
+from . import instrumentation
+from .types import *
+from .cache import RouteCache
+from .spatial import SpatialIndex
+from .network import RoadNetwork, bounding_box, union_box, enclosing_circle, DISTRICT
+from . import database as _db
+from .database import _projected_pathfinder_from_records
+
+
+def _street_records(net: RoadNetwork, nodes, limits: tuple = None, inner: tuple = None):
+    # The rows of _PROJECTED_STREETS_QUERY for some node indices of a box:
+    # each street once, from its smaller end if both ends are in the box,
+    # and none with an end in the inner box
+    streets = []
+    for i in nodes:
+        i_id = net.ids[i]
+        for slot in range(net.offsets[i], net.offsets[i+1]):
+            j = net.targets[slot]
+            j_id = net.ids[j]
+            if inner is not None and net.inside(j, inner):
+                continue
+            if i_id < j_id or (limits is not None and not net.inside(j, limits)):
+                streets.append({
+                    "id": net.edge_ids[slot],
+                    "length": net.lengths[slot],
+                    "i1_id": i_id,
+                    "i1_latitude": net.latitudes[i],
+                    "i1_longitude": net.longitudes[i],
+                    "i2_id": j_id,
+                    "i2_latitude": net.latitudes[j],
+                    "i2_longitude": net.longitudes[j]
+                })
+    return streets
+
+
+def _aed_row(aed: AED):
+    return [aed.id, aed.intersection_id, aed.open_hour, aed.close_hour, aed.in_use]
+
+
+def _runner_row(runner: Runner):
+    return [runner.id, runner.intersection_id, runner.speed]
+
+
+class MemoryHeartrunnerDB:
+    # HeartrunnerDB's read path over a RoadNetwork held in memory, for
+    # benchmarks and local runs without neo4j. Subgraphs are served as the
+    # records of the projected queries and parsed by the same code, so
+    # fetching and building a pathfinder can be timed on their own.
+    # Runners and patients are generated from a seed. Runner updates and
+    # reads are locked, so dispatches may run on several threads.
+
+    def __init__(self, store: RoadNetwork, cache: RouteCache = None):
+        self.store = store
+        # Built up front, not by the first subgraph fetch
+        store._intersections()
+        self.network: RoadNetwork = None
+        self.cache = cache
+        self.runners: dict[int, Runner] = {}
+        self.patients: dict[int, Patient] = {}
+        self._unavailable = set()
+        self._runner_index = SpatialIndex()
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    def generate_runners(self, n=1, seed=None):
+        rng = random.Random(seed)
+        ids = rng.sample(list(self.store.ids), min(n, len(self.store)))
+        start = max(self.runners, default=0) + 1
+        runners = [
+            Runner(id=start + k, speed=rng.randrange(3, 6), intersection_id=id)
+            for k, id in enumerate(ids)
+        ]
+        for runner in runners:
+            self.add_runner(runner)
+        return runners
+
+    def add_runner(self, runner: Runner):
+        with self._lock:
+            self.runners[runner.id] = runner
+            self._runner_index.insert(runner.id, self.store.location(runner.intersection_id))
+
+    def move_runners(self, moves: list[tuple]):
+        with self._lock:
+            for runner_id, intersection_id in moves:
+                runner = self.runners.get(runner_id)
+                if runner is not None:
+                    runner.intersection_id = intersection_id
+                    self.add_runner(runner)
+
+    def set_runner_available(self, runner_ids: list[int], available=True):
+        with self._lock:
+            if available:
+                self._unavailable.difference_update(runner_ids)
+            else:
+                self._unavailable.update(runner_ids)
+
+    def generate_patients(self, n=1, seed=None):
+        rng = random.Random(seed)
+        ids = rng.sample(list(self.store.ids), min(n, len(self.store)))
+        start = max(self.patients, default=0) + 1
+        patients = [Patient(id=start + k, intersection_id=id) for k, id in enumerate(ids)]
+        for patient in patients:
+            self.patients[patient.id] = patient
+        return patients
+
+    def delete_nodes(self, node_type: NodeType):
+        match node_type:
+            case NodeType.Runner:
+                with self._lock:
+                    self.runners.clear()
+                    self._unavailable.clear()
+                    self._runner_index = SpatialIndex()
+            case NodeType.Patient:
+                self.patients.clear()
+
+    def count_nodes(self, node_type: NodeType):
+        match node_type:
+            case NodeType.Runner:
+                return len(self.runners)
+            case NodeType.Patient:
+                return len(self.patients)
+            case NodeType.AED:
+                return len(self.store.aeds)
+            case NodeType.Intersection:
+                return len(self.store)
+
+    def get_nodes(self, node_type: NodeType, limit=0):
+        match node_type:
+            case NodeType.Runner:
+                nodes = list(self.runners.values())
+            case NodeType.Patient:
+                nodes = list(self.patients.values())
+            case NodeType.AED:
+                nodes = list(self.store.aeds.values())
+            case NodeType.Intersection:
+                nodes = [self.store.intersection(id) for id in self.store.ids]
+        return nodes[:limit] if limit > 0 else nodes
+
+    def get_intersection_ids(self):
+        return list(self.store.ids)
+
+    def get_node(self, node_type: NodeType, node_id: int):
+        match node_type:
+            case NodeType.Runner:
+                return self.runners.get(node_id)
+            case NodeType.Patient:
+                return self.patients.get(node_id)
+            case NodeType.AED:
+                return self.store.aeds.get(node_id)
+            case NodeType.Intersection:
+                if node_id in self.store.index:
+                    return self.store.intersection(node_id)
+        return None
+
+    def load_network(self, network: RoadNetwork = None):
+        if network is None:
+            network = self.get_network()
+        self.network = network
+        return network
+
+    def get_network(self):
+        return self.store
+
+    def fetch_subgraph(self, limits: tuple):
+        # The records _PROJECTED_STREETS_QUERY, _PROJECTED_AEDS_QUERY and
+        # _PROJECTED_RUNNERS_QUERY return for limits
+        net = self.store
+        streets = _street_records(net, net.intersections_inside(limits), limits)
+
+        aeds = []
+        for _, aed_id in net._aed_index.within(*enclosing_circle(limits)):
+            aed = net.aeds[aed_id]
+            if net.inside(net.index[aed.intersection_id], limits):
+                aeds.append(_aed_row(aed))
+        return streets, aeds, self.__runners_inside(limits)
+
+    def __runners_inside(self, limits: tuple):
+        net = self.store
+        runners = []
+        with self._lock:
+            for _, runner_id in self._runner_index.within(*enclosing_circle(limits)):
+                runner = self.runners[runner_id]
+                if runner_id not in self._unavailable and net.inside(net.index[runner.intersection_id], limits):
+                    runners.append(_runner_row(runner))
+        return runners
+
+    def limits(self, patient: Patient, kilometers=1):
+        return bounding_box(self.store.location(patient.intersection_id), kilometers, snap=self.__snap())
+
+    @instrumentation.timed("db.get_pathfinder")
+    def get_pathfinder(self, patient: Patient, kilometers=1, projected=True):
+        # Every subgraph is projected, the argument is kept for HeartrunnerDB's signature
+        try:
+            if self.network is not None:
+                pf = self.network.pathfinder(patient, kilometers, cache=self.cache)
+                return self.__add_runners(pf)
+            limits = self.limits(patient, kilometers)
+            streets, aeds, runners = self.fetch_subgraph(limits)
+            return _projected_pathfinder_from_records(
+                streets, aeds, runners, limits, patient, self.cache)
+        except:
+            logging.exception(" Error while executing get_subgraph")
+            instrumentation.count("db.errors", operation="get_subgraph")
+            return None
+
+    @instrumentation.timed("db.get_pathfinders")
+    def get_pathfinders(self, patients: list[Patient], kilometers=1, projected=True):
+        if not patients:
+            return []
+        try:
+            if self.network is not None:
+                pfs = self.network.pathfinders(patients, kilometers, self.cache)
+                self.__add_runners(pfs[0])
+                return pfs
+            limits = union_box([self.limits(patient, kilometers) for patient in patients])
+            streets, aeds, runners = self.fetch_subgraph(limits)
+            pf = _projected_pathfinder_from_records(
+                streets, aeds, runners, limits, None, self.cache)
+            return [pf.for_patient(patient) for patient in patients]
+        except:
+            logging.exception(" Error while executing get_pathfinders")
+            instrumentation.count("db.errors", operation="get_pathfinders")
+            return None
+
+    def __add_runners(self, pf):
+        for id, intersection_id, speed in self.__runners_inside(pf.limits):
+            pf.add_runner(Runner(id=id, speed=speed, intersection_id=intersection_id))
+        return pf
+
+    def __snap(self):
+        return DISTRICT if self.cache is not None else None
+
+
+# A neo4j driver stand-in answering HeartrunnerDB's and AsyncHeartrunnerDB's
+# read queries from a MemoryHeartrunnerDB, so both can run without a server:
+#
+#   driver = MemoryDriver(MemoryHeartrunnerDB(grid_network(30)))
+#   db = AsyncHeartrunnerDB(driver=driver.asynchronous())
+#
+# Only the queries of the read path are known, anything else raises
+# ValueError in session.run like a failing query would. Every session is
+# kept with the queries run on it, so tests can check how they are shared.
+
+_NODE_QUERY = re.compile(r"MATCH \(n:(\w+)\)--\(m\) WHERE n\.id = \$id RETURN n, m( LIMIT 1)?$")
+_COUNT_QUERY = re.compile(r"MATCH \(n:(\w+)\) RETURN count\(n\)( AS count)?$")
+_NO_LIMITS = (0.0, 0.0, 0.0, 0.0)
+
+
+class MemoryResult(list):
+
+    def single(self):
+        return self[0] if self else None
+
+    def peek(self):
+        return self[0] if self else None
+
+    def consume(self):
+        return None
+
+
+class MemorySession:
+
+    def __init__(self, driver: "MemoryDriver"):
+        self.driver = driver
+        self.queries: list[str] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    def run(self, query: str, params: dict = None, **kwargs):
+        self.queries.append(query)
+        return MemoryResult(self.driver.records(query, {**(params or {}), **kwargs}))
+
+    def execute_read(self, work, *args):
+        return work(self, *args)
+
+
+class AsyncMemoryResult:
+
+    def __init__(self, records: list):
+        self.records = records
+
+    async def __aiter__(self):
+        for record in self.records:
+            yield record
+
+
+class AsyncMemorySession:
+
+    def __init__(self, driver: "MemoryDriver", latency: float):
+        self.driver = driver
+        self.latency = latency
+        self.queries: list[str] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    async def run(self, query: str, params: dict = None, **kwargs):
+        self.queries.append(query)
+        records = self.driver.records(query, {**(params or {}), **kwargs})
+        # A round trip, other sessions run meanwhile
+        self.driver.in_flight += 1
+        self.driver.max_in_flight = max(self.driver.max_in_flight, self.driver.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.driver.in_flight -= 1
+        return AsyncMemoryResult(records)
+
+
+class MemoryDriver:
+
+    def __init__(self, db: MemoryHeartrunnerDB, latency=0.0):
+        self.db = db
+        self.latency = latency
+        self.sessions: list = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.closed = False
+
+    def session(self, database=None):
+        session = MemorySession(self)
+        self.sessions.append(session)
+        return session
+
+    def close(self):
+        self.closed = True
+
+    def asynchronous(self):
+        return AsyncMemoryDriver(self)
+
+    def records(self, query: str, params: dict):
+        db = self.db
+        net = db.store
+        if match := _NODE_QUERY.match(query):
+            node = db.get_node(NodeType[match[1]], params["id"])
+            return [] if node is None else [self.__node_record(node)]
+        if match := _COUNT_QUERY.match(query):
+            count = db.count_nodes(NodeType[match[1]])
+            return [{"count": count} if match[2] else {"count(n)": count}]
+        if query == _db._INTERSECTION_IDS_QUERY:
+            return [{"id": id} for id in net.ids]
+        if query == _db._NETWORK_INTERSECTIONS_QUERY:
+            return [
+                {"id": net.ids[i], "latitude": net.latitudes[i], "longitude": net.longitudes[i]}
+                for i in range(len(net))
+            ]
+        if query == _db._NETWORK_STREETS_QUERY:
+            return [
+                {"id": record["id"], "head_id": record["i1_id"], "tail_id": record["i2_id"], "length": record["length"]}
+                for record in self.__streets(None, None)
+            ]
+        if query == _db._NETWORK_AEDS_QUERY:
+            return [
+                {"id": aed.id, "intersection_id": aed.intersection_id, "open_hour": aed.open_hour,
+                 "close_hour": aed.close_hour, "in_use": aed.in_use}
+                for aed in net.aeds.values()
+            ]
+        if query == _db._runners_query(None)[0]:
+            return [self.__runner_record(runner) for runner in self.__runners(None, None)]
+        if query == _db._runners_query(_NO_LIMITS)[0]:
+            return [self.__runner_record(runner) for runner in self.__runners(self.__box(params), None)]
+
+        if query == _db._subgraph_query(_NO_LIMITS)[0]:
+            return self.__subgraph(self.__box(params))
+
+        rings = {
+            _db._PROJECTED_STREETS_QUERY: None, _db._PROJECTED_AEDS_QUERY: None, _db._PROJECTED_RUNNERS_QUERY: None,
+            _db._RING_STREETS_QUERY: "inner_", _db._RING_AEDS_QUERY: "inner_", _db._RING_RUNNERS_QUERY: "inner_"
+        }
+        if query in rings:
+            limits = self.__box(params)
+            inner = self.__box(params, "inner_") if rings[query] else None
+            if query in (_db._PROJECTED_STREETS_QUERY, _db._RING_STREETS_QUERY):
+                return self.__streets(limits, inner)
+            if query in (_db._PROJECTED_AEDS_QUERY, _db._RING_AEDS_QUERY):
+                return [{"aeds": [
+                    _aed_row(aed) for aed in net.aeds.values() if self.__inside(aed.intersection_id, limits, inner)
+                ]}]
+            return [{"runners": [_runner_row(runner) for runner in self.__runners(limits, inner)]}]
+        raise ValueError(f"MemoryDriver does not know the query {query!r}")
+
+    def __box(self, params: dict, box=""):
+        return tuple(params[f"{box}{side}"] for side in ("north", "south", "east", "west"))
+
+    def __inside(self, intersection_id: int, limits: tuple, inner: tuple = None):
+        net = self.db.store
+        i = net.index[intersection_id]
+        return (limits is None or net.inside(i, limits)) and (inner is None or not net.inside(i, inner))
+
+    def __streets(self, limits: tuple, inner: tuple):
+        net = self.db.store
+        nodes = range(len(net)) if limits is None else net.intersections_inside(limits)
+        if inner is not None:
+            nodes = [i for i in nodes if not net.inside(i, inner)]
+        return _street_records(net, nodes, limits, inner)
+
+    def __subgraph(self, limits: tuple):
+        # A row per street leaving an intersection in the box, per AED and
+        # available runner at that intersection as the optional matches give
+        net = self.db.store
+        aeds = {}
+        for aed in net.aeds.values():
+            aeds.setdefault(aed.intersection_id, []).append(
+                {"id": aed.id, "open_hour": aed.open_hour, "close_hour": aed.close_hour, "in_use": aed.in_use})
+        runners = {}
+        for runner in self.__runners(limits, None):
+            runners.setdefault(runner.intersection_id, []).append({"id": runner.id, "speed": runner.speed})
+        records = []
+        for i in net.intersections_inside(limits):
+            i_id = net.ids[i]
+            for slot in range(net.offsets[i], net.offsets[i+1]):
+                j = net.targets[slot]
+                street = {
+                    "id": net.edge_ids[slot],
+                    "length": net.lengths[slot],
+                    "geometry": net._geometries.get(net.edge_ids[slot])
+                }
+                for aed in aeds.get(i_id, [None]):
+                    for runner in runners.get(i_id, [None]):
+                        records.append({
+                            "i1": {"id": i_id, "latitude": net.latitudes[i], "longitude": net.longitudes[i]},
+                            "i2": {"id": net.ids[j], "latitude": net.latitudes[j], "longitude": net.longitudes[j]},
+                            "s": street,
+                            "a": aed,
+                            "r": runner
+                        })
+        return records
+
+    def __runners(self, limits: tuple, inner: tuple):
+        db = self.db
+        return [
+            runner for runner in db.runners.values()
+            if runner.id not in db._unavailable and self.__inside(runner.intersection_id, limits, inner)
+        ]
+
+    def __runner_record(self, runner: Runner):
+        return {"id": runner.id, "speed": runner.speed, "intersection_id": runner.intersection_id}
+
+    def __node_record(self, node):
+        match node:
+            case Intersection():
+                return {"n": {"id": node.id, "latitude": node.latitude, "longitude": node.longitude},
+                        "m": {"id": node.id}}
+            case Runner():
+                return {"n": {"id": node.id, "speed": node.speed}, "m": {"id": node.intersection_id}}
+            case AED():
+                return {"n": {"id": node.id, "open_hour": node.open_hour, "close_hour": node.close_hour,
+                              "in_use": node.in_use}, "m": {"id": node.intersection_id}}
+            case Patient():
+                return {"n": {"id": node.id}, "m": {"id": node.intersection_id}}
+
+
+class AsyncMemoryDriver:
+    # MemoryDriver's records behind neo4j's async driver interface, every
+    # query takes latency seconds of simulated round trip
+
+    def __init__(self, driver: MemoryDriver):
+        self.driver = driver
+
+    @property
+    def sessions(self):
+        return self.driver.sessions
+
+    def session(self, database=None):
+        session = AsyncMemorySession(self.driver, self.driver.latency)
+        self.driver.sessions.append(session)
+        return session
+
+    async def close(self):
+        self.driver.close()
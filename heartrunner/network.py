@@ -0,0 +1,423 @@
+import csv
+import math
+import heapq
+import hashlib
+import networkx as nx
+from array import array
+from geopy.distance import great_circle
+from .types import *
+from . import instrumentation
+from .pathfinder import Pathfinder
+from .cache import RouteCache
+from .spatial import SpatialIndex, haversine
+
+INTERSECTIONS_CSV_PATH = "data/csv/intersections.csv"
+STREETS_CSV_PATH = "data/csv/streetsegments.csv"
+AEDS_CSV_PATH = "data/csv/aeds.csv"
+# Grid in degrees that bounding boxes snap to when routes are cached
+DISTRICT = 0.01
+
+
+def bounding_box(location: tuple, kilometers=1, snap: float = None):
+    # (north, south, east, west) limits of a square around location. With
+    # snap the limits are widened to a grid of that many degrees, so that
+    # incidents in the same district share a subgraph and cached routes
+    dist_limit = great_circle(kilometers=kilometers)
+    north_limit = tuple(dist_limit.destination(location, 0))
+    south_limit = tuple(dist_limit.destination(location, 180))
+    east_limit = tuple(dist_limit.destination(location, 90))
+    west_limit = tuple(dist_limit.destination(location, 270))
+    limits = (north_limit[0], south_limit[0], east_limit[1], west_limit[1])
+    if snap:
+        limits = (
+            round(math.ceil(limits[0] / snap) * snap, 9),
+            round(math.floor(limits[1] / snap) * snap, 9),
+            round(math.ceil(limits[2] / snap) * snap, 9),
+            round(math.floor(limits[3] / snap) * snap, 9)
+        )
+    return limits
+
+
+def union_box(boxes: list[tuple]):
+    return (
+        max(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        min(box[3] for box in boxes)
+    )
+
+
+def enclosing_circle(limits: tuple):
+    # (center, meters) of a circle the box fits inside, the one through its corners
+    center = ((limits[0] + limits[1]) / 2, (limits[2] + limits[3]) / 2)
+    return center, haversine(center, (limits[0], limits[2])) * 1.01
+
+
+class RoadNetwork:
+    # Whole city street graph kept in memory as compact CSR arrays.
+    # Nodes are addressed by their index into ids/latitudes/longitudes, the
+    # neighbours of node i are targets[offsets[i]:offsets[i+1]], and every
+    # street is stored once in each direction.
+
+    def __init__(self, intersections: list[tuple], streets: list[tuple], aeds: list[AED] = []):
+        # intersections: (id, latitude, longitude)
+        # streets: (id, head_id, tail_id, length, geometry)
+        self.ids = array("i", [row[0] for row in intersections])
+        self.latitudes = array("f", [row[1] for row in intersections])
+        self.longitudes = array("f", [row[2] for row in intersections])
+        self.index = {id: i for i, id in enumerate(self.ids)}
+
+        degree = [0] * (len(self.ids) + 1)
+        for _, head_id, tail_id, _, _ in streets:
+            degree[self.index[head_id] + 1] += 1
+            degree[self.index[tail_id] + 1] += 1
+        for i in range(len(self.ids)):
+            degree[i + 1] += degree[i]
+        self.offsets = array("i", degree)
+
+        fill = list(degree[:-1])
+        self.targets = array("i", bytes(4 * degree[-1]))
+        self.edge_ids = array("i", bytes(4 * degree[-1]))
+        self.lengths = array("f", bytes(4 * degree[-1]))
+        self._geometries = {}
+        for s_id, head_id, tail_id, length, geometry in streets:
+            u = self.index[head_id]
+            v = self.index[tail_id]
+            for a, b in ((u, v), (v, u)):
+                self.targets[fill[a]] = b
+                self.edge_ids[fill[a]] = s_id
+                self.lengths[fill[a]] = length
+                fill[a] += 1
+            if geometry is not None:
+                self._geometries[s_id] = geometry
+
+        self.aeds: dict[int, AED] = {}
+        self._aed_index = SpatialIndex()
+        for aed in aeds:
+            self.add_aed(aed)
+        self._intersection_index = None
+        # Optional AEDField, read by pathfinders instead of runner searches
+        self.aed_field = None
+        # Optional Landmarks index, used by pathfinders for A*
+        self.landmarks = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def fingerprint(self):
+        # Digest of the node ids and the CSR arrays, for files derived from
+        # the street graph that must not be used with another one
+        digest = hashlib.sha256()
+        for values in (self.ids, self.offsets, self.targets, self.lengths):
+            digest.update(len(values).to_bytes(8, "little"))
+            digest.update(values.tobytes())
+        return digest.digest()
+
+    @classmethod
+    def from_arrays(
+        cls,
+        ids,
+        latitudes,
+        longitudes,
+        offsets,
+        targets,
+        edge_ids,
+        lengths,
+        aeds: list[AED] = [],
+        geometries=None
+    ):
+        # A network over ready made CSR arrays, e.g. memoryviews into a
+        # snapshot, which are used as they are. Only the id index and the
+        # AEDs are built, geometries is anything with get(edge_id)
+        network = cls.__new__(cls)
+        network.ids = ids
+        network.latitudes = latitudes
+        network.longitudes = longitudes
+        network.index = {id: i for i, id in enumerate(ids)}
+        network.offsets = offsets
+        network.targets = targets
+        network.edge_ids = edge_ids
+        network.lengths = lengths
+        network._geometries = {} if geometries is None else geometries
+        network.aeds = {}
+        network._aed_index = SpatialIndex()
+        for aed in aeds:
+            network.add_aed(aed)
+        network._intersection_index = None
+        network.aed_field = None
+        network.landmarks = None
+        return network
+
+    @staticmethod
+    def from_csv(
+        intersections_path=INTERSECTIONS_CSV_PATH,
+        streets_path=STREETS_CSV_PATH,
+        aeds_path=AEDS_CSV_PATH,
+        geometry=False
+    ):
+        with open(intersections_path, "r") as intersections_file:
+            intersections = [
+                (int(row["id"]), float(row["latitude"]), float(row["longitude"]))
+                for row in csv.DictReader(intersections_file)
+            ]
+        with open(streets_path, "r") as streets_file:
+            streets = [
+                (
+                    int(row["id"]),
+                    int(row["head_id"]),
+                    int(row["tail_id"]),
+                    float(row["length"]),
+                    row["geometry"] if geometry else None
+                )
+                for row in csv.DictReader(streets_file)
+            ]
+        aeds = []
+        if aeds_path:
+            with open(aeds_path, "r") as aeds_file:
+                aeds = [
+                    AED(
+                        id=int(row["id"]),
+                        intersection_id=int(row["intersection_id"]),
+                        time_range=(int(row["open_hour"]), int(row["close_hour"])),
+                        in_use=row["in_use"]
+                    )
+                    for row in csv.DictReader(aeds_file)
+                ]
+        return RoadNetwork(intersections, streets, aeds)
+
+    def add_aed(self, aed: AED):
+        i = self.index.get(aed.intersection_id)
+        if i is None: return
+        self.aeds[aed.id] = aed
+        self._aed_index.insert(aed.id, (self.latitudes[i], self.longitudes[i]))
+
+    def _intersections(self):
+        if self._intersection_index is None:
+            self._intersection_index = SpatialIndex()
+            for i, id in enumerate(self.ids):
+                self._intersection_index.insert(id, (self.latitudes[i], self.longitudes[i]))
+        return self._intersection_index
+
+    def nearest_intersections(self, coords: tuple, k=1, max_distance=math.inf):
+        # (meters, intersection id) of the k closest intersections
+        return self._intersections().nearest(coords, k, max_distance)
+
+    def intersections_inside(self, limits: tuple):
+        nodes = [self.index[id] for _, id in self._intersections().within(*enclosing_circle(limits))]
+        return [i for i in nodes if self.inside(i, limits)]
+
+    def intersection(self, node_id: int):
+        i = self.index[node_id]
+        return Intersection(id=node_id, coords=(self.latitudes[i], self.longitudes[i]))
+
+    def inside(self, i: int, limits: tuple):
+        return (
+            limits[1] <= self.latitudes[i] <= limits[0] and
+            limits[3] <= self.longitudes[i] <= limits[2]
+        )
+
+    def location(self, node_id: int):
+        i = self.index[node_id]
+        return (self.latitudes[i], self.longitudes[i])
+
+    def pathfinder(self, patient: Patient, kilometers=1, limits: tuple = None, cache: RouteCache = None):
+        if limits is None and kilometers is not None:
+            limits = bounding_box(
+                self.location(patient.intersection_id), kilometers,
+                snap=DISTRICT if cache is not None else None
+            )
+        aeds = self.aeds.keys()
+        if limits is not None:
+            aeds = [id for _, id in self._aed_index.within(*enclosing_circle(limits))]
+        pf = NetworkPathfinder(patient, self, limits, cache)
+        for id in aeds:
+            pf.add_aed(self.aeds[id])
+        return pf
+
+    def pathfinders(self, patients: list[Patient], kilometers=1, cache: RouteCache = None):
+        # Views for several patients sharing one graph over the union of their boxes
+        limits = union_box([
+            bounding_box(
+                self.location(patient.intersection_id), kilometers,
+                snap=DISTRICT if cache is not None else None
+            )
+            for patient in patients
+        ])
+        pf = self.pathfinder(None, limits=limits, cache=cache)
+        return [pf.for_patient(patient) for patient in patients]
+
+
+class NetworkPathfinder(Pathfinder):
+    # Pathfinder view over a RoadNetwork. Nothing is copied up front,
+    # Intersection and Streetsegment objects are created on first use and
+    # searches only traverse streets with an end inside the limits, matching
+    # the subgraph HeartrunnerDB.get_pathfinder would have fetched.
+
+    def __init__(self, patient: Patient, network: RoadNetwork, limits: tuple = None, cache: RouteCache = None):
+        super().__init__(patient, cache)
+        self._graph = None
+        self._network = network
+        self.limits = limits
+
+    def _allowed(self, i: int):
+        return self.limits is None or self._network.inside(i, self.limits)
+
+    def add_node(self, node: Intersection):
+        raise TypeError("NetworkPathfinder is a read-only view of its RoadNetwork, intersections cannot be added")
+
+    def add_edge(self, edge: Streetsegment):
+        raise TypeError("NetworkPathfinder is a read-only view of its RoadNetwork, streets cannot be added")
+
+    def get_node(self, node_id: int):
+        i = self._network.index.get(node_id)
+        if i is None or not self._allowed(i):
+            return None
+        return self._node_at(i)
+
+    def get_nodes(self):
+        return [self._node_at(i) for i in range(len(self._network)) if self._allowed(i)]
+
+    def _node_at(self, j: int):
+        # Neighbours just outside the limits are still valid path ends
+        net = self._network
+        node = self._nodes.get(net.ids[j])
+        if node is None:
+            node = net.intersection(net.ids[j])
+            self._nodes[node.id] = node
+        return node
+
+    def _node(self, node_id: int):
+        return self._node_at(self._network.index[node_id])
+
+    def _slots(self, node: Intersection):
+        net = self._network
+        i = net.index[node.id]
+        inside = self._allowed(i)
+        for slot in range(net.offsets[i], net.offsets[i+1]):
+            j = net.targets[slot]
+            if inside or self._allowed(j):
+                yield slot, j
+
+    def _street(self, slot: int, source: Intersection, target: Intersection):
+        net = self._network
+        edge_id = net.edge_ids[slot]
+        if edge_id not in self._edges:
+            self._edges[edge_id] = Streetsegment(
+                id=edge_id,
+                source=source,
+                target=target,
+                length=net.lengths[slot],
+                geometry=net._geometries.get(edge_id)
+            )
+        return self._edges[edge_id]
+
+    def get_edges(self):
+        edges = []
+        for node in self.get_nodes():
+            for slot, j in self._slots(node):
+                edges.append(self._street(slot, node, self._node_at(j)))
+        return list({edge.id: edge for edge in edges}.values())
+
+    def _neighbors(self, node: Intersection):
+        for slot, j in self._slots(node):
+            yield self._node_at(j), self._network.lengths[slot]
+
+    def _best_slot(self, u: Intersection, v: Intersection):
+        # Paths from the aed field may leave the limits, so look at every street
+        net = self._network
+        i = net.index[u.id]
+        j = net.index[v.id]
+        best = None
+        for slot in range(net.offsets[i], net.offsets[i+1]):
+            if net.targets[slot] == j and (best is None or net.lengths[slot] < net.lengths[best]):
+                best = slot
+        return best
+
+    def _edge_id(self, u: Intersection, v: Intersection):
+        best = self._best_slot(u, v)
+        self._street(best, u, v)
+        return self._network.edge_ids[best]
+
+    def _length(self, u: Intersection, v: Intersection):
+        return self._network.lengths[self._best_slot(u, v)]
+
+    def _runner_detours(self, r_source: Intersection, atop_dist: dict, n_aeds: int = None, aeds: dict = None):
+        # With an aed field the runner's nearest aeds are looked up instead of
+        # searched for, as long as they provably hold the n_aeds best
+        # runner->aed->patient detours
+        field = self._network.aed_field
+        if field is not None and n_aeds is not None:
+            detours = self._field_detours(field, r_source, atop_dist, n_aeds, self._aeds if aeds is None else aeds)
+            if detours is not None:
+                return detours
+            instrumentation.count("pathfinder.aed_field_fallbacks")
+        return super()._runner_detours(r_source, atop_dist, n_aeds, aeds)
+
+    def _field_detours(self, field, r_source: Intersection, atop_dist: dict, n_aeds: int, aeds: dict):
+        # An aed location the field does not list for the runner is at least
+        # as far from it as the field's k-th aed, if the field knows of its
+        # aeds at all, and never closer than 0. Its detour is at least that
+        # plus its distance to the patient, so the detours found are kept up
+        # to the smallest such bound, None if that leaves fewer than n_aeds
+        nearest = field.nearest(r_source.id)
+        detours = {}
+        for distance, location in nearest:
+            a_source = self.get_node(location)
+            if a_source in atop_dist:
+                path = field.path(r_source.id, location)
+                if path is None:
+                    return None
+                nodes = [self._node(id) for id in path]
+                detours[a_source] = (distance + atop_dist[a_source], a_source, nodes, None)
+
+        # Fewer than k labels means every other aed the field knows of is
+        # unreachable from the runner
+        floor = nearest[-1][0] if len(nearest) >= field.k else math.inf
+        bound = math.inf
+        for a_source, atop in atop_dist.items():
+            if a_source in detours:
+                continue
+            if any(field.available(aed) for aed in aeds[a_source]):
+                bound = min(bound, floor + atop)
+            else:
+                bound = min(bound, atop)
+
+        found = []
+        n = 0
+        for detour in sorted(detours.values(), key=lambda x: x[0]):
+            if detour[0] > bound:
+                break
+            found.append(detour)
+            n += len(aeds[detour[1]])
+        if n < n_aeds and bound < math.inf:
+            return None
+        return found
+
+    @instrumentation.timed("pathfinder.astar")
+    def _astar(self, source: Intersection, target: Intersection):
+        if self._network.landmarks is not None:
+            path = self._network.landmarks.astar_path(source.id, target.id, self.limits)
+            return [self._node(id) for id in path]
+
+        dist = {source: 0}
+        pred = {source: None}
+        done = set()
+        h = self._heuristic
+        heap = [(h(source, target), 0, 0, source)]
+        counter = 1
+        while heap:
+            _, d, _, u = heapq.heappop(heap)
+            if u == target:
+                instrumentation.count("pathfinder.astar_nodes", len(dist))
+                return self._unwind(pred, u)[::-1]
+            if u in done:
+                continue
+            done.add(u)
+            for v, weight in self._neighbors(u):
+                nd = d + weight
+                if v not in dist or nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = u
+                    heapq.heappush(heap, (nd + h(v, target), nd, counter, v))
+                    counter += 1
+        raise nx.NetworkXNoPath(f"Node {target} not reachable from {source}")
@@ -0,0 +1,122 @@
+import os
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .types import *
+from .pathfinder import Pathfinder, Path, AEDPath, Task
+
+# Pathfinders shared with the worker processes, by the key of the
+# ParallelPathfinder that owns them, so pools living side by side each see
+# their own. With the fork start method a pathfinder is inherited read-only
+# (copy-on-write) when the pool starts its workers, otherwise it is pickled
+# once per worker by the pool initializer, never per call. Either way the
+# workers hold a snapshot, so a batch after the pathfinder changed (runners
+# added, moved or removed, aeds added or updated) restarts the pool on the
+# current state first. Frequent changes between batches cost a pool start
+# each, batch them where possible.
+_shared: dict[int, Pathfinder] = {}
+_keys = itertools.count(1)
+
+
+def _init(key: int, pathfinder: Pathfinder):
+    _shared[key] = pathfinder
+
+
+def _calculate(key: int, patient: Patient, n_runners: int, n_aeds: int, at=None):
+    # Tasks are sent back as ids and the node ids and distances of each path,
+    # the parent rebuilds them on its own copy of the graph instead of
+    # unpickling streets and geometry
+    tasks = _shared[key].for_patient(patient).calculate_tasks(
+        n_runners=n_runners, n_aeds=n_aeds, multi_target=True, at=at)
+    return [
+        (
+            task.runner.id,
+            task.runner.intersection_id,
+            _leaves(task.patient_path),
+            [(aed_path.aed.id, _leaves(aed_path.path)) for aed_path in task.aed_paths]
+        )
+        for task in tasks
+    ]
+
+
+def _leaves(path: Path):
+    return [(leaf._ids, leaf._distances) for leaf in path.leaves()]
+
+
+class ParallelPathfinder:
+    # Fans per patient task calculation out to a process pool. Results are
+    # returned in patient order and are identical to calling
+    # calculate_tasks(multi_target=True) on each patient serially.
+
+    def __init__(self, pathfinder: Pathfinder, workers: int = None):
+        self.pathfinder = pathfinder
+        self.workers = workers or os.cpu_count()
+        self._key = next(_keys)
+        self._executor = None
+        # Pathfinder._changes the workers were started on
+        self._snapshot = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def start(self):
+        if self._executor is not None:
+            return
+        self._snapshot = self.pathfinder._changes
+        if "fork" in multiprocessing.get_all_start_methods():
+            # Workers are forked as work is submitted, so the entry stays
+            # until the pool is closed
+            _shared[self._key] = self.pathfinder
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork")
+            )
+        else:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init,
+                initargs=(self._key, self.pathfinder)
+            )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        _shared.pop(self._key, None)
+
+    def calculate_tasks_batch(self, patients: list[Patient], n_runners: int = None, n_aeds: int = None, at=None):
+        if self._executor is not None and self._snapshot != self.pathfinder._changes:
+            self.close()
+        self.start()
+        results = self._executor.map(
+            _calculate,
+            [self._key] * len(patients),
+            patients,
+            [n_runners] * len(patients),
+            [n_aeds] * len(patients),
+            [at] * len(patients)
+        )
+        pf = self.pathfinder
+        runners = {runner.id: runner for runner in pf.get_runners()}
+        aeds = {aed.id: aed for aed in pf.get_aeds()}
+        return [self._rebuild(result, runners, aeds) for result in results]
+
+    def _rebuild(self, result: list[tuple], runners: dict, aeds: dict):
+        pf = self.pathfinder
+
+        def to_path(leaves):
+            paths = [Path(pf._node(ids[0]), pf._node(ids[-1]), ids, distances, pf) for ids, distances in leaves]
+            path = paths[0]
+            for part in paths[1:]:
+                path = path + part
+            return path
+
+        tasks = []
+        for runner_id, _, patient_leaves, aed_results in result:
+            aed_paths = [AEDPath(to_path(leaves), aeds[aed_id]) for aed_id, leaves in aed_results]
+            tasks.append(Task(runners[runner_id], to_path(patient_leaves), aed_paths))
+        return tasks
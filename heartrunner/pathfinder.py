@@ -1,25 +1,52 @@
+import copy
+import math
+import heapq
+import bisect
 import networkx as nx
+from abc import ABC, abstractmethod
+from array import array
+from timeit import default_timer
+from math import sin, asin, sqrt
 from .types import *
-from geopy.distance import great_circle
+from . import instrumentation
+from .cache import RouteCache
+from .availability import AvailabilityIndex
+from .spatial import SpatialIndex, HaversineHeuristic, haversine, ADMISSIBLE_RADIUS, _prepare, _haversine_prepared
 
 
 def heuristic(node_a: Intersection, node_b: Intersection):
-    return great_circle(node_a.coords(), node_b.coords()).meters
+    return haversine(node_a.coords(), node_b.coords(), ADMISSIBLE_RADIUS)
 
 
 class Path:
-    def __init__(self, source: Intersection, target: Intersection, streets: list[Streetsegment], aed: AED = None):
+    # A route as the ids of its intersections and, for each, its distance
+    # in the search that found the route: rising from 0 along an A* path,
+    # falling to 0 at the root of a search tree along an unwound one.
+    # Paths joined with + keep both halves instead of copying them, and
+    # streets are only looked up on the pathfinder when streets, geojson()
+    # or repr() ask for them, routing only needs the length
+    __slots__ = ("source", "target", "length", "_ids", "_distances", "_parts", "_pathfinder", "_streets")
+
+    def __init__(self, source: Intersection, target: Intersection, ids: array, distances: array, pathfinder=None):
         self.source = source
         self.target = target
-        self.streets = streets
-        self.length = sum([s.length for s in streets])
-        self.aed = aed
+        self.length = abs(distances[-1] - distances[0])
+        self._ids = ids
+        self._distances = distances
+        self._parts = None
+        self._pathfinder = pathfinder
+        self._streets = None
 
     def __add__(self, p):
-        source = self.source
-        target = p.target
-        path = self.streets + p.streets
-        return Path(source=source, target=target, streets=path)
+        path = Path.__new__(Path)
+        path.source = self.source
+        path.target = p.target
+        path.length = self.length + p.length
+        path._ids = path._distances = None
+        path._parts = (self, p)
+        path._pathfinder = self._pathfinder
+        path._streets = None
+        return path
 
     def __repr__(self) -> str:
         rep = f"Path({self.source} -> {self.target}, {self.length}m):\n"
@@ -27,13 +54,77 @@ class Path:
             rep += f"{street}\n"
         return rep
 
+    def leaves(self):
+        # The unjoined paths this one is made of, in order
+        if self._parts is None:
+            yield self
+        else:
+            for part in self._parts:
+                yield from part.leaves()
+
+    def node_ids(self):
+        ids = []
+        for leaf in self.leaves():
+            # Joined paths share the intersection they meet at
+            ids += leaf._ids[1:] if ids else leaf._ids
+        return ids
+
+    def nodes(self):
+        node = self._pathfinder._node
+        return [node(id) for id in self.node_ids()]
+
+    def cumulative(self):
+        # Distance along the route at each of its intersections
+        distances = array("d")
+        total = 0.0
+        for leaf in self.leaves():
+            d = leaf._distances
+            distances.extend(total + abs(x - d[0]) for x in (d[1:] if distances else d))
+            total += leaf.length
+        return distances
+
+    @property
+    def streets(self):
+        if self._streets is None:
+            if self._parts is not None:
+                self._streets = [street for part in self._parts for street in part.streets]
+            else:
+                pf = self._pathfinder
+                nodes = [pf._node(id) for id in self._ids]
+                self._streets = [pf.get_edge(pf._edge_id(u, v)) for u, v in zip(nodes, nodes[1:])]
+        return self._streets
+
     def is_aed_path(self):
-        return True if isinstance(self.aed, AED) else False
+        return False
 
     def geojson(self, style={}):
         return [street.geojson(style=style) for street in self.streets]
 
 
+class AEDPath:
+    # An AED and the route fetching it on the way to the patient. Every AED
+    # at an intersection gets its own record around the one shared Path,
+    # which it stands in for
+    __slots__ = ("path", "aed")
+
+    def __init__(self, path: Path, aed: AED):
+        self.path = path
+        self.aed = aed
+
+    def __getattr__(self, name: str):
+        # copy and pickle look up dunders on instances whose slots are not
+        # set yet, neither may reach path
+        if name == "path" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.path, name)
+
+    def __repr__(self) -> str:
+        return f"AEDPath({self.aed.id}, {self.path.source} -> {self.path.target}, {self.path.length}m)"
+
+    def is_aed_path(self):
+        return True
+
+
 class Task:
     def __init__(
         self, 
@@ -51,20 +142,351 @@ class Task:
         return path.length/self.runner.speed
 
 
+def enough_targets(costs: list, n_targets: int, d: float):
+    # Whether the n_targets cheapest of the sorted target costs found so far
+    # cannot be beaten by a target settled at distance d or further
+    if n_targets is None:
+        return False
+    return n_targets <= 0 or (len(costs) >= n_targets and costs[n_targets-1] <= d)
+
+
+def dijkstra(neighbors, source, targets: set = None, n_targets: int = None, bound: dict = None, max_distance: float = None):
+    # Single-source Dijkstra over an undirected graph given by neighbors(u),
+    # yielding (v, length), on any hashable nodes. Stops once every target
+    # is settled or, when n_targets is given, once n_targets targets have a
+    # cost (distance + bound[target]) that no unsettled target can beat,
+    # since those are at least the current distance away. Nodes further than
+    # max_distance are not settled
+    dist = {}
+    pred = {source: None}
+    seen = {source: 0}
+    remaining = set(targets) if targets is not None else None
+    costs = []
+    heap = [(0, 0, source)]
+    counter = 1
+    while heap:
+        d, _, u = heapq.heappop(heap)
+        if u in dist:
+            continue
+        if enough_targets(costs, n_targets, d):
+            break
+        if max_distance is not None and d > max_distance:
+            break
+        dist[u] = d
+
+        if remaining is not None and u in remaining:
+            remaining.discard(u)
+            if n_targets is not None:
+                cost = d + (bound.get(u, math.inf) if bound else 0)
+                bisect.insort(costs, cost)
+            if not remaining:
+                break
+
+        for v, weight in neighbors(u):
+            nd = d + weight
+            if v not in seen or nd < seen[v]:
+                seen[v] = nd
+                pred[v] = u
+                heapq.heappush(heap, (nd, counter, v))
+                counter += 1
+    return dist, pred
+
+
+class GraphBackend(ABC):
+    # Street graph a Pathfinder searches, on intersection ids. Streets are
+    # undirected and, as in nx.Graph, adding one between intersections that
+    # are already connected replaces it. Searches raise the networkx
+    # exceptions, see NetworkxBackend for the reference behaviour
+
+    @abstractmethod
+    def __len__(self):
+        ...
+
+    @abstractmethod
+    def __contains__(self, id: int):
+        ...
+
+    @abstractmethod
+    def add_node(self, id: int, coords: tuple):
+        ...
+
+    @abstractmethod
+    def add_edge(self, u: int, v: int, edge_id: int, length: float):
+        ...
+
+    @abstractmethod
+    def neighbors(self, u: int):
+        # (intersection id, street length) pairs
+        ...
+
+    @abstractmethod
+    def edge_id(self, u: int, v: int):
+        ...
+
+    @abstractmethod
+    def length(self, u: int, v: int):
+        ...
+
+    @abstractmethod
+    def astar(self, source: int, target: int):
+        # Shortest path as a list of intersection ids, with a great circle
+        # heuristic on ADMISSIBLE_RADIUS
+        ...
+
+    @abstractmethod
+    def dijkstra(self, source: int, targets: set = None, n_targets: int = None, bound: dict = None, max_distance: float = None):
+        # (dist, pred) on ids for the settled nodes, see dijkstra
+        ...
+
+
+class NetworkxBackend(GraphBackend):
+    # nx.Graph keyed by intersection id, the reference implementation
+
+    def __init__(self, radius=ADMISSIBLE_RADIUS):
+        self.graph = nx.Graph()
+        self.radius = radius
+        self._prepared: dict[int, tuple] = {}
+
+    def __len__(self):
+        return len(self.graph)
+
+    def __contains__(self, id: int):
+        return id in self.graph
+
+    def add_node(self, id: int, coords: tuple):
+        if id not in self.graph:
+            self.graph.add_node(id)
+            self._prepared[id] = _prepare(coords)
+
+    def add_edge(self, u: int, v: int, edge_id: int, length: float):
+        self.graph.add_edge(u, v, id=edge_id, weight=length)
+
+    def neighbors(self, u: int):
+        for v, attr in self.graph[u].items():
+            yield v, attr["weight"]
+
+    def edge_id(self, u: int, v: int):
+        return self.graph[u][v]["id"]
+
+    def length(self, u: int, v: int):
+        return self.graph[u][v]["weight"]
+
+    def astar(self, source: int, target: int):
+        prepared = self._prepared
+        radius = self.radius
+        # nx evaluates the heuristic once for every node it reaches
+        reached = [1]
+
+        def heuristic(u, v):
+            reached[0] += 1
+            return _haversine_prepared(prepared[u], prepared[v], radius)
+
+        path = nx.astar_path(self.graph, source, target, heuristic)
+        instrumentation.count("pathfinder.astar_nodes", reached[0])
+        return path
+
+    def dijkstra(self, source: int, targets: set = None, n_targets: int = None, bound: dict = None, max_distance: float = None):
+        if source not in self.graph:
+            raise nx.NodeNotFound(f"Node {source} not in graph")
+        dist, pred = dijkstra(self.neighbors, source, targets, n_targets, bound, max_distance)
+        return dist, {v: pred[v] for v in dist}
+
+
+class ArrayBackend(GraphBackend):
+    # Adjacency lists threaded through flat arrays (a forward star): the
+    # slots of node index i start at first[i] and continue through next, a
+    # street fills one slot at each of its ends. Nodes carry their
+    # coordinates prepared for the heuristic, so searches run on ints and
+    # arrays without hashing Intersection objects or reading edge dicts.
+    # A few dozen bytes per street instead of networkx's nested dicts
+
+    def __init__(self, radius=ADMISSIBLE_RADIUS):
+        self._diameter = 2 * radius
+        self.index: dict[int, int] = {}
+        self.ids = array("q")
+        self._lat = array("d")
+        self._lon = array("d")
+        self._cos = array("d")
+        self._first = array("i")
+        self._next = array("i")
+        self._target = array("i")
+        self._length = array("d")
+        self._edge = array("q")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id: int):
+        return id in self.index
+
+    def add_node(self, id: int, coords: tuple):
+        if id in self.index:
+            return
+        self.index[id] = len(self.ids)
+        self.ids.append(id)
+        lat = math.radians(coords[0])
+        self._lat.append(lat)
+        self._lon.append(math.radians(coords[1]))
+        self._cos.append(math.cos(lat))
+        self._first.append(-1)
+
+    def _slot(self, i: int, j: int):
+        target, next_slot = self._target, self._next
+        slot = self._first[i]
+        while slot >= 0 and target[slot] != j:
+            slot = next_slot[slot]
+        return slot
+
+    def add_edge(self, u: int, v: int, edge_id: int, length: float):
+        i, j = self.index[u], self.index[v]
+        slot = self._slot(i, j)
+        if slot >= 0:
+            # Replaces the street in both directions
+            for a, b in ((i, j), (j, i)):
+                slot = self._slot(a, b)
+                self._edge[slot] = edge_id
+                self._length[slot] = length
+            return
+        for a, b in ((i, j), (j, i)) if i != j else ((i, j),):
+            self._next.append(self._first[a])
+            self._target.append(b)
+            self._length.append(length)
+            self._edge.append(edge_id)
+            self._first[a] = len(self._target) - 1
+
+    def neighbors(self, u: int):
+        ids, target, length, next_slot = self.ids, self._target, self._length, self._next
+        slot = self._first[self.index[u]]
+        while slot >= 0:
+            yield ids[target[slot]], length[slot]
+            slot = next_slot[slot]
+
+    def edge_id(self, u: int, v: int):
+        slot = self._slot(self.index[u], self.index[v])
+        if slot < 0:
+            raise KeyError((u, v))
+        return self._edge[slot]
+
+    def length(self, u: int, v: int):
+        slot = self._slot(self.index[u], self.index[v])
+        if slot < 0:
+            raise KeyError((u, v))
+        return self._length[slot]
+
+    def _indices(self, source: int, target: int = None):
+        for id in (source, target):
+            if id is not None and id not in self.index:
+                raise nx.NodeNotFound(f"Node {id} not in graph")
+        return self.index[source], self.index.get(target)
+
+    def astar(self, source: int, target: int):
+        s, t = self._indices(source, target)
+        first, next_slot, targets, lengths = self._first, self._next, self._target, self._length
+        lat, lon, cos = self._lat, self._lon, self._cos
+        lat_t, lon_t, cos_t = lat[t], lon[t], cos[t]
+        diameter = self._diameter
+        dist = {s: 0.0}
+        pred = {s: -1}
+        done = set()
+        heap = [(0.0, 0.0, s)]
+        while heap:
+            _, d, i = heapq.heappop(heap)
+            if i == t:
+                instrumentation.count("pathfinder.astar_nodes", len(dist))
+                path = [i]
+                while pred[path[-1]] >= 0:
+                    path.append(pred[path[-1]])
+                ids = self.ids
+                return [ids[i] for i in reversed(path)]
+            if i in done:
+                continue
+            done.add(i)
+            slot = first[i]
+            while slot >= 0:
+                j = targets[slot]
+                nd = d + lengths[slot]
+                if j not in dist or nd < dist[j]:
+                    dist[j] = nd
+                    pred[j] = i
+                    h = sin((lat_t - lat[j]) * 0.5) ** 2 + cos[j] * cos_t * sin((lon_t - lon[j]) * 0.5) ** 2
+                    heapq.heappush(heap, (nd + diameter * asin(sqrt(h) if h < 1.0 else 1.0), nd, j))
+                slot = next_slot[slot]
+        raise nx.NetworkXNoPath(f"Node {target} not reachable from {source}")
+
+    def dijkstra(self, source: int, targets: set = None, n_targets: int = None, bound: dict = None, max_distance: float = None):
+        s, _ = self._indices(source)
+        index = self.index
+        first, next_slot, target, length = self._first, self._next, self._target, self._length
+        # Targets outside the graph are never settled, as in dijkstra
+        remaining = {index.get(t, -1) for t in targets} if targets is not None else None
+        if bound:
+            bound = {index[k]: v for k, v in bound.items() if k in index}
+        dist = {}
+        pred = {s: -1}
+        seen = {s: 0.0}
+        costs = []
+        heap = [(0.0, s)]
+        while heap:
+            d, i = heapq.heappop(heap)
+            if i in dist:
+                continue
+            if enough_targets(costs, n_targets, d):
+                break
+            if max_distance is not None and d > max_distance:
+                break
+            dist[i] = d
+
+            if remaining is not None and i in remaining:
+                remaining.discard(i)
+                if n_targets is not None:
+                    bisect.insort(costs, d + (bound.get(i, math.inf) if bound else 0))
+                if not remaining:
+                    break
+
+            slot = first[i]
+            while slot >= 0:
+                j = target[slot]
+                nd = d + length[slot]
+                if j not in seen or nd < seen[j]:
+                    seen[j] = nd
+                    pred[j] = i
+                    heapq.heappush(heap, (nd, j))
+                slot = next_slot[slot]
+
+        ids = self.ids
+        return (
+            {ids[i]: d for i, d in dist.items()},
+            {ids[i]: ids[pred[i]] if pred[i] >= 0 else None for i in dist}
+        )
+
+
 class Pathfinder:
 
-    def __init__(self, patient: Patient):
+    def __init__(self, patient: Patient = None, cache: RouteCache = None, graph: GraphBackend = None):
         self.tasks: list[Task] = []
+        self.limits: tuple = None
         self._patient = patient
-        self._graph = nx.Graph()
+        self._cache = cache
+        self._graph = ArrayBackend() if graph is None else graph
         self._nodes: dict[int, Intersection] = {}
         self._edges: dict[int, Streetsegment] = {}
         self._aeds: dict[Intersection, list[AED]] = {}
         self._runners: dict[Intersection, list[Runner]] = {}
+        self._runner_locations: dict[int, Intersection] = {}
+        # Runners that moved out of the graph, kept in case they come back
+        self._runners_outside: dict[int, Runner] = {}
+        self._heuristic = HaversineHeuristic()
+        self._aed_index = SpatialIndex(radius=ADMISSIBLE_RADIUS)
+        self._runner_index = SpatialIndex(radius=ADMISSIBLE_RADIUS)
+        # Built on the first query with a dispatch time
+        self._availability: AvailabilityIndex = None
+        # Bumped by every change to the graph, aeds or runners
+        self._changes = 0
 
     def add_node(self, node: Intersection):
+        self._changes += 1
         self._nodes[node.id] = node
-        self._graph.add_node(node)
+        self._graph.add_node(node.id, node.coords())
 
     def get_node(self, node_id: int):
         if node_id in self._nodes:
@@ -74,11 +496,14 @@ class Pathfinder:
         return list(self._nodes.values())
 
     def add_edge(self, edge: Streetsegment):
+        self._changes += 1
         self._edges[edge.id] = edge
-        self._nodes[edge.source.id] = edge.source
-        self._nodes[edge.target.id] = edge.target
-        self._graph.add_edge(edge.source, edge.target,
-                            id=edge.id, weight=edge.length)
+        nodes = self._nodes
+        for node in (edge.source, edge.target):
+            if node.id not in nodes:
+                self._graph.add_node(node.id, node.coords())
+            nodes[node.id] = node
+        self._graph.add_edge(edge.source.id, edge.target.id, edge.id, edge.length)
 
     def get_edge(self, edge_id: int):
         if edge_id in self._edges:
@@ -91,36 +516,184 @@ class Pathfinder:
         location = self.get_node(aed.intersection_id)
         if not location: return
 
+        self._changes += 1
         if location not in self._aeds:
             self._aeds[location] = [aed]
+            self._aed_index.insert(location, location.coords())
         else:
-            self._aeds[location].append(aed)
+            # Subgraph records repeat an aed on every street of its intersection
+            aeds = self._aeds[location]
+            for k, other in enumerate(aeds):
+                if other.id == aed.id:
+                    aeds[k] = aed
+                    break
+            else:
+                aeds.append(aed)
+        if self._availability is not None:
+            self._availability.add(aed)
 
     def get_aeds(self):
         return [aed for aeds in self._aeds.values() for aed in aeds]
 
     def add_runner(self, runner: Runner):
+        if runner.id in self._runner_locations or runner.id in self._runners_outside:
+            self.remove_runner(runner.id)
+        self._changes += 1
         location = self.get_node(runner.intersection_id)
-        if not location: return
+        if not location:
+            self._runners_outside[runner.id] = runner
+            return
 
         if location not in self._runners:
             self._runners[location] = [runner]
+            self._runner_index.insert(location, location.coords())
         else:
             self._runners[location].append(runner)
+        self._runner_locations[runner.id] = location
+
+    def remove_runner(self, runner_id: int):
+        self._changes += 1
+        location = self._runner_locations.pop(runner_id, None)
+        if location is None:
+            return self._runners_outside.pop(runner_id, None)
+
+        runners = self._runners[location]
+        runner = next(r for r in runners if r.id == runner_id)
+        runners.remove(runner)
+        if not runners:
+            del self._runners[location]
+            self._runner_index.remove(location)
+        # Search trees only depend on the streets, so the route cache stays
+        # valid. Only tasks computed for this runner are out of date
+        self.tasks = [task for task in self.tasks if task.runner.id != runner_id]
+        return runner
+
+    def move_runner(self, runner_id: int, intersection_id: int):
+        runner = self.remove_runner(runner_id)
+        if runner is None:
+            return None
+        runner.intersection_id = intersection_id
+        self.add_runner(runner)
+        return runner
 
     def get_runners(self):
         return [runner for runners in self._runners.values() for runner in runners]
 
-    def calculate_tasks(self, n_runners: int = None, n_aeds: int = None):
-        def to_path(nx_path: list[Intersection], aed=None):
-            source = nx_path[0]
-            target = nx_path[-1]
-            edges = []
-            if len(nx_path) > 0:
-                for u, v in zip(nx_path, nx_path[1:]):
-                    edge_id = self._graph[u][v]["id"]
-                    edges.append(self.get_edge(edge_id))
-            return Path(source=source, target=target, streets=edges, aed=aed)
+    def _available_aeds(self, at=None):
+        # AEDs by location that are open and not in use at the dispatch
+        # time, so no search is spent on the others. All AEDs without one
+        if at is None:
+            return self._aeds
+        if self._availability is None:
+            self._availability = AvailabilityIndex(self.get_aeds())
+        available = self._availability.available(at)
+        aeds = {}
+        for location, location_aeds in self._aeds.items():
+            location_aeds = [aed for aed in location_aeds if aed.id in available]
+            if location_aeds:
+                aeds[location] = location_aeds
+        return aeds
+
+    def _closest_aeds(self, source: Intersection, target: Intersection, aeds: dict = None):
+        # Yield aed locations by increasing heuristic(x, source)+heuristic(x, target).
+        # Locations are visited outwards from the target; by the triangle
+        # inequality an unvisited location at distance rho from the target
+        # has a sum of at least 2*rho - heuristic(source, target)
+        h = self._heuristic
+        direct = h(source, target)
+        heap = []
+        for rho, location in self._aed_index.iter_nearest(target.coords()):
+            if aeds is not None and location not in aeds:
+                continue
+            while heap and heap[0][0] <= 2*rho - direct:
+                yield heapq.heappop(heap)[2]
+            heapq.heappush(heap, (rho + h(location, source), id(location), location))
+        while heap:
+            yield heapq.heappop(heap)[2]
+
+    def _node(self, node_id: int):
+        # Any node of the graph, also those only reachable across the limits
+        return self._nodes[node_id]
+
+    def _neighbors(self, node: Intersection):
+        nodes = self._nodes
+        for v, length in self._graph.neighbors(node.id):
+            yield nodes[v], length
+
+    def _edge_id(self, u: Intersection, v: Intersection):
+        return self._graph.edge_id(u.id, v.id)
+
+    @instrumentation.timed("pathfinder.astar")
+    def _astar(self, source: Intersection, target: Intersection):
+        # The graph is keyed by intersection id
+        nodes = self._nodes
+        return [nodes[id] for id in self._graph.astar(source.id, target.id)]
+
+    def _length(self, u: Intersection, v: Intersection):
+        return self._graph.length(u.id, v.id)
+
+    def _to_path(self, nodes: list[Intersection], distances: list = None):
+        # distances of the nodes in the search tree they were unwound from,
+        # otherwise the street lengths are summed along the nodes
+        ids = array("q", [node.id for node in nodes])
+        if distances is not None:
+            distances = array("d", distances)
+        else:
+            distances = array("d", [0.0])
+            total = 0.0
+            for u, v in zip(nodes, nodes[1:]):
+                total += self._length(u, v)
+                distances.append(total)
+        return Path(nodes[0], nodes[-1], ids, distances, self)
+
+    @staticmethod
+    def _unwind(pred: dict, node: Intersection):
+        # Follow a predecessor map from node back to the root of the search
+        nodes = [node]
+        while pred[nodes[-1]] is not None:
+            nodes.append(pred[nodes[-1]])
+        return nodes
+
+    @instrumentation.timed("pathfinder.dijkstra")
+    def _dijkstra(self, source: Intersection, targets: set = None, n_targets: int = None, bound: dict = None, max_distance: float = None):
+        # See dijkstra, on Intersections. Views without a backend search
+        # through _neighbors
+        if self._graph is None:
+            dist, pred = dijkstra(self._neighbors, source, targets, n_targets, bound, max_distance)
+        else:
+            nodes = self._nodes
+            dist, pred = self._graph.dijkstra(
+                source.id,
+                {node.id for node in targets} if targets is not None else None,
+                n_targets,
+                {node.id: value for node, value in bound.items()} if bound else None,
+                max_distance
+            )
+            dist = {nodes[id]: d for id, d in dist.items()}
+            pred = {nodes[id]: nodes[p] if p is not None else None for id, p in pred.items()}
+        instrumentation.count("pathfinder.dijkstra_nodes", len(dist))
+        return dist, pred
+
+    def coverage(self, max_distance: float, patient: Patient = None, at=None):
+        # Number of runners and available AEDs within max_distance of the
+        # patient by network distance
+        patient = self._patient if patient is None else patient
+        target = self.get_node(patient.intersection_id)
+        if target is None:
+            return 0, 0
+        dist, _ = self._dijkstra(target, max_distance=max_distance)
+        runners = sum(len(self._runners[r]) for r in self._runners if r in dist)
+        aeds = self._available_aeds(at)
+        return runners, sum(len(aeds[a]) for a in aeds if a in dist)
+
+    @instrumentation.timed("pathfinder.calculate_tasks")
+    def calculate_tasks(self, n_runners: int = None, n_aeds: int = None, multi_target: bool = False, at=None):
+        # at is the dispatch time, a datetime or hhmm, see availability.py
+        aeds = self._available_aeds(at)
+        if multi_target:
+            self.tasks = self._calculate_tasks_multi_target(
+                n_runners, n_aeds, trees=self._trees(), aeds=aeds)
+            return self.tasks
 
         # Remove previous tasks, if any
         self.tasks = []
@@ -128,44 +701,254 @@ class Pathfinder:
         # Get target intersection
         target = self.get_node(self._patient.intersection_id)
         
-        # Limit amount of runner/aed paths to find (default is no limit)
-        a_limit = isinstance(n_aeds, int)
+        # Limit amount of runner paths to find (default is no limit)
         r_limit = isinstance(n_runners, int)
         r_i = 0
 
-        # Sort runners by shortest heuristic distance to the target
-        r_closest = sorted(self._runners, key=lambda x: heuristic(x, target))
-        for r_source in r_closest:
+        # Visit runners by shortest heuristic distance to the target
+        r_closest = self._runner_index.iter_nearest(target.coords())
+        for _, r_source in r_closest:
             if r_limit and r_i >= n_runners: break
             
             try:
-                patient_path = to_path(nx.astar_path(self._graph, r_source, target, heuristic))
+                patient_path = self._to_path(self._astar(r_source, target))
             except nx.NetworkXNoPath:
                 continue
             
-            a_i = 0
-            # Sort aeds by shortest summed heuristic distance between aed-runner and aed-target
-            a_closest = sorted(self._aeds, key=lambda x: heuristic(x, r_source)+heuristic(x, target))
-            aed_paths = []
-            for a_source in a_closest:
-                if a_limit and a_i >= n_aeds: break
-                
-                try:
-                    rtoa = to_path(nx.astar_path(self._graph, r_source, a_source, heuristic))
-                    atop = to_path(nx.astar_path(self._graph, a_source, target, heuristic))
-                    aed_path = rtoa+atop
-                except nx.NetworkXNoPath:
-                    continue
-                
-                for aed in self._aeds[a_source]:
-                    if a_i >= n_aeds: break
-                    aed_path.aed = aed
-                    aed_paths.append(aed_path)
-                    a_i += 1
-                
+            aed_paths = self._aed_paths(r_source, target, aeds, n_aeds)
             for runner in self._runners[r_source]:
-                if r_i >= n_runners: break
+                if r_limit and r_i >= n_runners: break
                 self.tasks.append(Task(runner, patient_path, aed_paths))
                 r_i += 1
-        
+
+        instrumentation.count("pathfinder.tasks", len(self.tasks))
         return self.tasks
+
+    def _aed_paths(self, r_source: Intersection, target: Intersection, aeds: dict, n_aeds: int = None):
+        # Visit aeds by shortest summed heuristic distance between aed-runner and aed-target
+        a_limit = isinstance(n_aeds, int)
+        aed_paths = []
+        for a_source in self._closest_aeds(r_source, target, aeds):
+            if a_limit and len(aed_paths) >= n_aeds: break
+
+            try:
+                rtoa = self._to_path(self._astar(r_source, a_source))
+                atop = self._to_path(self._astar(a_source, target))
+                aed_path = rtoa+atop
+            except nx.NetworkXNoPath:
+                continue
+
+            for aed in aeds[a_source]:
+                if a_limit and len(aed_paths) >= n_aeds: break
+                aed_paths.append(AEDPath(aed_path, aed))
+        return aed_paths
+
+    def iter_tasks(self, n_runners: int = None, n_aeds: int = None, at=None, deadline: float = None):
+        # Yield tasks by increasing patient latency, each as soon as no
+        # runner left can beat it, so the first alert does not wait for the
+        # rest. Runners are taken by straight line distance over speed, a
+        # lower bound on their latency, and routed with A* one at a time. A
+        # routed task is proven once its latency is within the smallest bound
+        # left, and once n_runners are proven the remaining candidates, whose
+        # bounds exceed the last of them, are never routed. With a deadline
+        # in seconds no runner is routed after it has passed, so the tasks
+        # yielded by then are the best ones found in time
+        self.tasks = []
+        target = self.get_node(self._patient.intersection_id)
+        if target is None or not self._runners:
+            return
+        aeds = self._available_aeds(at)
+        stop = None if deadline is None else default_timer() + deadline
+        top_speed = max(runner.speed for runners in self._runners.values() for runner in runners)
+
+        # Runner locations come out of the index by distance, runners wait in
+        # candidates by bound until no unseen location can have a smaller one
+        nearest = self._runner_index.iter_nearest(target.coords())
+        frontier = 0.0
+        candidates = []
+        routed = []
+        patient_paths = {}
+        aed_paths = {}
+        counter = 0
+        while True:
+            while frontier < math.inf and (not candidates or candidates[0][0] > frontier / top_speed):
+                frontier, r_source = next(nearest, (math.inf, None))
+                if r_source is not None:
+                    for runner in self._runners[r_source]:
+                        heapq.heappush(candidates, (frontier / runner.speed, counter, runner, r_source))
+                        counter += 1
+            bound = candidates[0][0] if candidates else math.inf
+
+            while routed and routed[0][0] <= bound:
+                _, _, runner, r_source = heapq.heappop(routed)
+                if r_source not in aed_paths:
+                    aed_paths[r_source] = self._aed_paths(r_source, target, aeds, n_aeds)
+                task = Task(runner, patient_paths[r_source], aed_paths[r_source])
+                self.tasks.append(task)
+                instrumentation.count("pathfinder.tasks")
+                yield task
+                if n_runners is not None and len(self.tasks) >= n_runners:
+                    return
+            if not candidates:
+                return
+
+            _, _, runner, r_source = heapq.heappop(candidates)
+            if r_source not in patient_paths:
+                if stop is not None and default_timer() > stop:
+                    instrumentation.count("pathfinder.deadline_exceeded")
+                    return
+                try:
+                    patient_paths[r_source] = self._to_path(self._astar(r_source, target))
+                except nx.NetworkXNoPath:
+                    patient_paths[r_source] = None
+            if patient_paths[r_source] is not None:
+                latency = patient_paths[r_source].length / runner.speed
+                heapq.heappush(routed, (latency, counter, runner, r_source))
+                counter += 1
+
+
+    @instrumentation.timed("pathfinder.calculate_tasks_batch")
+    def calculate_tasks_batch(self, patients: list[Patient], n_runners: int = None, n_aeds: int = None, at=None):
+        # Tasks for several patients on the same graph. Search trees from
+        # patients and aed locations are computed at most once and shared
+        # between patients, so overlapping incidents reuse each other's work
+        trees = self._trees() or {}
+        aeds = self._available_aeds(at)
+        return [
+            self._calculate_tasks_multi_target(n_runners, n_aeds, patient, trees, aeds)
+            for patient in patients
+        ]
+
+    def for_patient(self, patient: Patient):
+        # Pathfinder for another patient sharing this graph, runners and aeds
+        pf = copy.copy(self)
+        pf.tasks = []
+        pf._patient = patient
+        return pf
+
+    def _trees(self):
+        if self._cache is not None:
+            return self._cache.scope(self.limits)
+
+    def _tree(self, source: Intersection, trees: dict = None):
+        if trees is None:
+            return self._dijkstra(source)
+        tree = trees.get(source)
+        if tree is None:
+            tree = self._dijkstra(source)
+            trees[source] = tree
+        return tree
+
+    def warm_aed_trees(self):
+        # Keep a distance table from every aed location in the route cache
+        trees = self._trees()
+        if trees is not None:
+            for location in self._aeds:
+                self._tree(location, trees)
+
+    def _runner_detours(self, r_source: Intersection, atop_dist: dict, n_aeds: int = None, aeds: dict = None):
+        # One search from the runner to all aeds, stopped as soon as the
+        # n_aeds best runner->aed->patient detours are known
+        r_dist, r_pred = self._dijkstra(
+            r_source,
+            targets=set(atop_dist),
+            n_targets=n_aeds,
+            bound=atop_dist
+        )
+        detours = []
+        for a in atop_dist:
+            if a in r_dist:
+                nodes = self._unwind(r_pred, a)[::-1]
+                detours.append((r_dist[a] + atop_dist[a], a, nodes, [r_dist[n] for n in nodes]))
+        return sorted(detours, key=lambda x: x[0])
+
+    def _aed_detours(self, r_sources: list[Intersection], atop_dist: dict, n_aeds: int = None, trees: dict = None):
+        # Full trees from aed locations, visited by increasing distance to
+        # the patient, give runner->aed distances for every runner at once.
+        # An aed further from the patient than every runner's n_aeds-th best
+        # detour cannot improve any of them, so the remaining trees are skipped
+        best = {r: [] for r in r_sources}
+        for a_source in sorted(atop_dist, key=lambda x: atop_dist[x]):
+            if n_aeds is not None and all(
+                len(b) >= n_aeds and b[n_aeds-1][0] <= atop_dist[a_source]
+                for b in best.values()
+            ):
+                break
+            tree = self._tree(a_source, trees)
+            a_dist = tree[0]
+            for r_source, b in best.items():
+                if r_source in a_dist:
+                    bisect.insort(
+                        b, (a_dist[r_source] + atop_dist[a_source], a_source, tree),
+                        key=lambda x: x[0]
+                    )
+        detours = {}
+        for r, b in best.items():
+            detours[r] = []
+            for total, a, (a_dist, a_pred) in b:
+                nodes = self._unwind(a_pred, r)
+                detours[r].append((total, a, nodes, [a_dist[n] for n in nodes]))
+        return detours
+
+    def _calculate_tasks_multi_target(self, n_runners: int = None, n_aeds: int = None, patient: Patient = None, trees: dict = None, aeds: dict = None):
+        tasks = []
+        patient = self._patient if patient is None else patient
+        aeds = self._aeds if aeds is None else aeds
+
+        # Get target intersection
+        target = self.get_node(patient.intersection_id)
+        if target is None:
+            return tasks
+
+        # Limit amount of runner/aed paths to find (default is no limit)
+        a_limit = isinstance(n_aeds, int)
+        r_limit = isinstance(n_runners, int)
+        r_i = 0
+
+        # One search from the patient gives every runner->patient and
+        # aed->patient distance, as the street graph is undirected
+        p_dist, p_pred = self._tree(target, trees)
+        atop_dist = {a: p_dist[a] for a in aeds if a in p_dist}
+
+        # Pick runners by shortest network distance to the target
+        r_closest = []
+        for r_source in sorted([r for r in self._runners if r in p_dist], key=lambda x: p_dist[x]):
+            if r_limit and r_i >= n_runners: break
+            r_closest.append(r_source)
+            r_i += len(self._runners[r_source])
+
+        if a_limit and n_aeds <= 0:
+            detours = {r: [] for r in r_closest}
+        elif trees is None:
+            detours = {
+                r: self._runner_detours(r, atop_dist, n_aeds if a_limit else None, aeds)
+                for r in r_closest
+            }
+        else:
+            detours = self._aed_detours(
+                r_closest, atop_dist, n_aeds if a_limit else None, trees)
+
+        r_i = 0
+        for r_source in r_closest:
+            nodes = self._unwind(p_pred, r_source)
+            patient_path = self._to_path(nodes, [p_dist[n] for n in nodes])
+
+            aed_paths = []
+            for _, a_source, rtoa_nodes, rtoa_distances in detours[r_source]:
+                if a_limit and len(aed_paths) >= n_aeds: break
+
+                rtoa = self._to_path(rtoa_nodes, rtoa_distances)
+                nodes = self._unwind(p_pred, a_source)
+                atop = self._to_path(nodes, [p_dist[n] for n in nodes])
+                aed_path = rtoa+atop
+                for aed in aeds[a_source]:
+                    if a_limit and len(aed_paths) >= n_aeds: break
+                    aed_paths.append(AEDPath(aed_path, aed))
+
+            for runner in self._runners[r_source]:
+                if r_limit and r_i >= n_runners: break
+                tasks.append(Task(runner, patient_path, aed_paths))
+                r_i += 1
+
+        instrumentation.count("pathfinder.tasks", len(tasks))
+        return tasks
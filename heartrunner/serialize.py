@@ -0,0 +1,126 @@
+import json
+from collections import OrderedDict
+from .types import *
+from .pathfinder import Pathfinder, Task
+
+# Dispatch results as one GeoJSON FeatureCollection for map clients, written
+# straight to bytes instead of through geojson.Feature objects:
+#
+#   writer = DispatchWriter()
+#   payload = writer.dispatch(pf, tasks)
+#   for chunk in writer.iter_dispatch(pf, tasks):  # streamed
+#       response.write(chunk)
+#
+# Features come in this order: the patient, a point per runner and per AED,
+# then a Route per runner->patient and runner->AED->patient path without
+# geometry, listing its street ids, then every street on any route once. A
+# street's feature is encoded the first time the street is written and
+# reused for later dispatches of the same writer, as long as the street
+# still has the same geometry and length, so a reloaded network never gets
+# stale features. At most max_streets features are kept, the least recently
+# written go first. Geometry strings as read from the CSVs or neo4j are
+# copied without being parsed.
+
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+_BOOL = {True: b"true", False: b"false"}
+_POINT = b'{"type":"Feature","geometry":{"type":"Point","coordinates":[%r,%r]},"properties":{%s}}'
+_LINE = b'{"type":"LineString","coordinates":[[%r,%r],[%r,%r]]}'
+_STREET = (
+    b'{"type":"Feature","id":%d,"geometry":%s,'
+    b'"properties":{"type":"Streetsegment","id":%d,"length":%r}}'
+)
+_ROUTE = (
+    b',{"type":"Feature","geometry":null,"properties":{"type":"Route","id":%d,'
+    b'"runner":%d,"aed":%s,"length":%r,"latency":%r,"streets":[%s]}}'
+)
+
+
+def _point(longitude: float, latitude: float, properties: bytes):
+    return _POINT % (longitude, latitude, properties)
+
+
+class DispatchWriter:
+
+    def __init__(self, max_streets=100_000):
+        self.max_streets = max_streets
+        # Street id -> (geometry, length, encoded feature), oldest first
+        self._streets: OrderedDict[int, tuple] = OrderedDict()
+
+    def clear(self):
+        self._streets.clear()
+
+    def _street(self, street: Streetsegment):
+        cached = self._streets.get(street.id)
+        if cached is not None:
+            geometry, length, head = cached
+            if (geometry is street._geometry or geometry == street._geometry) and length == street.length:
+                self._streets.move_to_end(street.id)
+                return head
+        geometry = street._geometry
+        if geometry is None:
+            # Not loaded, a straight line stands in and is not kept
+            geometry = _LINE % (
+                street.source.longitude, street.source.latitude,
+                street.target.longitude, street.target.latitude)
+        elif isinstance(geometry, str):
+            geometry = geometry.encode()
+        else:
+            geometry = _encode(geometry).encode()
+        head = _STREET % (street.id, geometry, street.id, street.length)
+        if street._geometry is not None and self.max_streets > 0:
+            self._streets[street.id] = (street._geometry, street.length, head)
+            self._streets.move_to_end(street.id)
+            if len(self._streets) > self.max_streets:
+                self._streets.popitem(last=False)
+        return head
+
+    def iter_dispatch(self, pf: Pathfinder, tasks: list[Task] = None, patient: Patient = None):
+        tasks = pf.tasks if tasks is None else tasks
+        patient = pf._patient if patient is None else patient
+        yield b'{"type":"FeatureCollection","features":['
+        location = pf._node(patient.intersection_id)
+        yield _point(location.longitude, location.latitude, b'"type":"Patient","id":%d' % patient.id)
+
+        runners = {}
+        aeds = {}
+        routes = []
+        for task in tasks:
+            runners.setdefault(task.runner.id, (task.runner, task.patient_path.source))
+            routes.append((task.runner, None, task.patient_path, task.patient_latency))
+            for aed_path, latency in zip(task.aed_paths, task.aed_latencies):
+                aeds.setdefault(aed_path.aed.id, aed_path.aed)
+                routes.append((task.runner, aed_path.aed, aed_path.path, latency))
+
+        for runner, location in runners.values():
+            yield b"," + _point(
+                location.longitude, location.latitude,
+                b'"type":"Runner","id":%d,"speed":%r' % (runner.id, runner.speed))
+        for aed in aeds.values():
+            location = pf._node(aed.intersection_id)
+            yield b"," + _point(
+                location.longitude, location.latitude,
+                b'"type":"AED","id":%d,"in_use":%s,"open_hour":%d,"close_hour":%d' % (
+                    aed.id, _BOOL[aed.in_use], aed.open_hour, aed.close_hour))
+
+        # Runners at one intersection share their paths, and so do the AEDs at
+        # one, so each path is walked once
+        street_ids: dict[int, bytes] = {}
+        streets: dict[int, Streetsegment] = {}
+        for k, (runner, aed, path, latency) in enumerate(routes):
+            ids = street_ids.get(id(path))
+            if ids is None:
+                ids = []
+                for street in path.streets:
+                    ids.append(street.id)
+                    if street.id not in streets:
+                        streets[street.id] = street
+                ids = street_ids[id(path)] = ",".join(map(str, ids)).encode()
+            yield _ROUTE % (k, runner.id, b"null" if aed is None else b"%d" % aed.id, path.length, latency, ids)
+
+        for street in streets.values():
+            yield b"," + self._street(street)
+        yield b"]}"
+
+    def dispatch(self, pf: Pathfinder, tasks: list[Task] = None, patient: Patient = None):
+        return b"".join(self.iter_dispatch(pf, tasks, patient))
+
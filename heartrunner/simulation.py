@@ -0,0 +1,274 @@
+import math
+import heapq
+import random
+import statistics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from timeit import default_timer
+from .types import *
+from .util import iter_csv
+
+# Discrete event load simulation of the dispatch pipeline. An incident
+# stream, seeded Poisson arrivals or a recorded trace, is replayed against
+# a HeartrunnerDB or a MemoryHeartrunnerDB:
+#
+#   incidents = poisson_incidents(2.0, 600, db.get_intersection_ids(), seed=0)
+#   report = Simulation(db, incidents, concurrency=4, move_rate=5).run()
+#   print(report.summary())
+#
+# The concurrency dispatchers are threads that run dispatches for real and
+# side by side, so a dispatch's service time is its wall clock time under
+# contention with the others, for cores, the GIL and the database. While a
+# dispatch runs, simulated time follows the wall clock and the arrivals,
+# releases and runner moves that fall due meanwhile are applied on time;
+# while every dispatcher is idle it skips ahead to the next event. Queues
+# thus build up exactly when incidents arrive faster than they can be
+# routed. Runners alerted for an incident are unavailable for a while, and
+# meanwhile runners move around, so the database sees the churn of a real
+# event. The db must be safe to use from several threads, as HeartrunnerDB
+# and MemoryHeartrunnerDB are.
+
+
+class Incident:
+    __slots__ = ("patient", "arrival", "start", "finish", "tasks")
+
+    def __init__(self, patient: Patient, arrival: float):
+        self.patient = patient
+        # Seconds since the start of the simulation
+        self.arrival = arrival
+        self.start: float = None
+        self.finish: float = None
+        self.tasks: list = None
+
+    def __repr__(self) -> str:
+        return f"Incident({self.patient.id} at {self.arrival:.1f}s)"
+
+    def queueing(self):
+        return self.start - self.arrival
+
+    def service(self):
+        return self.finish - self.start
+
+    def latency(self):
+        return self.finish - self.arrival
+
+
+def poisson_incidents(rate: float, duration: float, intersection_ids: list[int], seed=None):
+    # rate incidents per second for duration seconds, at random intersections
+    rng = random.Random(seed)
+    incidents = []
+    t = rng.expovariate(rate)
+    while t < duration:
+        patient = Patient(id=len(incidents) + 1, intersection_id=rng.choice(intersection_ids))
+        incidents.append(Incident(patient, t))
+        t += rng.expovariate(rate)
+    return incidents
+
+
+def trace_incidents(path):
+    # A CSV with time, seconds since the start of the trace, intersection_id
+    # and optionally id columns
+    incidents = []
+    for k, row in enumerate(iter_csv(path)):
+        id = int(row["id"]) if row.get("id") else k + 1
+        patient = Patient(id=id, intersection_id=int(row["intersection_id"]))
+        incidents.append(Incident(patient, float(row["time"])))
+    return sorted(incidents, key=lambda incident: incident.arrival)
+
+
+def percentiles(samples: list[float]):
+    if len(samples) < 2:
+        return {key: samples[0] if samples else 0.0 for key in ("p50", "p95", "p99", "max")}
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": q[49], "p95": q[94], "p99": q[98], "max": max(samples)}
+
+
+class Report:
+
+    def __init__(self, incidents: list[Incident], concurrency: int, max_queue: int, moves: int, elapsed: float):
+        self.incidents = incidents
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.moves = moves
+        self.elapsed = elapsed
+        self.completed = [incident for incident in incidents if incident.tasks is not None]
+        self.failed = len(incidents) - len(self.completed)
+
+    def offered_rate(self):
+        if len(self.incidents) < 2:
+            return 0.0
+        span = self.incidents[-1].arrival - self.incidents[0].arrival
+        return (len(self.incidents) - 1) / span if span > 0 else math.inf
+
+    def throughput(self):
+        # Sustained incidents per second, from the first arrival to the last
+        # dispatch out of the pipeline
+        if not self.incidents:
+            return 0.0
+        span = max(incident.finish for incident in self.incidents) - self.incidents[0].arrival
+        return len(self.completed) / span if span > 0 else math.inf
+
+    def utilization(self):
+        if not self.incidents:
+            return 0.0
+        span = max(incident.finish for incident in self.incidents) - self.incidents[0].arrival
+        busy = sum(incident.service() for incident in self.incidents)
+        return busy / (self.concurrency * span) if span > 0 else 1.0
+
+    def summary(self):
+        return {
+            "incidents": len(self.incidents),
+            "failed": self.failed,
+            "concurrency": self.concurrency,
+            "offered_per_s": self.offered_rate(),
+            "throughput_per_s": self.throughput(),
+            "utilization": self.utilization(),
+            "max_queue": self.max_queue,
+            "runner_moves": self.moves,
+            "queueing_s": percentiles([incident.queueing() for incident in self.incidents]),
+            "service_s": percentiles([incident.service() for incident in self.incidents]),
+            "latency_s": percentiles([incident.latency() for incident in self.incidents]),
+            "elapsed_s": self.elapsed
+        }
+
+
+class Simulation:
+    # db is a HeartrunnerDB or MemoryHeartrunnerDB, incidents are in order of
+    # arrival. The first responders runners of every dispatch are
+    # unavailable for busy seconds after it, move_rate runner moves per
+    # second are applied in batches every tick seconds. With start, a
+    # datetime, AEDs are filtered by opening hours at the simulated time
+
+    def __init__(
+        self,
+        db,
+        incidents: list[Incident],
+        concurrency=1,
+        n_runners=20,
+        n_aeds=3,
+        responders=2,
+        busy=900.0,
+        move_rate=0.0,
+        tick=10.0,
+        start: datetime = None,
+        seed=None
+    ):
+        self.db = db
+        self.incidents = incidents
+        self.concurrency = concurrency
+        self.n_runners = n_runners
+        self.n_aeds = n_aeds
+        self.responders = responders
+        self.busy = busy
+        self.move_rate = move_rate
+        self.tick = tick
+        self.start = start
+        self._rng = random.Random(seed)
+        self._events = []
+        self._counter = 0
+
+    def _push(self, time: float, kind: str, payload=None):
+        heapq.heappush(self._events, (time, self._counter, kind, payload))
+        self._counter += 1
+
+    def run(self):
+        time1 = default_timer()
+        runner_ids = []
+        intersection_ids = []
+        if self.move_rate > 0:
+            runner_ids = [runner.id for runner in self.db.get_nodes(NodeType.Runner)]
+            intersection_ids = self.db.get_intersection_ids()
+            self._push(self.tick, "tick")
+
+        for incident in self.incidents:
+            self._push(incident.arrival, "arrival", incident)
+        # Incidents not yet out of the pipeline, moves stop after the last
+        pending = len(self.incidents)
+        free = self.concurrency
+        queue = deque()
+        max_queue = 0
+        moves = 0
+        running = set()
+        # Wall clock time at simulated time 0, moved on while nothing runs
+        offset = default_timer()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while self._events or running:
+                if running:
+                    now = default_timer() - offset
+                    due = self._events[0][0] if self._events else None
+                    if due is None or due > now:
+                        timeout = None if due is None else due - now
+                        done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            incident, finished = future.result()
+                            incident.finish = finished - offset
+                            self._push(incident.finish, "finish", incident)
+                        now = default_timer() - offset
+                elif self._events:
+                    now = self._events[0][0]
+                    offset = default_timer() - now
+
+                while self._events and self._events[0][0] <= now:
+                    time, _, kind, payload = heapq.heappop(self._events)
+                    match kind:
+                        case "arrival":
+                            queue.append(payload)
+                            max_queue = max(max_queue, len(queue))
+                        case "finish":
+                            free += 1
+                            pending -= 1
+                            responders = self._responders(payload)
+                            if responders:
+                                self.db.set_runner_available(responders, False)
+                                self._push(time + self.busy, "release", responders)
+                        case "release":
+                            self.db.set_runner_available(payload, True)
+                        case "tick":
+                            moves += self._move(runner_ids, intersection_ids)
+                            if pending:
+                                self._push(time + self.tick, "tick")
+
+                while free and queue:
+                    incident = queue.popleft()
+                    free -= 1
+                    incident.start = default_timer() - offset
+                    running.add(executor.submit(self._dispatch, incident, incident.start))
+
+        return Report(self.incidents, self.concurrency, max_queue, moves, default_timer() - time1)
+
+    def _dispatch(self, incident: Incident, now: float):
+        # On a dispatcher thread, returns the wall clock time it finished at
+        at = None if self.start is None else self.start + timedelta(seconds=now)
+        pf = self.db.get_pathfinder(incident.patient)
+        if pf is not None:
+            incident.tasks = pf.calculate_tasks(
+                n_runners=self.n_runners, n_aeds=self.n_aeds, multi_target=True, at=at)
+        return incident, default_timer()
+
+    def _responders(self, incident: Incident):
+        ids = []
+        for task in incident.tasks or []:
+            if len(ids) >= self.responders:
+                break
+            if task.runner.id not in ids:
+                ids.append(task.runner.id)
+        return ids
+
+    def _move(self, runner_ids: list[int], intersection_ids: list[int]):
+        # Moves in one tick of a Poisson process of move_rate per second
+        if not runner_ids or not intersection_ids:
+            return 0
+        n = 0
+        t = self._rng.expovariate(self.move_rate)
+        while t < self.tick:
+            n += 1
+            t += self._rng.expovariate(self.move_rate)
+        moves = [
+            (self._rng.choice(runner_ids), self._rng.choice(intersection_ids))
+            for _ in range(n)
+        ]
+        if moves:
+            self.db.move_runners(moves)
+        return len(moves)
@@ -0,0 +1,252 @@
+import os
+import sys
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from .types import *
+from .network import RoadNetwork, INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH, AEDS_CSV_PATH
+
+# Binary snapshot of a RoadNetwork, its AEDs and optionally runners, loaded
+# with mmap so a worker starts without parsing anything and every process
+# mapping the same file shares one page cached copy:
+#
+#   snapshot.write("data/dc.snap", RoadNetwork.from_csv(geometry=True), runners)
+#   network = snapshot.load("data/dc.snap")
+#
+# The file is a header, a table of (offset, length) per section, and the
+# sections, each a fixed width array aligned to 8 bytes in native byte
+# order. Nodes are addressed by index as in RoadNetwork, the adjacency
+# sections are its CSR arrays, and geometries are a blob of UTF-8 GeoJSON
+# strings found through sorted street ids and offsets into the blob.
+
+_MAGIC = b"HRSNAP"
+_VERSION = 1
+# magic, version, byte order, then node, slot, street, aed, runner and geometry counts
+_HEADER = struct.Struct("<6sHB7x6q")
+_ENTRY = struct.Struct("<qq")
+_ALIGN = 8
+_SECTIONS = [
+    # intersections
+    ("ids", "i"),
+    ("latitudes", "f"),
+    ("longitudes", "f"),
+    # adjacency, see RoadNetwork
+    ("offsets", "i"),
+    ("targets", "i"),
+    ("edge_ids", "i"),
+    ("lengths", "f"),
+    # streets once each, ends as node indices
+    ("street_ids", "i"),
+    ("street_heads", "i"),
+    ("street_tails", "i"),
+    ("street_lengths", "f"),
+    ("aed_ids", "i"),
+    ("aed_intersections", "i"),
+    ("aed_open", "i"),
+    ("aed_close", "i"),
+    ("aed_in_use", "b"),
+    ("runner_ids", "i"),
+    ("runner_intersections", "i"),
+    ("runner_speeds", "d"),
+    # geometry of street geometry_ids[k] is blob[geometry_offsets[k]:geometry_offsets[k+1]]
+    ("geometry_ids", "i"),
+    ("geometry_offsets", "q"),
+    ("geometry_blob", "B")
+]
+_BYTE_ORDER = {"little": 1, "big": 2}
+
+
+def _streets(network: RoadNetwork):
+    # Each street once, from the first of its two slots
+    seen = set()
+    ids, heads, tails, lengths = array("i"), array("i"), array("i"), array("f")
+    for i in range(len(network)):
+        for slot in range(network.offsets[i], network.offsets[i+1]):
+            edge_id = network.edge_ids[slot]
+            if edge_id in seen:
+                continue
+            seen.add(edge_id)
+            ids.append(edge_id)
+            heads.append(i)
+            tails.append(network.targets[slot])
+            lengths.append(network.lengths[slot])
+    return ids, heads, tails, lengths
+
+
+def write(path, network: RoadNetwork, runners: list[Runner] = [], geometries: dict = None):
+    # Geometries default to the ones the network was built with
+    if geometries is None:
+        geometries = network._geometries
+    street_ids, heads, tails, street_lengths = _streets(network)
+    aeds = list(network.aeds.values())
+    runners = [runner for runner in runners if runner.intersection_id in network.index]
+
+    geometry_ids = array("i", sorted(id for id in street_ids if geometries.get(id) is not None))
+    geometry_offsets = array("q", [0])
+    blob = bytearray()
+    for id in geometry_ids:
+        blob += geometries.get(id).encode()
+        geometry_offsets.append(len(blob))
+
+    columns = {
+        "ids": array("i", network.ids),
+        "latitudes": array("f", network.latitudes),
+        "longitudes": array("f", network.longitudes),
+        "offsets": array("i", network.offsets),
+        "targets": array("i", network.targets),
+        "edge_ids": array("i", network.edge_ids),
+        "lengths": array("f", network.lengths),
+        "street_ids": street_ids,
+        "street_heads": heads,
+        "street_tails": tails,
+        "street_lengths": street_lengths,
+        "aed_ids": array("i", [aed.id for aed in aeds]),
+        "aed_intersections": array("i", [aed.intersection_id for aed in aeds]),
+        "aed_open": array("i", [aed.open_hour for aed in aeds]),
+        "aed_close": array("i", [aed.close_hour for aed in aeds]),
+        "aed_in_use": array("b", [aed.in_use for aed in aeds]),
+        "runner_ids": array("i", [runner.id for runner in runners]),
+        "runner_intersections": array("i", [runner.intersection_id for runner in runners]),
+        "runner_speeds": array("d", [runner.speed for runner in runners]),
+        "geometry_ids": geometry_ids,
+        "geometry_offsets": geometry_offsets,
+        "geometry_blob": array("B", blob)
+    }
+
+    offset = _HEADER.size + _ENTRY.size * len(_SECTIONS)
+    table = []
+    for name, _ in _SECTIONS:
+        offset += -offset % _ALIGN
+        size = len(columns[name]) * columns[name].itemsize
+        table.append((offset, size))
+        offset += size
+
+    # Written next to the target and renamed, so a worker never maps a half written file
+    partial = f"{path}.partial"
+    with open(partial, "wb") as file:
+        file.write(_HEADER.pack(
+            _MAGIC, _VERSION, _BYTE_ORDER[sys.byteorder],
+            len(network), len(network.targets), len(street_ids),
+            len(aeds), len(runners), len(geometry_ids)
+        ))
+        for entry in table:
+            file.write(_ENTRY.pack(*entry))
+        for (name, _), (offset, _) in zip(_SECTIONS, table):
+            file.write(bytes(offset - file.tell()))
+            columns[name].tofile(file)
+    os.replace(partial, path)
+    return offset
+
+
+def export_csv(
+    path,
+    intersections_path=INTERSECTIONS_CSV_PATH,
+    streets_path=STREETS_CSV_PATH,
+    aeds_path=AEDS_CSV_PATH
+):
+    return write(path, RoadNetwork.from_csv(intersections_path, streets_path, aeds_path, geometry=True))
+
+
+class Geometries:
+    # Read only mapping from street id to GeoJSON string over the geometry
+    # sections, a string is decoded when it is asked for
+
+    def __init__(self, ids: memoryview, offsets: memoryview, blob: memoryview):
+        self._ids = ids
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _find(self, street_id: int):
+        k = bisect_left(self._ids, street_id)
+        if k < len(self._ids) and self._ids[k] == street_id:
+            return k
+        return None
+
+    def __contains__(self, street_id: int):
+        return self._find(street_id) is not None
+
+    def get(self, street_id: int, default=None):
+        k = self._find(street_id)
+        if k is None:
+            return default
+        return str(self._blob[self._offsets[k]:self._offsets[k+1]], "utf-8")
+
+
+class Snapshot:
+    # A snapshot file mapped into memory, its sections as memoryviews
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"{self.path} is not a network snapshot")
+        magic, version, byte_order, *counts = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            raise ValueError(f"{self.path} is not a network snapshot")
+        if version != _VERSION:
+            raise ValueError(f"{self.path} is snapshot version {version}, expected {_VERSION}")
+        if byte_order != _BYTE_ORDER[sys.byteorder]:
+            raise ValueError(f"{self.path} was written on a machine with another byte order")
+        self.n_nodes, self.n_slots, self.n_streets, self.n_aeds, self.n_runners, self.n_geometries = counts
+
+        view = memoryview(self._mmap)
+        self.sections = {}
+        for k, (name, typecode) in enumerate(_SECTIONS):
+            offset, size = _ENTRY.unpack_from(self._mmap, _HEADER.size + k * _ENTRY.size)
+            if offset + size > len(self._mmap):
+                raise ValueError(f"{self.path} is truncated")
+            self.sections[name] = view[offset:offset + size].cast(typecode)
+
+    def __getitem__(self, name: str):
+        return self.sections[name]
+
+    def network(self):
+        s = self.sections
+        aeds = [
+            AED(id=id, intersection_id=intersection_id, time_range=(open_hour, close_hour), in_use=in_use)
+            for id, intersection_id, open_hour, close_hour, in_use in zip(
+                s["aed_ids"], s["aed_intersections"], s["aed_open"], s["aed_close"], s["aed_in_use"])
+        ]
+        network = MappedNetwork.from_arrays(
+            s["ids"], s["latitudes"], s["longitudes"],
+            s["offsets"], s["targets"], s["edge_ids"], s["lengths"],
+            aeds, Geometries(s["geometry_ids"], s["geometry_offsets"], s["geometry_blob"])
+        )
+        network.path = self.path
+        return network
+
+    def runners(self):
+        s = self.sections
+        return [
+            Runner(id=id, speed=speed, intersection_id=intersection_id)
+            for id, intersection_id, speed in zip(
+                s["runner_ids"], s["runner_intersections"], s["runner_speeds"])
+        ]
+
+    def streets(self):
+        # (id, head_id, tail_id, length) of every street, as in the streets CSV
+        s = self.sections
+        ids = s["ids"]
+        return [
+            (id, ids[head], ids[tail], length)
+            for id, head, tail, length in zip(
+                s["street_ids"], s["street_heads"], s["street_tails"], s["street_lengths"])
+        ]
+
+
+class MappedNetwork(RoadNetwork):
+    # RoadNetwork over a snapshot. Its arrays are views of the mapping and
+    # cannot be pickled, so it pickles as its path and a spawned worker
+    # maps the same file again
+
+    def __reduce__(self):
+        return load, (self.path,)
+
+
+def load(path):
+    return Snapshot(path).network()
@@ -0,0 +1,192 @@
+import math
+import heapq
+from math import sin, asin, sqrt
+
+# Same mean earth radius as geopy's great_circle
+EARTH_RADIUS = 6371009.0
+# Smallest radius of curvature of the WGS-84 ellipsoid. Street lengths are
+# geodesic distances, so great circle distances on a sphere this size never
+# overestimate them, which keeps A* heuristics admissible
+ADMISSIBLE_RADIUS = 6335439.0
+
+
+def haversine(coords_a: tuple, coords_b: tuple, radius=EARTH_RADIUS):
+    lat_a, lon_a = math.radians(coords_a[0]), math.radians(coords_a[1])
+    lat_b, lon_b = math.radians(coords_b[0]), math.radians(coords_b[1])
+    h = (
+        math.sin((lat_b - lat_a) / 2) ** 2 +
+        math.cos(lat_a) * math.cos(lat_b) * math.sin((lon_b - lon_a) / 2) ** 2
+    )
+    return 2 * radius * math.asin(min(1.0, math.sqrt(h)))
+
+
+def _prepare(coords: tuple):
+    lat = math.radians(coords[0])
+    return (lat, math.radians(coords[1]), math.cos(lat))
+
+
+def _haversine_prepared(a: tuple, b: tuple, radius: float):
+    h = (
+        math.sin((b[0] - a[0]) / 2) ** 2 +
+        a[2] * b[2] * math.sin((b[1] - a[1]) / 2) ** 2
+    )
+    return 2 * radius * math.asin(min(1.0, math.sqrt(h)))
+
+
+class HaversineHeuristic:
+    # A* heuristic with radians and cos(latitude) computed once per node id,
+    # leaving two sines, a square root and an arcsine per evaluation
+
+    def __init__(self, radius=ADMISSIBLE_RADIUS):
+        self.radius = radius
+        self._diameter = 2 * radius
+        self._prepared: dict[int, tuple] = {}
+
+    def _get(self, node):
+        p = self._prepared[node.id] = _prepare(node.coords())
+        return p
+
+    def __call__(self, node_a, node_b):
+        prepared = self._prepared
+        a = prepared.get(node_a.id) or self._get(node_a)
+        b = prepared.get(node_b.id) or self._get(node_b)
+        h = sin((b[0] - a[0]) * 0.5) ** 2 + a[2] * b[2] * sin((b[1] - a[1]) * 0.5) ** 2
+        return self._diameter * asin(sqrt(h) if h < 1.0 else 1.0)
+
+    def distances(self, source, nodes: list):
+        # Batched form for ranking candidates against a single source
+        prepared = self._prepared
+        s = prepared.get(source.id) or self._get(source)
+        radius = self.radius
+        return [
+            _haversine_prepared(s, prepared.get(node.id) or self._get(node), radius)
+            for node in nodes
+        ]
+
+
+class SpatialIndex:
+    # Uniform grid over equirectangular projected coordinates (meters).
+    # Cells are only used to find candidates, distances are refined with the
+    # haversine formula, so results agree with great_circle. The projection
+    # is exact along meridians, along parallels it stretches distances by
+    # cos(origin latitude) / cos(latitude), which is a fraction of a percent
+    # over a city but several percent over a state. The ring search shrinks
+    # its reach by the worst stretch between the origin and the furthest
+    # latitude seen so far, so results stay exact at any extent, and only
+    # get slower the further the points are from the origin latitude. Pass
+    # origin_latitude as the middle of the data for large extents. Not meant
+    # for data reaching the poles.
+
+    _MARGIN = 0.99
+
+    def __init__(self, cell_size=250, origin_latitude=None, radius=EARTH_RADIUS):
+        self.cell_size = cell_size
+        self.radius = radius
+        self._cos_origin = None
+        if origin_latitude is not None:
+            self._cos_origin = math.cos(math.radians(origin_latitude))
+        # Smallest cos(latitude) inserted, see iter_nearest
+        self._cos_min = 1.0
+        self._cells: dict[tuple, dict] = {}
+        self._keys: dict = {}
+        self._bounds = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def _cell(self, coords: tuple):
+        if self._cos_origin is None:
+            self._cos_origin = math.cos(math.radians(coords[0]))
+        x = math.radians(coords[1]) * EARTH_RADIUS * self._cos_origin
+        y = math.radians(coords[0]) * EARTH_RADIUS
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, key, coords: tuple):
+        if key in self._keys:
+            self.remove(key)
+        cell = self._cell(coords)
+        prepared = self._cells.setdefault(cell, {})[key] = _prepare(coords)
+        self._cos_min = min(self._cos_min, prepared[2])
+        self._keys[key] = cell
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[1], cell[0], cell[1]]
+        else:
+            b = self._bounds
+            b[0], b[1] = min(b[0], cell[0]), min(b[1], cell[1])
+            b[2], b[3] = max(b[2], cell[0]), max(b[3], cell[1])
+
+    def remove(self, key):
+        cell = self._keys.pop(key, None)
+        if cell is None:
+            return
+        del self._cells[cell][key]
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def _ring(self, center: tuple, r: int):
+        cx, cy = center
+        if r == 0:
+            yield center
+            return
+        for x in range(cx - r, cx + r + 1):
+            yield (x, cy - r)
+            yield (x, cy + r)
+        for y in range(cy - r + 1, cy + r):
+            yield (cx - r, y)
+            yield (cx + r, y)
+
+    def _max_ring(self, center: tuple):
+        b = self._bounds
+        return max(
+            abs(center[0] - b[0]), abs(center[0] - b[2]),
+            abs(center[1] - b[1]), abs(center[1] - b[3])
+        )
+
+    def iter_nearest(self, coords: tuple, max_distance=math.inf):
+        # Yield (meters, key) in increasing distance, expanding one ring of
+        # cells at a time so only the neighbourhood that is consumed is visited
+        if not self._keys:
+            return
+        center = self._cell(coords)
+        query = _prepare(coords)
+        radius = self.radius
+        # Projected distances overestimate real ones by at most this factor
+        stretch = max(1.0, self._cos_origin / min(self._cos_min, query[2]))
+        scale = self.cell_size * self._MARGIN * self.radius / EARTH_RADIUS / stretch
+        last_ring = self._max_ring(center)
+        heap = []
+        counter = 0
+        r = 0
+        while r <= last_ring or heap:
+            if r <= last_ring:
+                for cell in self._ring(center, r):
+                    for key, prepared in self._cells.get(cell, {}).items():
+                        distance = _haversine_prepared(query, prepared, radius)
+                        heapq.heappush(heap, (distance, counter, key))
+                        counter += 1
+                # Anything in cells further out is at least this far away
+                reach = r * scale
+                r += 1
+            else:
+                reach = math.inf
+            while heap and heap[0][0] <= reach:
+                distance, _, key = heapq.heappop(heap)
+                if distance > max_distance:
+                    return
+                yield distance, key
+            if reach > max_distance:
+                return
+
+    def nearest(self, coords: tuple, k=1, max_distance=math.inf):
+        result = []
+        for item in self.iter_nearest(coords, max_distance):
+            result.append(item)
+            if len(result) >= k:
+                break
+        return result
+
+    def within(self, coords: tuple, meters: float):
+        return list(self.iter_nearest(coords, meters))
@@ -16,15 +16,26 @@ _TIMERANGES = [(0, 2359), (900, 1700), (600, 2300), (300, 1200), (2000, 400)]
 _TIMERANGES_PROB = [0.4, 0.3, 0.2, 0.05, 0.05]
 
 
+def _flag(value):
+    # Booleans stored as 'true'/'false' strings in csv files and neo4j
+    if isinstance(value, str):
+        return value.strip().lower() == "true"
+    return bool(value)
+
+
 class Intersection:
+    # Hashed on every dict lookup during a search, so the hash is computed
+    # once. Intersections are not modified after they are created
+    __slots__ = ("id", "latitude", "longitude", "_hash")
     id_iter = itertools.count(1)
 
     def __init__(self, coords: tuple, id=None):
         self.id = next(self.id_iter) if id == None else id
         self.latitude, self.longitude = coords
+        self._hash = hash((self.id, self.latitude, self.longitude))
 
     def __hash__(self) -> int:
-        return hash((self.id, self.coords()))
+        return self._hash
 
     def __eq__(self, __o: object) -> bool:
         return (
@@ -60,6 +71,7 @@ class Intersection:
 
 
 class Streetsegment:
+    __slots__ = ("id", "source", "target", "length", "_geometry", "_hash")
     id_iter = itertools.count(1)
 
     def __init__(
@@ -74,10 +86,22 @@ class Streetsegment:
         self.source = source
         self.target = target
         self.length = length
-        self.geometry = geojson.loads(geometry)
+        self._geometry = geometry
+        self._hash = hash((self.id, self.source, self.target, self.length))
+
+    @property
+    def geometry(self):
+        # Kept as the GeoJSON string until needed, routing only uses length
+        if isinstance(self._geometry, str):
+            self._geometry = geojson.loads(self._geometry)
+        return self._geometry
+
+    @geometry.setter
+    def geometry(self, geometry):
+        self._geometry = geometry
 
     def __hash__(self) -> int:
-        return hash((self.id, self.source, self.target, self.length))
+        return self._hash
 
     def __eq__(self, __o: object) -> bool:
         return (
@@ -107,15 +131,16 @@ class Streetsegment:
 
 
 class AED:
+    __slots__ = ("id", "open_hour", "close_hour", "intersection_id", "in_use")
     id_iter = itertools.count(1)
 
-    def __init__(self, id=None, intersection_id=None, time_range=None, in_use='false'):
+    def __init__(self, id=None, intersection_id=None, time_range=None, in_use=False):
         self.id = next(self.id_iter) if id == None else id
         if time_range == None:
             time_range = random.choices(_TIMERANGES, _TIMERANGES_PROB)[0]
         self.open_hour, self.close_hour = time_range
         self.intersection_id = intersection_id
-        self.in_use = in_use
+        self.in_use = _flag(in_use)
 
     def __repr__(self) -> str:
         return f"A({self.id})"
@@ -151,6 +176,7 @@ class AED:
 
 
 class Runner:
+    __slots__ = ("id", "speed", "intersection_id")
     id_iter = itertools.count(1)
 
     def __init__(self, id=None, speed=None, intersection_id=None):
@@ -183,6 +209,7 @@ class Runner:
 
 
 class Patient:
+    __slots__ = ("id", "intersection_id")
     id_iter = itertools.count(1)
 
     def __init__(self, id=None, intersection_id=None):
@@ -1,126 +1,325 @@
-import math
+import os
 import csv
-import geojson
-import geojson_length
-from geopy.distance import great_circle
-from .types import Intersection, Streetsegment, AED
-from .pathfinder import Pathfinder
+import json
+import math
+import logging
+from timeit import default_timer
+from geographiclib.geodesic import Geodesic
+from .types import AED
+from .spatial import SpatialIndex, haversine
+from .network import INTERSECTIONS_CSV_PATH, STREETS_CSV_PATH, AEDS_CSV_PATH
 
 INTERSECTIONS_CSV_HEADER = ["id", "latitude", "longitude"]
-INTERSECTIONS_CSV_PATH = "data/csv/intersections.csv"
 STREETS_CSV_HEADER = ["id", "head_id", "tail_id", "length", "geometry"]
-STREETS_CSV_PATH = "data/csv/streetsegments.csv"
 AEDS_CSV_HEADER = ["id", "intersection_id",
                    "in_use", "open_hour", "close_hour"]
-AEDS_CSV_PATH = "data/csv/aeds.csv"
-
-
-def parse_geojson(streets_path, aeds_path):
-    def filter(feature):
-        properties = feature["properties"]
-        geometry = feature["geometry"]
-        if geometry["type"] not in ["LineString", "MultiLineString"]:
-            return True
-        if properties["FUNCTIONALCLASS"] in ["Interstate", "Other Freeways & Expressways"]:
-            return True
-        if properties["ROADTYPE"] in ["Ramp", "ServiceRoad", "Driveway"]:
-            return True
-        return False
 
-    with (
-        open(streets_path, "r") as streets_file,
-        open(aeds_path, "r") as aeds_file
-    ):
-        graph = Pathfinder()
-        intersections = {}
-        aed_features = geojson.load(aeds_file)["features"]
-        street_features = geojson.load(streets_file)["features"]
-
-        n = 1
-        street_count = len(street_features)
-        for feature in street_features:
-            print(f"Parsing features in {streets_path}: {n}/{street_count}")
-            n += 1
-            if filter(feature):
+# WGS-84, the ellipsoid geopy measures street lengths on
+_A = 6378137.0
+_E2 = 0.00669437999014
+# Segments spanning more than this many degrees are measured exactly
+_SHORT = 0.02
+
+
+def iter_features(path, chunk_size=1 << 20):
+    # Stream the features of a GeoJSON FeatureCollection one at a time,
+    # holding at most one chunk and one feature in memory
+    decoder = json.JSONDecoder()
+    with open(path, "r") as file:
+        buffer = file.read(chunk_size)
+        start = buffer.find('"features"')
+        while start < 0:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            buffer = buffer[-len('"features"'):] + chunk
+            start = buffer.find('"features"')
+        buffer = buffer[start + len('"features"'):]
+        pos = None
+        while True:
+            if pos is None:
+                pos = buffer.find("[")
+                if pos < 0:
+                    chunk = file.read(chunk_size)
+                    if not chunk:
+                        return
+                    buffer += chunk
+                    continue
+                pos += 1
+            # Skip separators up to the next feature or the end of the array
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                feature, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
                 continue
+            yield feature
+            pos = end
+            if pos > chunk_size:
+                buffer = buffer[pos:]
+                pos = 0
+
+
+def keep_street(feature):
+    # Streets runners can use, no highways, ramps or driveways
+    properties = feature["properties"]
+    geometry = feature["geometry"]
+    if geometry is None or geometry["type"] not in ["LineString", "MultiLineString"]:
+        return False
+    if properties.get("FUNCTIONALCLASS") in ["Interstate", "Other Freeways & Expressways"]:
+        return False
+    if properties.get("ROADTYPE") in ["Ramp", "ServiceRoad", "Driveway"]:
+        return False
+    return True
+
+
+def _segment_length(lon_a, lat_a, lon_b, lat_b):
+    # Ellipsoidal distance from the local radii of curvature at the mid
+    # latitude, which agrees with geopy's geodesic to well under a millimetre
+    # on street length segments at a fraction of the cost
+    if abs(lat_b - lat_a) > _SHORT or abs(lon_b - lon_a) > _SHORT:
+        return Geodesic.WGS84.Inverse(lat_a, lon_a, lat_b, lon_b, Geodesic.DISTANCE)["s12"]
+    phi = math.radians((lat_a + lat_b) / 2)
+    w = 1 - _E2 * math.sin(phi) ** 2
+    n = _A / math.sqrt(w)
+    m = n * (1 - _E2) / w
+    dy = m * math.radians(lat_b - lat_a)
+    dx = n * math.cos(phi) * math.radians(lon_b - lon_a)
+    return math.sqrt(dx * dx + dy * dy)
+
+
+def street_length(geometry: dict):
+    # Length in meters of a LineString or MultiLineString, as
+    # geojson_length.calculate_distance
+    lines = geometry["coordinates"]
+    if geometry["type"] == "LineString":
+        lines = [lines]
+    length = 0.0
+    for line in lines:
+        for a, b in zip(line, line[1:]):
+            length += _segment_length(a[0], a[1], b[0], b[1])
+    return length
+
+
+def coordinate_key(latitude: float, longitude: float):
+    # One int per intersection, street ends closer than 1e-7 degrees
+    # (about a centimetre) are the same intersection
+    return round(latitude * 1e7) * 4_000_000_000 + round(longitude * 1e7)
+
+
+def _ends(geometry: dict):
+    lines = geometry["coordinates"]
+    if geometry["type"] == "MultiLineString":
+        return lines[0][0], lines[-1][-1]
+    return lines[0], lines[-1]
+
+
+class _Progress:
+    # Log throughput every so many features instead of a line per feature
 
-            length = geojson_length.calculate_distance(feature)
-            coords = list(geojson.coords(feature))
-            head_coords = tuple(reversed(coords[0]))
-            tail_coords = tuple(reversed(coords[-1]))
-
-            if head_coords not in intersections:
-                intersections[head_coords] = Intersection(coords=head_coords)
-            if tail_coords not in intersections:
-                intersections[tail_coords] = Intersection(coords=tail_coords)
-
-            head = intersections[head_coords]
-            tail = intersections[tail_coords]
-            street = Streetsegment(
-                source=head,
-                target=tail,
-                length=length,
-                geometry=feature["geometry"]
-            )
-            graph.add_edge(edge=street)
-
-        n = 1
-        aed_count = len(aed_features)
-        for feature in aed_features:
-            print(f"Parsing features in {aeds_path}: {n}/{aed_count}")
-            n += 1
-
-            aed_coords = tuple(reversed(feature["geometry"]["coordinates"]))
-            if aed_coords not in intersections:
-                shortest = math.inf
-                for inter_coords in intersections:
-                    distance = great_circle(aed_coords, inter_coords)
-                    if distance < shortest:
-                        closest_inter = intersections[inter_coords]
-                        shortest = distance
-            else:
-                closest_inter = intersections[aed_coords]
-
-            aed = AED(
-                intersection_id=closest_inter.id
-            )
-            graph.add_aed(closest_inter, aed)
+    def __init__(self, name, every=100_000):
+        self.name = name
+        self.every = every
+        self.count = 0
+        self.start = default_timer()
 
+    def tick(self):
+        self.count += 1
+        if self.count % self.every == 0:
+            self.log()
+
+    def log(self):
+        elapsed = default_timer() - self.start
+        logging.info(
+            f" {self.name}: {self.count} features in {elapsed:.1f}s "
+            f"({self.count / max(elapsed, 1e-9):.0f}/s)"
+        )
+
+
+def parse_geojson(
+    streets_path,
+    aeds_path,
+    intersections_csv=INTERSECTIONS_CSV_PATH,
+    streets_csv=STREETS_CSV_PATH,
+    aeds_csv=AEDS_CSV_PATH,
+    snap_distance=100,
+    batch_size=10_000,
+    keep=keep_street
+):
+    # Stream street and AED features into the CSV files RoadNetwork.from_csv
+    # and HeartrunnerDB.import_csv read. Streets are written as they are
+    # parsed, so memory holds the intersection keys and the AEDs, never the
+    # features. Each new intersection is offered to the AEDs within
+    # snap_distance of it, AEDs further than that from every intersection are
+    # snapped in a second pass over the written intersections
+    aeds = []
+    for feature in iter_features(aeds_path):
+        if feature.get("geometry") is None:
+            continue
+        longitude, latitude = feature["geometry"]["coordinates"][:2]
+        aeds.append([(latitude, longitude), math.inf, None])
+    # Projected around the middle of the AEDs, so a state wide file keeps the
+    # grid's stretch small, see SpatialIndex
+    latitudes = [coords[0] for coords, _, _ in aeds]
+    aed_index = SpatialIndex(
+        cell_size=snap_distance,
+        origin_latitude=(min(latitudes) + max(latitudes)) / 2 if aeds else None
+    )
+    for i, (coords, _, _) in enumerate(aeds):
+        aed_index.insert(i, coords)
+
+    intersections: dict[int, int] = {}
+    counts = {"features": 0, "intersections": 0, "streets": 0, "aeds": 0}
+    progress = _Progress(streets_path)
     with (
-        open(INTERSECTIONS_CSV_PATH, "w+") as intersections_file,
-        open(STREETS_CSV_PATH, "w+") as streets_file,
-        open(AEDS_CSV_PATH, "w+") as aeds_file
+        open(intersections_csv, "w", newline="") as intersections_file,
+        open(streets_csv, "w", newline="") as streets_file
     ):
         intersections_writer = csv.writer(intersections_file)
         streets_writer = csv.writer(streets_file)
-        aeds_writer = csv.writer(aeds_file)
-
         intersections_writer.writerow(INTERSECTIONS_CSV_HEADER)
-        for intersection in graph.get_nodes():
-            intersections_writer.writerow([
-                intersection.id,
-                intersection.latitude,
-                intersection.longitude
-            ])
-
         streets_writer.writerow(STREETS_CSV_HEADER)
-        for street in graph.get_edges():
-            streets_writer.writerow([
-                street.id,
-                street.source.id,
-                street.target.id,
-                street.length,
-                street.geometry
-            ])
+        intersection_rows = []
+        street_rows = []
+
+        def intersection(coords):
+            longitude, latitude = coords[0], coords[1]
+            key = coordinate_key(latitude, longitude)
+            id = intersections.get(key)
+            if id is None:
+                id = intersections[key] = len(intersections) + 1
+                intersection_rows.append((id, latitude, longitude))
+                for distance, i in aed_index.within((latitude, longitude), snap_distance):
+                    if distance < aeds[i][1]:
+                        aeds[i][1], aeds[i][2] = distance, id
+            return id
+
+        for feature in iter_features(streets_path):
+            progress.tick()
+            if not keep(feature):
+                continue
+            geometry = feature["geometry"]
+            head, tail = _ends(geometry)
+            street_rows.append((
+                len(street_rows) + counts["streets"] + 1,
+                intersection(head),
+                intersection(tail),
+                street_length(geometry),
+                json.dumps(geometry, separators=(",", ":"))
+            ))
+            if len(street_rows) >= batch_size:
+                counts["streets"] += len(street_rows)
+                streets_writer.writerows(street_rows)
+                intersections_writer.writerows(intersection_rows)
+                street_rows.clear()
+                intersection_rows.clear()
+        counts["streets"] += len(street_rows)
+        streets_writer.writerows(street_rows)
+        intersections_writer.writerows(intersection_rows)
+    progress.log()
+    counts["features"] = progress.count
+    counts["intersections"] = len(intersections)
+    intersections.clear()
+
+    unsnapped = [aed for aed in aeds if aed[2] is None]
+    if unsnapped:
+        for row in iter_csv(intersections_csv):
+            latitude = float(row["latitude"])
+            longitude = float(row["longitude"])
+            for aed in unsnapped:
+                # A degree of latitude is never shorter than 110 km
+                if abs(aed[0][0] - latitude) * 110_000 > aed[1]:
+                    continue
+                distance = haversine(aed[0], (latitude, longitude))
+                if distance < aed[1]:
+                    aed[1], aed[2] = distance, int(row["id"])
 
+    with open(aeds_csv, "w", newline="") as aeds_file:
+        aeds_writer = csv.writer(aeds_file)
         aeds_writer.writerow(AEDS_CSV_HEADER)
-        for aed in graph.get_aeds():
+        for n, (_, _, intersection_id) in enumerate(aeds, 1):
+            if intersection_id is None:
+                continue
+            aed = AED(id=n, intersection_id=intersection_id)
             aeds_writer.writerow([
                 aed.id,
                 aed.intersection_id,
-                aed.in_use,
+                str(aed.in_use).lower(),
                 aed.open_hour,
                 aed.close_hour
             ])
+            counts["aeds"] += 1
+    return counts
+
+
+def iter_csv(path):
+    with open(path, "r", newline="") as file:
+        yield from csv.DictReader(file)
+
+
+def iter_batches(rows, batch_size=10_000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_admin_import(
+    directory,
+    intersections_csv=INTERSECTIONS_CSV_PATH,
+    streets_csv=STREETS_CSV_PATH,
+    aeds_csv=AEDS_CSV_PATH
+):
+    # Copies of the CSVs written by parse_geojson with the typed headers of
+    # an offline `neo4j-admin database import`, the fastest way to load a
+    # large network into an empty database. Returns the import arguments
+    os.makedirs(directory, exist_ok=True)
+
+    def copy(name, header, source, columns):
+        path = os.path.join(directory, name)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            for batch in iter_batches(iter_csv(source)):
+                writer.writerows([[row[c] for c in columns] for row in batch])
+        return path
 
-    return graph
+    intersections = copy(
+        "intersections.csv",
+        ["id:ID(Intersection)", "latitude:double", "longitude:double"],
+        intersections_csv, INTERSECTIONS_CSV_HEADER
+    )
+    streets = copy(
+        "streetsegments.csv",
+        ["id:long", ":START_ID(Intersection)", ":END_ID(Intersection)", "length:double", "geometry"],
+        streets_csv, STREETS_CSV_HEADER
+    )
+    # AEDs are both nodes and LocatedAt relationships
+    aeds = copy(
+        "aeds.csv",
+        ["id:ID(AED)", "in_use:boolean", "open_hour:int", "close_hour:int"],
+        aeds_csv, ["id", "in_use", "open_hour", "close_hour"]
+    )
+    locations = copy(
+        "aed_locations.csv",
+        [":START_ID(AED)", ":END_ID(Intersection)"],
+        aeds_csv, ["id", "intersection_id"]
+    )
+    return [
+        "--id-type=integer",
+        f"--nodes=Intersection={intersections}",
+        f"--relationships=Streetsegment={streets}",
+        f"--nodes=AED={aeds}",
+        f"--relationships=LocatedAt={locations}"
+    ]
@@ -1,26 +1,30 @@
 import os
+import sys
 from dotenv import load_dotenv
-from timeit import default_timer
-from heartrunner.types import NodeType
 from heartrunner.database import HeartrunnerDB
+from heartrunner.simulation import Simulation, poisson_incidents
+
+# Load test against the neo4j database in .env: seeded Poisson incidents at
+# each rate given on the command line (incidents per second), dispatched by
+# 4 concurrent dispatchers while runners move around, see simulation.py.
+#   pipenv run python pathfinder_test.py 0.5 1 2 4
 
 if __name__ == "__main__":
     load_dotenv('.env')
     uri = os.getenv("NEO4J_URI")
     user = os.getenv("NEO4J_USERNAME")
     password = os.getenv("NEO4J_PASSWORD")
+    rates = [float(rate) for rate in sys.argv[1:]] or [1.0]
     with HeartrunnerDB(uri, user, password) as db:
-        acc = 0
-        for i in range(10):
-            # db.delete_nodes(NodeType.Runner)
-            # db.generate_runners(1000)
-            time1 = default_timer()
-            db.delete_nodes(NodeType.Patient)
-            patients = db.generate_patients(10)
-            for patient in patients:
-                tasks = db.get_pathfinder(patient).calculate_tasks(n_runners=20, n_aeds=3)
-                
-            time2 = default_timer()
-            elapsed = time2-time1
-            acc += elapsed
-            print(f"{i+1:4} Elapsed: {elapsed:.6f} - Average: {acc/(i+1):.6f}")
+        db.load_network()
+        intersection_ids = db.get_intersection_ids()
+        for rate in rates:
+            incidents = poisson_incidents(rate, 60, intersection_ids, seed=0)
+            report = Simulation(db, incidents, concurrency=4, move_rate=5, seed=1).run()
+            summary = report.summary()
+            print(
+                f"{rate:6.2f}/s offered, {summary['throughput_per_s']:6.2f}/s done, "
+                f"{summary['failed']} failed, queueing p95 {summary['queueing_s']['p95']:.3f}s, "
+                f"latency p50 {summary['latency_s']['p50']:.3f}s "
+                f"p95 {summary['latency_s']['p95']:.3f}s p99 {summary['latency_s']['p99']:.3f}s"
+            )
@@ -0,0 +1,103 @@
+import asyncio
+from heartrunner.types import *
+from heartrunner.cache import RouteCache
+from heartrunner.memory import MemoryHeartrunnerDB, MemoryDriver
+from heartrunner.database import (
+    HeartrunnerDB, _box_params, _projected_pathfinder_from_records, _read,
+    _PROJECTED_STREETS_QUERY, _PROJECTED_AEDS_QUERY, _PROJECTED_RUNNERS_QUERY,
+    _RING_STREETS_QUERY, _RING_AEDS_QUERY, _RING_RUNNERS_QUERY
+)
+from heartrunner.async_database import AsyncHeartrunnerDB
+from heartrunner.network import bounding_box
+from benchmarks.synthetic import grid_network
+
+
+def fake():
+    store = MemoryHeartrunnerDB(grid_network(40, seed=0))
+    store.generate_runners(len(store.store) // 8, seed=1)
+    return store, MemoryDriver(store)
+
+
+def box_pathfinder(driver, limits, patient):
+    # Everything in limits fetched at once
+    session = driver.session()
+    params = _box_params(limits)
+    return _projected_pathfinder_from_records(
+        _read(session, _PROJECTED_STREETS_QUERY, params),
+        _read(session, _PROJECTED_AEDS_QUERY, params)[0]["aeds"],
+        _read(session, _PROJECTED_RUNNERS_QUERY, params)[0]["runners"],
+        limits, patient)
+
+
+def runners(tasks):
+    return [(task.runner.id, round(task.patient_path.length, 6)) for task in tasks]
+
+
+def test_rings_add_up_to_the_box():
+    store, driver = fake()
+    db = HeartrunnerDB(driver=driver)
+    for patient in store.generate_patients(5, seed=2):
+        pf = db.get_adaptive_pathfinder(patient, n_runners=10, n_aeds=3)
+        full = box_pathfinder(driver, pf.limits, patient)
+        assert sorted(e.id for e in pf.get_edges()) == sorted(e.id for e in full.get_edges())
+        assert sorted(a.id for a in pf.get_aeds()) == sorted(a.id for a in full.get_aeds())
+        assert sorted(r.id for r in pf.get_runners()) == sorted(r.id for r in full.get_runners())
+
+        # Covered within the box's radius, so a bigger box finds the same runners
+        location = store.store.location(patient.intersection_id)
+        big = box_pathfinder(driver, bounding_box(location, 4), patient)
+        assert runners(pf.calculate_tasks(10, 3, multi_target=True)) == \
+            runners(big.calculate_tasks(10, 3, multi_target=True))
+
+
+def test_one_session_for_the_rings():
+    store, driver = fake()
+    db = HeartrunnerDB(driver=driver)
+    patient = store.generate_patients(1, seed=2)[0]
+    db.get_adaptive_pathfinder(patient, n_runners=10, n_aeds=3)
+    # The location lookup, then every ring on the outer session
+    lookup, rings = driver.sessions[1], driver.sessions[0]
+    assert lookup.queries[0].startswith("MATCH (n:Intersection)")
+    assert len(rings.queries) >= 3
+    assert rings.queries == [_RING_STREETS_QUERY, _RING_AEDS_QUERY, _RING_RUNNERS_QUERY] * (len(rings.queries) // 3)
+
+
+def test_async_matches_sync():
+    store, driver = fake()
+    patients = store.generate_patients(5, seed=2)
+    sync = [HeartrunnerDB(driver=driver).get_adaptive_pathfinder(patient, n_runners=10, n_aeds=3)
+            for patient in patients]
+
+    async def run():
+        db = AsyncHeartrunnerDB(driver=driver.asynchronous())
+        return await asyncio.gather(*[
+            db.get_adaptive_pathfinder(patient, n_runners=10, n_aeds=3) for patient in patients])
+
+    for a, b in zip(sync, asyncio.run(run())):
+        assert a.limits == b.limits
+        assert sorted(e.id for e in a.get_edges()) == sorted(e.id for e in b.get_edges())
+        assert runners(a.calculate_tasks(10, 3, multi_target=True)) == \
+            runners(b.calculate_tasks(10, 3, multi_target=True))
+
+
+def test_network_mode_shares_cached_routes():
+    store, driver = fake()
+    cache = RouteCache()
+    db = HeartrunnerDB(driver=driver, cache=cache)
+    db.load_network(store.store)
+    net = store.store
+    # Two patients a block apart, in the same district
+    i = net.index[net.ids[len(net) // 2 + 20]]
+    j = net.targets[net.offsets[i]]
+    a = db.get_adaptive_pathfinder(Patient(id=1, intersection_id=net.ids[i]), n_runners=10, n_aeds=3)
+    b = db.get_adaptive_pathfinder(Patient(id=2, intersection_id=net.ids[j]), n_runners=10, n_aeds=3)
+    assert a.limits == b.limits
+    a.calculate_tasks(10, 3, multi_target=True)
+    hits = cache.hits
+    b.calculate_tasks(10, 3, multi_target=True)
+    assert cache.hits > hits
+
+    # The same runners as routing over the whole box at once
+    full = box_pathfinder(driver, b.limits, b._patient)
+    assert runners(b.calculate_tasks(10, 3, multi_target=True)) == \
+        runners(full.calculate_tasks(10, 3, multi_target=True))
@@ -0,0 +1,137 @@
+import random
+from heartrunner.types import AED
+from heartrunner.network import RoadNetwork
+from heartrunner.aedfield import AEDField
+from benchmarks.synthetic import grid_network, random_runners, random_patients
+
+
+def detours(tasks):
+    return [
+        (task.runner.id, [(aed_path.aed.id, round(aed_path.length, 6)) for aed_path in task.aed_paths])
+        for task in tasks
+    ]
+
+
+def compare(network, patients, runners, **kwargs):
+    results = {}
+    for mode in ("search", "field"):
+        network.aed_field = AEDField(network, k=3) if mode == "field" else None
+        results[mode] = []
+        for patient in patients:
+            pf = network.pathfinder(patient, **kwargs)
+            for runner in runners:
+                pf.add_runner(runner)
+            results[mode].append(detours(pf.calculate_tasks(n_runners=10, n_aeds=3, multi_target=True)))
+    network.aed_field = None
+    return results["search"], results["field"]
+
+
+def test_field_matches_search():
+    network = grid_network(30, seed=0)
+    runners = random_runners(network, len(network) // 5, seed=1)
+    patients = random_patients(network, 8, seed=2)
+    # A box covering the whole city, field paths cannot leave it
+    search, field = compare(network, patients, runners, kilometers=10)
+    assert field == search
+
+
+def test_field_with_aeds_in_use():
+    network = grid_network(30, seed=3)
+    rng = random.Random(4)
+    for aed in network.aeds.values():
+        aed.in_use = rng.random() < 0.3
+    runners = random_runners(network, len(network) // 5, seed=5)
+    patients = random_patients(network, 8, seed=6)
+    search, field = compare(network, patients, runners, kilometers=10)
+    assert field == search
+
+
+def test_field_in_small_box():
+    # Field paths may leave the box and be shorter than the searched ones,
+    # never longer, and every runner gets as many aeds
+    network = grid_network(40, seed=7)
+    runners = random_runners(network, len(network) // 5, seed=8)
+    patients = random_patients(network, 8, seed=9)
+    search, field = compare(network, patients, runners, kilometers=0.5)
+    for s_tasks, f_tasks in zip(search, field):
+        for (s_runner, s_aeds), (f_runner, f_aeds) in zip(s_tasks, f_tasks):
+            assert s_runner == f_runner
+            assert len(f_aeds) == len(s_aeds)
+            for (_, s_length), (_, f_length) in zip(s_aeds, f_aeds):
+                assert f_length <= s_length + 1e-6
+
+
+def uniform_grid(side: int, locations: list[int], per_location: int):
+    # Every block 100 m long, so distances tie everywhere, and several AEDs
+    # at each AED location
+    intersections = [
+        (row * side + col + 1, 38.85 + row * 0.0009, -77.10 + col * 0.0012)
+        for row in range(side) for col in range(side)
+    ]
+    streets = []
+    for row in range(side):
+        for col in range(side):
+            u = row * side + col + 1
+            if col + 1 < side:
+                streets.append((len(streets) + 1, u, u + 1, 100.0, None))
+            if row + 1 < side:
+                streets.append((len(streets) + 1, u, u + side, 100.0, None))
+    aeds = [
+        AED(id=len(locations) * n + k + 1, intersection_id=location, time_range=(0, 2359))
+        for k, location in enumerate(locations) for n in range(per_location)
+    ]
+    return RoadNetwork(intersections, streets, aeds)
+
+
+def check_against_build(field: AEDField):
+    fresh = AEDField(field.network, k=field.k)
+    assert field._labels == fresh._labels
+    for node_id in field.network.ids:
+        for _, location in field.nearest(node_id):
+            path = field.path(node_id, location)
+            assert path is not None and path[0] == node_id and path[-1] == location
+
+
+def test_update_matches_build_on_ties():
+    for seed in range(20):
+        rng = random.Random(seed)
+        side = 12
+        locations = rng.sample(range(1, side * side + 1), 8)
+        network = uniform_grid(side, locations, per_location=rng.choice((1, 3)))
+        field = AEDField(network, k=3)
+        check_against_build(field)
+        aeds = list(network.aeds.values())
+        for _ in range(15):
+            aed = rng.choice(aeds)
+            aed.in_use = not aed.in_use
+            field.update(aed)
+            check_against_build(field)
+
+
+def test_co_located_aeds_share_a_label():
+    network = uniform_grid(8, [1, 64], per_location=4)
+    field = AEDField(network, k=3)
+    assert [location for _, location in field.nearest(1)] == [1, 64]
+    assert len(field.aeds(1)) == 4
+    for aed in field.aeds(1)[:3]:
+        aed.in_use = True
+        field.update(aed)
+    # One AED left keeps the location
+    assert [location for _, location in field.nearest(1)] == [1, 64]
+    aed = field.aeds(1)[0]
+    aed.in_use = True
+    field.update(aed)
+    assert [location for _, location in field.nearest(1)] == [64]
+    check_against_build(field)
+
+
+def test_field_matches_search_on_ties():
+    for seed in range(5):
+        rng = random.Random(seed)
+        network = uniform_grid(15, rng.sample(range(1, 226), 10), per_location=3)
+        runners = random_runners(network, 40, seed=seed + 1)
+        patients = random_patients(network, 4, seed=seed + 2)
+        search, field = compare(network, patients, runners, kilometers=10)
+        # Equally long detours may go to other AEDs
+        assert [[[length for _, length in aeds] for _, aeds in tasks] for tasks in field] == \
+            [[[length for _, length in aeds] for _, aeds in tasks] for tasks in search]
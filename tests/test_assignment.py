@@ -0,0 +1,80 @@
+import random
+import itertools
+import pytest
+from heartrunner.types import Patient
+from heartrunner.assignment import hungarian, _assign, solve, greedy, UNASSIGNED
+from benchmarks.synthetic import grid_network, random_runners
+
+
+def brute_force(cost):
+    # Cheapest assignment of rows to distinct columns, or columns to rows
+    n, m = len(cost), len(cost[0])
+    if n <= m:
+        return min(sum(cost[i][j] for i, j in enumerate(p)) for p in itertools.permutations(range(m), n))
+    return min(sum(cost[i][j] for j, i in enumerate(p)) for p in itertools.permutations(range(n), m))
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5)])
+def test_hungarian_matches_brute_force(shape):
+    rng = random.Random(sum(shape))
+    for _ in range(20):
+        cost = [[rng.choice([rng.uniform(0, 100), float(rng.randrange(5))]) for _ in range(shape[1])]
+                for _ in range(shape[0])]
+        pairs, exact = _assign(cost)
+        assert exact
+        assert len({i for i, _ in pairs}) == len({j for _, j in pairs}) == len(pairs) == min(shape)
+        assert sum(cost[i][j] for i, j in pairs) == pytest.approx(brute_force(cost))
+    columns, exact = hungarian([[1.0, 2.0], [1.0, 5.0]])
+    assert columns == [1, 0] and exact
+
+
+def incidents(seed):
+    network = grid_network(12, seed=seed)
+    rng = random.Random(seed)
+    patients = [Patient(id=k + 1, intersection_id=rng.choice(network.ids)) for k in range(2)]
+    pf = network.pathfinders(patients, kilometers=2)[0]
+    for runner in random_runners(network, 6, seed=seed + 1):
+        pf.add_runner(runner)
+    return patients, pf.calculate_tasks_batch(patients, n_runners=4, n_aeds=2)
+
+
+def best_objective(patients, tasks):
+    # Every way to fill each patient's direct and AED role with distinct
+    # runners and AEDs, or leave it empty
+    best = UNASSIGNED * 2 * len(patients)
+
+    def search(k, runners, aeds, total):
+        nonlocal best
+        if k == len(patients):
+            best = min(best, total)
+            return
+        direct = [(task.patient_latency, task.runner.id) for task in tasks[k] if task.runner.id not in runners]
+        via = [
+            (latency, task.runner.id, path.aed.id)
+            for task in tasks[k] if task.runner.id not in runners
+            for path, latency in zip(task.aed_paths, task.aed_latencies) if path.aed.id not in aeds
+        ]
+        for d_latency, d_runner in direct + [(UNASSIGNED, None)]:
+            for v_latency, v_runner, aed in via + [(UNASSIGNED, None, None)]:
+                if d_runner is not None and d_runner == v_runner:
+                    continue
+                search(
+                    k + 1, runners | {d_runner, v_runner} - {None}, aeds | {aed} - {None},
+                    total + d_latency + v_latency)
+
+    search(0, set(), set(), 0.0)
+    return best
+
+
+def test_solve_is_optimal_on_small_instances():
+    for seed in range(10):
+        patients, tasks = incidents(seed)
+        plan = solve(patients, tasks, budget=None)
+        runners = [d.runner.id for d in plan.dispatches]
+        aeds = [d.aed.id for d in plan.dispatches if d.aed is not None]
+        assert len(runners) == len(set(runners)) and len(aeds) == len(set(aeds))
+        assert plan.exact
+        assert plan.objective == pytest.approx(best_objective(patients, tasks))
+        assert plan.objective <= greedy(patients, tasks).objective + 1e-9
+        # Out of time the plan is never worse than greedy
+        assert solve(patients, tasks, budget=0.0).objective <= greedy(patients, tasks).objective + 1e-9
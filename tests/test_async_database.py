@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from heartrunner.types import *
+from heartrunner.memory import MemoryHeartrunnerDB, MemoryDriver
+from heartrunner.async_database import AsyncHeartrunnerDB
+from heartrunner import database
+from benchmarks.synthetic import grid_network
+
+
+def fake(latency=0.0):
+    store = MemoryHeartrunnerDB(grid_network(30, seed=0))
+    store.generate_runners(len(store.store) // 5, seed=1)
+    return store, MemoryDriver(store, latency=latency)
+
+
+def signature(tasks):
+    return [
+        (task.runner.id, round(task.patient_path.length, 6),
+         [(aed_path.aed.id, round(aed_path.length, 6)) for aed_path in task.aed_paths])
+        for task in tasks
+    ]
+
+
+def expected(store, patients):
+    return [
+        signature(store.get_pathfinder(patient).calculate_tasks(n_runners=5, n_aeds=2, multi_target=True))
+        for patient in patients
+    ]
+
+
+def test_concurrent_batch():
+    store, driver = fake(latency=0.01)
+    patients = store.generate_patients(8, seed=2)
+
+    async def run():
+        async with AsyncHeartrunnerDB(driver=driver.asynchronous()) as db:
+            return await db.calculate_tasks(patients, n_runners=5, n_aeds=2)
+
+    results = asyncio.run(run())
+    assert [signature(tasks) for tasks in results] == expected(store, patients)
+    # Every patient's fetch was in flight at once
+    assert driver.max_in_flight == len(patients)
+    assert driver.closed
+
+
+def test_batch_within_pool_size():
+    store, driver = fake(latency=0.01)
+    patients = store.generate_patients(8, seed=2)
+
+    async def run():
+        db = AsyncHeartrunnerDB(driver=driver.asynchronous(), max_connection_pool_size=3)
+        return await db.get_pathfinders(patients, projected=True)
+
+    pfs = asyncio.run(run())
+    assert all(pf is not None for pf in pfs)
+    assert driver.max_in_flight == 3
+
+
+def test_session_reuse():
+    store, driver = fake()
+    patient = store.generate_patients(1, seed=2)[0]
+
+    async def run():
+        db = AsyncHeartrunnerDB(driver=driver.asynchronous())
+        pf = await db.get_pathfinder(patient, projected=True)
+        adaptive = await db.get_adaptive_pathfinder(patient, n_runners=5, n_aeds=2)
+        return pf, adaptive
+
+    pf, adaptive = asyncio.run(run())
+    assert pf is not None and adaptive is not None
+    # Location lookup and subgraph on one session, every ring on another
+    first, second = driver.sessions
+    assert first.queries[1:] == [
+        database._PROJECTED_STREETS_QUERY, database._PROJECTED_AEDS_QUERY, database._PROJECTED_RUNNERS_QUERY]
+    assert first.queries[0].startswith("MATCH (n:Intersection)")
+    assert second.queries[0].startswith("MATCH (n:Intersection)")
+    assert len(second.queries) > 1 and (len(second.queries) - 1) % 3 == 0
+
+
+def test_network_mode():
+    store, driver = fake()
+    patients = store.generate_patients(4, seed=2)
+
+    async def run():
+        db = AsyncHeartrunnerDB(driver=driver.asynchronous())
+        await db.load_network()
+        return await db.calculate_tasks(patients, n_runners=5, n_aeds=2)
+
+    results = asyncio.run(run())
+    assert [signature(tasks) for tasks in results] == expected(store, patients)
+    # The network in one session, then only the runners of each patient
+    assert [len(session.queries) for session in driver.sessions] == [3] + [1] * len(patients)
+
+
+def test_unknown_intersection(caplog):
+    store, driver = fake()
+    patients = store.generate_patients(2, seed=2)
+    lost = Patient(id=999, intersection_id=-1)
+
+    async def run():
+        db = AsyncHeartrunnerDB(driver=driver.asynchronous())
+        node = await db.get_node(NodeType.Intersection, -1)
+        pf = await db.get_pathfinder(lost)
+        results = await db.calculate_tasks([patients[0], lost, patients[1]], n_runners=5, n_aeds=2)
+        return node, pf, results
+
+    with caplog.at_level(logging.ERROR):
+        node, pf, results = asyncio.run(run())
+    assert node is None and pf is None
+    assert results[1] is None
+    assert [signature(results[0]), signature(results[2])] == expected(store, patients)
+    assert "Error while executing get_subgraph" in caplog.text
+
+
+def test_driver_serves_the_records_of_fetch_subgraph():
+    store, driver = fake()
+    for patient in store.generate_patients(4, seed=2):
+        limits = store.limits(patient)
+        streets, aeds, runners = store.fetch_subgraph(limits)
+        params = database._box_params(limits)
+        key = lambda record: (record["id"], record["i1_id"])
+        assert sorted(driver.records(database._PROJECTED_STREETS_QUERY, params), key=key) == \
+            sorted(streets, key=key)
+        assert sorted(driver.records(database._PROJECTED_AEDS_QUERY, params)[0]["aeds"]) == sorted(aeds)
+        assert sorted(driver.records(database._PROJECTED_RUNNERS_QUERY, params)[0]["runners"]) == sorted(runners)
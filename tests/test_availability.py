@@ -0,0 +1,61 @@
+import random
+from datetime import datetime
+from heartrunner.types import AED
+from heartrunner.availability import AvailabilityIndex, is_open
+
+
+def minutes():
+    return [hour * 100 + minute for hour in range(24) for minute in range(60)]
+
+
+def test_hours_past_midnight():
+    aed = AED(id=1, intersection_id=1, time_range=(2030, 415))
+    index = AvailabilityIndex([aed])
+    assert index.available(2030) == index.available(2359) == index.available(0) == {1}
+    assert index.available(415) == {1}
+    assert index.available(416) == index.available(2029) == index.available(1200) == set()
+    assert index.available(datetime(2024, 1, 1, 23, 0)) == {1}
+
+
+def test_index_matches_every_minute():
+    rng = random.Random(0)
+    hours = [(0, 2359), (800, 1700), (2000, 400), (1730, 1730), (2345, 15), (0, 0)]
+    aeds = []
+    for id in range(1, 200):
+        time_range = rng.choice(hours) if id < 20 else (
+            rng.randrange(24) * 100 + rng.randrange(60), rng.randrange(24) * 100 + rng.randrange(60))
+        aeds.append(AED(id=id, intersection_id=1, time_range=time_range, in_use=rng.random() < 0.1))
+    index = AvailabilityIndex(aeds)
+    for hhmm in minutes():
+        assert index.available(hhmm) == {
+            aed.id for aed in aeds if not aed.in_use and is_open(aed.open_hour, aed.close_hour, hhmm)}
+
+
+def test_update_moves_an_aed():
+    aed = AED(id=1, intersection_id=1, time_range=(800, 1700))
+    index = AvailabilityIndex([aed])
+    assert index.available(900) == {1}
+    aed.open_hour, aed.close_hour = 2200, 600
+    index.update(aed)
+    assert index.available(900) == set() and index.available(2300) == {1}
+    aed.in_use = True
+    index.update(aed)
+    assert index.available(2300) == set()
+    assert len(index) == 1
+
+
+def test_tasks_only_use_open_aeds():
+    from benchmarks.synthetic import grid_network, random_runners, random_patients
+    network = grid_network(20, seed=0)
+    rng = random.Random(1)
+    for aed in network.aeds.values():
+        aed.open_hour, aed.close_hour = rng.choice([(800, 1700), (2000, 400), (0, 2359)])
+    patient = random_patients(network, 1, seed=2)[0]
+    pf = network.pathfinder(patient)
+    for runner in random_runners(network, 40, seed=3):
+        pf.add_runner(runner)
+    for at in (300, 1200, 2100):
+        for multi_target in (False, True):
+            tasks = pf.calculate_tasks(n_runners=5, n_aeds=3, multi_target=multi_target, at=at)
+            used = [aed_path.aed for task in tasks for aed_path in task.aed_paths]
+            assert used and all(is_open(aed.open_hour, aed.close_hour, at) for aed in used)
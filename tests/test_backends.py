@@ -0,0 +1,97 @@
+import random
+import pytest
+import networkx as nx
+from heartrunner.pathfinder import Pathfinder, GraphBackend, NetworkxBackend, ArrayBackend
+from heartrunner.memory import MemoryHeartrunnerDB
+from heartrunner.database import _projected_pathfinder_from_records
+from benchmarks.synthetic import grid_network, planar_network
+
+
+def close(a: float, b: float):
+    # The same length summed over streets in another order
+    return abs(a - b) <= 1e-9 * max(1.0, a)
+
+
+def latencies(tasks):
+    return sorted(
+        (task.runner.id, round(task.patient_latency, 6), tuple(round(l, 6) for l in task.aed_latencies))
+        for task in tasks
+    )
+
+
+def pathfinders(network, n_patients, seed):
+    db = MemoryHeartrunnerDB(network)
+    db.generate_runners(len(db.store) // 10, seed=seed)
+    for patient in db.generate_patients(n_patients, seed=seed + 1):
+        limits = db.limits(patient)
+        records = db.fetch_subgraph(limits)
+        yield {
+            backend: _projected_pathfinder_from_records(
+                *records, limits, patient, pf=Pathfinder(patient, graph=backend()))
+            for backend in (NetworkxBackend, ArrayBackend)
+        }
+
+
+@pytest.mark.parametrize("network", [grid_network(40, seed=0), planar_network(40, seed=0)])
+def test_array_backend_matches_networkx(network):
+    rng = random.Random(0)
+    for pfs in pathfinders(network, 4, seed=1):
+        reference, array = pfs[NetworkxBackend], pfs[ArrayBackend]
+        nodes = reference.get_nodes()
+        for _ in range(30):
+            source, target = rng.choice(nodes), rng.choice(nodes)
+            try:
+                expected = reference._to_path(reference._astar(source, target)).length
+            except nx.NetworkXNoPath:
+                with pytest.raises(nx.NetworkXNoPath):
+                    array._astar(source, target)
+                continue
+            assert close(array._to_path(array._astar(source, target)).length, expected)
+
+        source = reference.get_node(reference._patient.intersection_id)
+        expected, _ = reference._dijkstra(source)
+        found, _ = array._dijkstra(source)
+        assert set(found) == set(expected)
+        assert all(close(found[node], d) for node, d in expected.items())
+
+        for multi_target in (False, True):
+            assert latencies(array.calculate_tasks(10, 3, multi_target)) == \
+                latencies(reference.calculate_tasks(10, 3, multi_target))
+
+
+@pytest.mark.parametrize("backend", [NetworkxBackend, ArrayBackend])
+def test_backend_contract(backend):
+    graph = backend()
+    for id, coords in ((1, (38.90, -77.03)), (2, (38.90, -77.02)), (3, (38.91, -77.02)), (4, (38.95, -77.0))):
+        graph.add_node(id, coords)
+    graph.add_edge(1, 2, 10, 900.0)
+    graph.add_edge(2, 3, 11, 1200.0)
+    graph.add_edge(1, 3, 12, 1500.0)
+    # Replaces the street in both directions
+    graph.add_edge(3, 1, 13, 2500.0)
+    assert len(graph) == 4 and 3 in graph and 5 not in graph
+    assert sorted(graph.neighbors(1)) == [(2, 900.0), (3, 2500.0)]
+    assert graph.edge_id(1, 3) == graph.edge_id(3, 1) == 13
+    assert graph.length(2, 3) == 1200.0
+    assert graph.astar(1, 3) == [1, 2, 3]
+    dist, pred = graph.dijkstra(1)
+    assert dist == {1: 0, 2: 900.0, 3: 2100.0} and pred[2] == 1
+    # Stops once the n_targets cheapest targets are known
+    assert graph.dijkstra(1, targets={2, 3}, n_targets=1)[0] == {1: 0, 2: 900.0}
+    assert graph.dijkstra(1, targets={2, 3}, n_targets=0)[0] == {}
+    with pytest.raises(nx.NetworkXNoPath):
+        graph.astar(1, 4)
+    with pytest.raises(nx.NodeNotFound):
+        graph.dijkstra(5)
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        GraphBackend()
+
+    class Partial(GraphBackend):
+        def __len__(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,65 @@
+import random
+import pytest
+import networkx as nx
+from heartrunner.landmarks import Landmarks, dijkstra
+from benchmarks.synthetic import grid_network, planar_network, random_patients
+
+
+def length(network, path):
+    total = 0.0
+    for u, v in zip(path, path[1:]):
+        total += min(
+            network.lengths[slot] for slot in range(network.offsets[u], network.offsets[u+1])
+            if network.targets[slot] == v
+        )
+    return total
+
+
+@pytest.mark.parametrize("network", [grid_network(30, seed=2), planar_network(30, seed=2)])
+def test_alt_matches_dijkstra(network):
+    landmarks = Landmarks.build(network, n=8)
+    rng = random.Random(3)
+    for _ in range(10):
+        source = rng.randrange(len(network))
+        dist = dijkstra(network, [source])
+        for target in rng.sample(range(len(network)), 10):
+            if dist[target] == float("inf"):
+                with pytest.raises(nx.NetworkXNoPath):
+                    landmarks.astar(source, target)
+                continue
+            path = landmarks.astar(source, target)
+            assert path[0] == source and path[-1] == target
+            assert length(network, path) == pytest.approx(dist[target], rel=1e-6)
+
+
+def test_alt_matches_search_in_a_box():
+    network = grid_network(30, seed=4)
+    patients = random_patients(network, 4, seed=5)
+    landmarks = Landmarks.build(network, n=8)
+    for patient in patients:
+        lengths = []
+        for index in (None, landmarks):
+            network.landmarks = index
+            pf = network.pathfinder(patient, kilometers=0.5)
+            target = pf.get_node(patient.intersection_id)
+            sources = random.Random(patient.id).sample(sorted(pf.get_nodes(), key=lambda node: node.id), 10)
+            lengths.append([pf._to_path(pf._astar(source, target)).length for source in sources])
+        assert lengths[1] == pytest.approx(lengths[0], rel=1e-6)
+    network.landmarks = None
+
+
+def test_load_checks_the_network(tmp_path):
+    network = grid_network(20, seed=0)
+    path = tmp_path / "landmarks.bin"
+    Landmarks.build(network, n=4).save(path)
+    loaded = Landmarks.load(path, network)
+    assert loaded.landmarks == Landmarks.build(network, n=4).landmarks
+
+    # Same size, other streets
+    with pytest.raises(ValueError):
+        Landmarks.load(path, grid_network(20, seed=1))
+    # Same streets, one length changed
+    changed = grid_network(20, seed=0)
+    changed.lengths[0] *= 2
+    with pytest.raises(ValueError):
+        Landmarks.load(path, changed)
@@ -0,0 +1,65 @@
+from heartrunner.types import Runner
+from heartrunner.parallel import ParallelPathfinder
+from benchmarks.synthetic import grid_network, random_runners, random_patients
+
+
+def signature(tasks):
+    return [
+        (task.runner.id, task.patient_path.node_ids(),
+         [(aed_path.aed.id, aed_path.node_ids()) for aed_path in task.aed_paths])
+        for task in tasks
+    ]
+
+
+def pathfinder(side, seed):
+    network = grid_network(side, seed=seed)
+    patients = random_patients(network, 4, seed=seed + 1)
+    pf = network.pathfinders(patients)[0]
+    for runner in random_runners(network, len(network) // 5, seed=seed + 2):
+        pf.add_runner(runner)
+    return pf, patients
+
+
+def serial(pf, patients):
+    return [
+        signature(pf.for_patient(patient).calculate_tasks(n_runners=5, n_aeds=2, multi_target=True))
+        for patient in patients
+    ]
+
+
+def test_pools_side_by_side():
+    pf_a, patients_a = pathfinder(20, seed=0)
+    pf_b, patients_b = pathfinder(24, seed=10)
+    with ParallelPathfinder(pf_a, workers=2) as a, ParallelPathfinder(pf_b, workers=2) as b:
+        # b starts its workers after a, each must still route on its own graph
+        results_b = b.calculate_tasks_batch(patients_b, n_runners=5, n_aeds=2)
+        results_a = a.calculate_tasks_batch(patients_a, n_runners=5, n_aeds=2)
+    assert [signature(tasks) for tasks in results_a] == serial(pf_a, patients_a)
+    assert [signature(tasks) for tasks in results_b] == serial(pf_b, patients_b)
+
+
+def test_close_keeps_other_pool():
+    pf_a, patients_a = pathfinder(20, seed=0)
+    pf_b, patients_b = pathfinder(24, seed=10)
+    b = ParallelPathfinder(pf_b, workers=1)
+    with ParallelPathfinder(pf_a, workers=1) as a:
+        b.start()
+        a.calculate_tasks_batch(patients_a, n_runners=5, n_aeds=2)
+    # a is closed before b forked its worker
+    results_b = b.calculate_tasks_batch(patients_b, n_runners=5, n_aeds=2)
+    b.close()
+    assert [signature(tasks) for tasks in results_b] == serial(pf_b, patients_b)
+
+
+def test_changes_reach_the_workers():
+    pf, patients = pathfinder(20, seed=0)
+    with ParallelPathfinder(pf, workers=2) as parallel:
+        parallel.calculate_tasks_batch(patients, n_runners=5, n_aeds=2)
+        # A runner at the first patient and another moved onto the second
+        pf.add_runner(Runner(10**6, speed=3.0, intersection_id=patients[0].intersection_id))
+        moved = pf.get_runners()[0]
+        pf.move_runner(moved.id, patients[1].intersection_id)
+        results = parallel.calculate_tasks_batch(patients, n_runners=5, n_aeds=2)
+    assert results[0][0].runner.id == 10**6
+    assert moved.id in {task.runner.id for task in results[1]}
+    assert [signature(tasks) for tasks in results] == serial(pf, patients)
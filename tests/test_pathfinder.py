@@ -0,0 +1,71 @@
+import pytest
+from heartrunner.cache import RouteCache
+from heartrunner.pathfinder import dijkstra
+from benchmarks.synthetic import grid_network, random_runners, random_patients
+
+
+def pathfinder(cache=None):
+    network = grid_network(20, seed=0)
+    patient = random_patients(network, 1, seed=1)[0]
+    pf = network.pathfinder(patient, cache=cache)
+    for runner in random_runners(network, len(network) // 5, seed=2):
+        pf.add_runner(runner)
+    return pf
+
+
+def test_dijkstra_without_targets_to_find():
+    graph = {1: [(2, 1.0)], 2: [(1, 1.0), (3, 1.0)], 3: [(2, 1.0)]}
+    dist, _ = dijkstra(graph.__getitem__, 1, targets={3}, n_targets=0)
+    assert 3 not in dist
+
+
+@pytest.mark.parametrize("cache", [None, RouteCache()])
+def test_multi_target_without_aeds(cache):
+    pf = pathfinder(cache)
+    tasks = pf.calculate_tasks(n_runners=5, n_aeds=0, multi_target=True)
+    assert len(tasks) == 5
+    assert all(task.aed_paths == [] for task in tasks)
+    assert all(task.aed_paths == [] for task in pf.calculate_tasks(n_runners=5, n_aeds=0))
+
+
+def test_legacy_tasks_without_runner_limit():
+    pf = pathfinder()
+    tasks = pf.calculate_tasks(n_aeds=1)
+    assert len(tasks) == len(pf.calculate_tasks(n_aeds=1, multi_target=True)) > 0
+
+
+def test_network_view_is_read_only():
+    pf = pathfinder()
+    node = pf.get_nodes()[0]
+    with pytest.raises(TypeError, match="read-only"):
+        pf.add_node(node)
+    with pytest.raises(TypeError, match="read-only"):
+        pf.add_edge(pf.get_edges()[0])
+
+
+def order(tasks):
+    return [
+        (round(task.patient_latency, 6), [round(latency, 6) for latency in task.aed_latencies])
+        for task in tasks
+    ]
+
+
+def test_iter_tasks_matches_calculate_tasks():
+    for seed in range(3):
+        network = grid_network(20, seed=seed)
+        for patient in random_patients(network, 3, seed=seed + 1):
+            pf = network.pathfinder(patient)
+            for runner in random_runners(network, 60, seed=seed + 2):
+                pf.add_runner(runner)
+            every = sorted(pf.calculate_tasks(n_aeds=2), key=lambda task: task.patient_latency)
+            streamed = list(pf.iter_tasks(n_runners=8, n_aeds=2))
+            assert order(streamed) == order(every[:8])
+            assert pf.tasks == streamed
+            assert order(pf.iter_tasks(n_aeds=2)) == order(every)
+
+
+def test_iter_tasks_deadline_keeps_a_prefix():
+    pf = pathfinder()
+    every = order(pf.iter_tasks(n_aeds=2))
+    found = order(pf.iter_tasks(n_aeds=2, deadline=0.0))
+    assert found == every[:len(found)]
@@ -0,0 +1,50 @@
+import copy
+import pickle
+import pytest
+from heartrunner.pathfinder import AEDPath, Path
+from benchmarks.synthetic import grid_network, random_runners, random_patients
+
+
+def tasks():
+    network = grid_network(20, seed=0)
+    patient = random_patients(network, 1, seed=1)[0]
+    pf = network.pathfinder(patient)
+    for runner in random_runners(network, len(network) // 5, seed=2):
+        pf.add_runner(runner)
+    return pf.calculate_tasks(n_runners=5, n_aeds=2, multi_target=True)
+
+
+def same(a: AEDPath, b: AEDPath):
+    return (
+        a.aed.id == b.aed.id and a.length == b.length and a.node_ids() == b.node_ids() and
+        [street.id for street in a.streets] == [street.id for street in b.streets]
+    )
+
+
+def test_aed_path_copies():
+    aed_path = tasks()[0].aed_paths[0]
+    for copied in (copy.copy(aed_path), copy.deepcopy(aed_path)):
+        assert isinstance(copied, AEDPath) and copied.is_aed_path()
+        assert same(copied, aed_path)
+    assert copy.copy(aed_path).path is aed_path.path
+
+
+def test_aed_path_pickles():
+    aed_path = tasks()[0].aed_paths[0]
+    loaded = pickle.loads(pickle.dumps(aed_path))
+    assert isinstance(loaded, AEDPath) and isinstance(loaded.path, Path)
+    assert same(loaded, aed_path)
+
+
+def test_task_round_trip():
+    for task in tasks():
+        for loaded in (copy.deepcopy(task), pickle.loads(pickle.dumps(task))):
+            assert loaded.runner.id == task.runner.id
+            assert loaded.patient_path.node_ids() == task.patient_path.node_ids()
+            assert all(same(a, b) for a, b in zip(loaded.aed_paths, task.aed_paths))
+
+
+def test_missing_attribute():
+    aed_path = tasks()[0].aed_paths[0]
+    with pytest.raises(AttributeError):
+        aed_path.missing
@@ -0,0 +1,62 @@
+import json
+from heartrunner import serialize
+from heartrunner.types import Intersection, Streetsegment
+from heartrunner.serialize import DispatchWriter
+from benchmarks.synthetic import grid_network, random_runners, random_patients
+
+
+def line(*coordinates):
+    return json.dumps({"type": "LineString", "coordinates": [list(c) for c in coordinates]})
+
+
+def street(id, geometry, length=100.0):
+    return Streetsegment(id, Intersection((38.9, -77.0), 1), Intersection((38.91, -77.0), 2), length, geometry)
+
+
+def feature(writer, s):
+    return json.loads(writer._street(s))
+
+
+def test_reloaded_street_is_not_stale():
+    writer = DispatchWriter()
+    old = street(7, line((-77.0, 38.9), (-77.0, 38.91)))
+    assert feature(writer, old)["geometry"]["coordinates"][0] == [-77.0, 38.9]
+    new = street(7, line((-77.1, 38.8), (-77.0, 38.91)))
+    assert feature(writer, new)["geometry"]["coordinates"][0] == [-77.1, 38.8]
+    longer = street(7, new._geometry, length=250.0)
+    assert feature(writer, longer)["properties"]["length"] == 250.0
+
+
+def test_cache_is_bounded_and_clears():
+    writer = DispatchWriter(max_streets=3)
+    streets = [street(k, line((-77.0, 38.9 + k), (-77.0, 39.0 + k))) for k in range(5)]
+    for s in streets[:3]:
+        writer._street(s)
+    # Reading the oldest keeps it, the next oldest goes
+    writer._street(streets[0])
+    writer._street(streets[3])
+    assert list(writer._streets) == [2, 0, 3]
+    for s in streets:
+        writer._street(s)
+    assert len(writer._streets) == 3
+    writer.clear()
+    assert len(writer._streets) == 0
+    unkept = DispatchWriter(max_streets=0)
+    unkept._street(streets[0])
+    assert len(unkept._streets) == 0
+
+
+def test_writers_are_owned_by_callers():
+    assert not hasattr(serialize, "dispatch") and not hasattr(serialize, "_writer")
+    network = grid_network(15, seed=0)
+    patient = random_patients(network, 1, seed=1)[0]
+    pf = network.pathfinder(patient)
+    for runner in random_runners(network, len(network) // 5, seed=2):
+        pf.add_runner(runner)
+    tasks = pf.calculate_tasks(n_runners=5, n_aeds=2, multi_target=True)
+    first, second = DispatchWriter(), DispatchWriter()
+    payload = first.dispatch(pf, tasks)
+    assert payload == first.dispatch(pf, tasks) == second.dispatch(pf, tasks)
+    assert b"".join(first.iter_dispatch(pf, tasks)) == payload
+    collection = json.loads(payload)
+    assert collection["features"][0]["properties"]["type"] == "Patient"
@@ -0,0 +1,75 @@
+import time
+import pytest
+from heartrunner.types import Patient
+from heartrunner.memory import MemoryHeartrunnerDB
+from heartrunner.simulation import Simulation, Incident, poisson_incidents
+from benchmarks.synthetic import grid_network
+
+
+class SlowDB:
+    # A database whose fetches wait on I/O for a while, as neo4j does
+    def __init__(self, db: MemoryHeartrunnerDB, delay: float):
+        self.db = db
+        self.delay = delay
+
+    def __getattr__(self, name: str):
+        return getattr(self.db, name)
+
+    def get_pathfinder(self, patient: Patient):
+        time.sleep(self.delay)
+        return self.db.get_pathfinder(patient)
+
+
+def store():
+    db = MemoryHeartrunnerDB(grid_network(10, seed=0))
+    db.generate_runners(20, seed=1)
+    return db
+
+
+def burst(db, n):
+    ids = db.get_intersection_ids()
+    return [Incident(Patient(id=k + 1, intersection_id=ids[k * 7]), 0.0) for k in range(n)]
+
+
+def test_dispatchers_run_side_by_side():
+    latencies = {}
+    for concurrency in (1, 4):
+        incidents = burst(store(), 4)
+        report = Simulation(SlowDB(store(), 0.1), incidents, concurrency=concurrency).run()
+        assert report.failed == 0
+        latencies[concurrency] = max(incident.latency() for incident in incidents)
+    # One dispatcher queues the burst, four fetch at the same time
+    assert latencies[1] >= 0.4
+    assert latencies[4] < 0.3
+
+
+def test_service_times_are_wall_clock():
+    incidents = burst(store(), 6)
+    report = Simulation(SlowDB(store(), 0.05), incidents, concurrency=3).run()
+    for incident in incidents:
+        assert incident.service() >= 0.05
+        assert incident.start >= incident.arrival
+    # Three at a time, the last three wait for a dispatcher
+    assert sorted(incident.queueing() for incident in incidents)[-1] >= 0.05
+    assert report.summary()["max_queue"] == 6
+
+
+def test_events_during_dispatch_are_applied_on_time():
+    db = store()
+    ids = db.get_intersection_ids()
+    incidents = [Incident(Patient(id=1, intersection_id=ids[0]), 0.0),
+                 Incident(Patient(id=2, intersection_id=ids[1]), 0.02)]
+    # The second arrives while the first is routed and waits for it
+    Simulation(SlowDB(db, 0.1), incidents, concurrency=1, busy=0.05).run()
+    assert incidents[1].start == pytest.approx(incidents[0].finish, abs=0.02)
+    assert incidents[1].queueing() >= 0.05
+    # Responders of both are released again
+    assert db._unavailable == set()
+
+
+def test_poisson_stream():
+    db = store()
+    incidents = poisson_incidents(5, 2, db.get_intersection_ids(), seed=2)
+    summary = Simulation(db, incidents, concurrency=2, move_rate=5, tick=0.5, seed=3).run().summary()
+    assert summary["incidents"] == len(incidents) and summary["failed"] == 0
+    assert summary["runner_moves"] > 0
@@ -0,0 +1,34 @@
+import random
+from heartrunner.spatial import SpatialIndex, haversine
+
+
+def brute_force(points, coords, k):
+    return sorted((haversine(coords, p), key) for key, p in points.items())[:k]
+
+
+def test_nearest_across_a_state():
+    # Points over six degrees of latitude, the first one at the southern
+    # edge fixes the projection
+    rng = random.Random(0)
+    points = {0: (36.0, -80.0)}
+    for key in range(1, 3000):
+        points[key] = (rng.uniform(36.0, 42.0), rng.uniform(-84.0, -76.0))
+    index = SpatialIndex(cell_size=500)
+    for key, coords in points.items():
+        index.insert(key, coords)
+    for _ in range(50):
+        coords = (rng.uniform(40.0, 42.0), rng.uniform(-84.0, -76.0))
+        found = index.nearest(coords, k=5)
+        assert [key for _, key in found] == [key for _, key in brute_force(points, coords, 5)]
+
+
+def test_within_matches_brute_force():
+    rng = random.Random(1)
+    points = {key: (rng.uniform(38.8, 39.0), rng.uniform(-77.1, -76.9)) for key in range(2000)}
+    index = SpatialIndex(cell_size=250)
+    for key, coords in points.items():
+        index.insert(key, coords)
+    for _ in range(20):
+        coords = (rng.uniform(38.8, 39.0), rng.uniform(-77.1, -76.9))
+        expected = [(d, key) for d, key in brute_force(points, coords, len(points)) if d <= 800]
+        assert [key for _, key in index.within(coords, 800)] == [key for _, key in expected]